@@ -0,0 +1,221 @@
+"""
+端到端基准：在本地回放服务器上运行完整的 biliq_daily.py / biliq_email.py 流程，不访问网络。
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --cards 500 --latency 0.02 --bandwidth 2000000
+    python benchmarks/bench_e2e.py --corpus recorded.jsonl.gz --json > e2e.json
+    python benchmarks/bench_e2e.py --scenario email_cold --recipients 300
+    python benchmarks/bench_e2e.py --slow-host i0.hdslb.com=2.0    # 图片主机变慢时的对冲下载
+
+每个场景在临时目录中以子进程运行脚本 (与实际使用方式一致)，报告耗时、退出码、
+脚本发出的接口/图片请求数、传输字节数和 SMTP 收到的邮件数。
+场景包括冷启动、再次运行 (状态库和图片仓库已就绪)、全量回溯及其中断后的恢复、邮件发送 (逐题和合集)，
+以及 -412 / -352 / 62002 错误码。每个场景的退出码和请求数与 expectations() 中的预期比较
+(例如再次运行的日常同步只能发一次接口请求、已完成的回溯不发任何请求)，有不符合预期的场景时以退出码 1 结束。
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import generate_cards, load_corpus  # noqa: E402
+from replay_server import PAGE_SIZE, ReplayServer, ReplayState, parse_host_latency  # noqa: E402
+
+DAILY_SCRIPT = os.path.join(REPO_DIR, "biliq_daily.py")
+EMAIL_SCRIPT = os.path.join(REPO_DIR, "biliq_email.py")
+
+# (场景名, 脚本, 参数, 错误码序列, 运行前是否清空工作目录)
+SCENARIOS = [
+    ("daily_cold", DAILY_SCRIPT, [], [], True),
+    ("daily_warm", DAILY_SCRIPT, [], [], False),
+    ("backfill_cold", DAILY_SCRIPT, ["--backfill"], [], True),
+    ("backfill_warm", DAILY_SCRIPT, ["--backfill"], [], False),
+    ("backfill_profile", DAILY_SCRIPT, ["--backfill", "--profile"], [], True),
+    ("email_cold", EMAIL_SCRIPT, ["--once"], [], True),
+    ("email_warm", EMAIL_SCRIPT, ["--once"], [], False),
+    ("email_digest_cold", EMAIL_SCRIPT, ["--once", "--digest"], [], True),
+    ("email_digest_warm", EMAIL_SCRIPT, ["--once", "--digest"], [], False),
+    ("daily_error_-412", DAILY_SCRIPT, [], [-412], True),
+    ("daily_error_-352", DAILY_SCRIPT, [], [-352], True),
+    ("daily_error_62002", DAILY_SCRIPT, [], [62002], True),
+    ("backfill_resume_after_-412", DAILY_SCRIPT, ["--backfill"], [0, 0, -412], True),
+    ("backfill_resume", DAILY_SCRIPT, ["--backfill"], [], False),
+]
+
+ANY = (0, None)
+SOME = (1, None)
+
+
+def expectations(pages, recipients):
+    """
+    每个场景的预期结果：整数要求相等，(下限, 上限) 要求落在区间内 (None 为不限)。
+    pages 为语料的总页数，recipients 为收件人数。图片请求数会因对冲请求而变化，只检查是否为 0。
+    """
+    return {
+        'daily_cold': {'exit_code': 0, 'api_requests': 1, 'api_errors': 0, 'image_requests': SOME},
+        'daily_warm': {'exit_code': 0, 'api_requests': 1, 'api_errors': 0, 'image_requests': 0},
+        'backfill_cold': {'exit_code': 0, 'api_requests': pages, 'api_errors': 0, 'image_requests': SOME},
+        'backfill_warm': {'exit_code': 0, 'api_requests': 0, 'image_requests': 0},
+        'backfill_profile': {'exit_code': 0, 'api_requests': pages, 'api_errors': 0, 'image_requests': SOME},
+        'email_cold': {'exit_code': 0, 'api_requests': 1, 'image_requests': SOME, 'smtp_messages': recipients},
+        'email_warm': {'exit_code': 0, 'api_requests': (0, 1), 'image_requests': 0, 'smtp_messages': 0},
+        'email_digest_cold': {'exit_code': 0, 'api_requests': SOME, 'image_requests': SOME,
+                              'smtp_messages': recipients},
+        'email_digest_warm': {'exit_code': 0, 'api_requests': (0, 1), 'image_requests': 0, 'smtp_messages': 0},
+        'daily_error_-412': {'exit_code': 1, 'api_requests': 1, 'api_errors': 1, 'image_requests': 0},
+        'daily_error_-352': {'exit_code': 1, 'api_requests': 1, 'api_errors': 1, 'image_requests': 0},
+        'daily_error_62002': {'exit_code': 1, 'api_requests': 1, 'api_errors': 1, 'image_requests': 0},
+        # 前两页已写入，游标停在第三页
+        'backfill_resume_after_-412': {'exit_code': 1, 'api_requests': 3, 'api_errors': 1, 'image_requests': SOME},
+        'backfill_resume': {'exit_code': 0, 'api_requests': pages - 2, 'api_errors': 0,
+                            'image_requests': SOME if pages > 2 else ANY},
+    }
+
+
+def check_result(result, expected):
+    """返回不符合预期的项的说明列表。"""
+    failures = []
+    for key, want in expected.items():
+        got = result[key]
+        if isinstance(want, tuple):
+            low, high = want
+            if got < low or (high is not None and got > high):
+                failures.append(f"{key}={got}，预期 {low}~{'' if high is None else high}")
+        elif got != want:
+            failures.append(f"{key}={got}，预期 {want}")
+    return failures
+
+
+def write_config(workdir, server, uid, recipients=1):
+    smtp_host, smtp_port = server.smtp_address
+    config = {
+        "TARGET_UID": uid,
+        "OUTPUT_MD_FILE": "bench_dynamics.md",
+        "IMAGE_DIR": "bili_images",
+        "API_BASE_URL": server.base_url,
+        "CDN_BASE_URL": server.base_url,
+        "RATE_LIMIT": 1000,
+        "RATE_BURST": 1000,
+        "BACKFILL_PAGE_INTERVAL": 0,
+        "SYNC_MIN_INTERVAL": 0, # 再次运行的场景测量的是增量同步本身，不让本地预检查跳过
+        "EMAIL": {
+            "sender": "bench@example.com",
+            "password": "bench",
+            "receiver": ["reader@example.com"] + [f"reader{i}@example.com" for i in range(1, recipients)],
+            "smtp_server": smtp_host,
+            "smtp_port": smtp_port,
+            "smtp_ssl": False,
+        },
+    }
+    with open(os.path.join(workdir, "config.json"), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def reset_workdir(workdir, server, uid, recipients=1):
+    for name in os.listdir(workdir):
+        path = os.path.join(workdir, name)
+        if os.path.isdir(path) and not os.path.islink(path): shutil.rmtree(path)
+        else: os.remove(path)
+    write_config(workdir, server, uid, recipients)
+
+
+def run_scenario(server, workdir, uid, name, script, args, errors, fresh, verbose=False, recipients=1):
+    if fresh: reset_workdir(workdir, server, uid, recipients)
+    server.state.stats.reset()
+    server.state.set_errors(errors)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, script] + args, cwd=workdir, capture_output=True, text=True,
+                          encoding='utf-8', errors='replace', timeout=600)
+    elapsed = time.perf_counter() - start
+    server.state.set_errors([])
+    if verbose:
+        sys.stderr.write(f"--- {name} ---\n{proc.stdout}{proc.stderr}\n")
+    stats = server.state.stats.snapshot()
+    return {
+        'scenario': name,
+        'exit_code': proc.returncode,
+        'seconds': round(elapsed, 3),
+        'api_requests': stats.get('api_requests', 0),
+        'api_errors': stats.get('api_errors', 0),
+        'image_requests': stats.get('image_requests', 0),
+        'image_not_modified': stats.get('image_not_modified', 0),
+        'http_bytes': stats.get('http_bytes_sent', 0),
+        'smtp_messages': stats.get('smtp_messages', 0),
+        'smtp_bytes': stats.get('smtp_bytes_received', 0),
+    }
+
+
+def print_table(results):
+    columns = ('scenario', 'exit_code', 'seconds', 'api_requests', 'api_errors', 'image_requests',
+               'http_bytes', 'smtp_messages', 'smtp_bytes')
+    widths = [max(len(col), *(len(str(r[col])) for r in results)) for col in columns]
+    print("  ".join(col.ljust(w) for col, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[col]).ljust(w) for col, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端基准 (离线回放)")
+    parser.add_argument("--corpus", help="录制的语料 (JSONL，可 .gz)，默认使用合成卡片")
+    parser.add_argument("--cards", type=int, default=120, help="合成卡片数量")
+    parser.add_argument("--uid", type=int, default=688379639)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的附加延迟 (秒)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个连接的限速 (字节/秒)")
+    parser.add_argument("--slow-host", action='append', help="图片主机的额外延迟，如 i0.hdslb.com=2.0 (可重复)")
+    parser.add_argument("--recipients", type=int, default=1, help="邮件收件人数量")
+    parser.add_argument("--scenario", action='append', help="只运行指定场景 (可重复)")
+    parser.add_argument("--json", action='store_true', help="以 JSON 输出结果")
+    parser.add_argument("--verbose", action='store_true', help="把脚本输出写到 stderr")
+    args = parser.parse_args()
+
+    cards = load_corpus(args.corpus) if args.corpus else generate_cards(args.cards, uid=args.uid)
+    state = ReplayState(cards, args.page_size, args.latency, args.bandwidth, host_latency=parse_host_latency(args.slow_host))
+    scenarios = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario]
+
+    expected = expectations(math.ceil(len(cards) / args.page_size), args.recipients)
+    order = [s[0] for s in SCENARIOS]
+    workdir = tempfile.mkdtemp(prefix="biliq-e2e-")
+    results = []
+    try:
+        with ReplayServer(state) as server:
+            previous = None
+            for name, script, script_args, errors, fresh in scenarios:
+                result = run_scenario(server, workdir, args.uid, name, script, script_args, errors, fresh,
+                                      args.verbose, args.recipients)
+                # 不清空工作目录的场景依赖前一个场景留下的状态，前一个场景没有运行时不检查
+                index = order.index(name)
+                if fresh or (index and previous == order[index - 1]):
+                    result['failures'] = check_result(result, expected.get(name, {}))
+                results.append(result)
+                previous = name
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    failed = [r for r in results if r.get('failures')]
+
+    if args.json:
+        print(json.dumps({'cards': len(cards), 'latency': args.latency, 'bandwidth': args.bandwidth,
+                          'results': results, 'ok': not failed}, ensure_ascii=False, indent=2))
+    else:
+        print(f"卡片: {len(cards)}  每页: {args.page_size}  延迟: {args.latency}s  "
+              f"限速: {args.bandwidth or '不限'}")
+        print_table(results)
+        for r in failed:
+            print(f"不符合预期: {r['scenario']}: " + "; ".join(r['failures']))
+        unchecked = [r['scenario'] for r in results if 'failures' not in r]
+        if unchecked: print(f"未检查 (依赖的前一个场景没有运行): {', '.join(unchecked)}")
+        if not failed: print(f"已检查的 {len(results) - len(unchecked)} 个场景全部符合预期")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
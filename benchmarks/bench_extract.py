@@ -0,0 +1,87 @@
+"""
+卡片提取吞吐基准。
+
+    python benchmarks/bench_extract.py                      # 5000 张合成卡片
+    python benchmarks/bench_extract.py --cards 20000
+    python benchmarks/bench_extract.py --corpus recorded.jsonl.gz
+
+对每个可用的 JSON 后端 (json / orjson) 报告每秒处理的卡片数，以及提取过程的内存峰值、
+保留的 QuestionRecord 占用和分配的内存块数。
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import biliq_extract  # noqa: E402
+from corpus import generate_cards, load_corpus, paginate  # noqa: E402
+
+
+def backends():
+    yield "json", json.loads
+    try:
+        import orjson
+        yield "orjson", orjson.loads
+    except ImportError:
+        pass
+
+
+def run_extraction(pages, loads):
+    records = []
+    for page in pages:
+        records.extend(biliq_extract.extract_questions(page, loads=loads))
+    return records
+
+
+def bench_throughput(pages, card_count, loads, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = run_extraction(pages, loads)
+        best = min(best, time.perf_counter() - start)
+    return card_count / best, len(records), best
+
+
+def bench_allocations(pages, loads):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    records = run_extraction(pages, loads)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    retained = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    return peak, retained, blocks, len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="卡片提取吞吐基准")
+    parser.add_argument("--corpus", help="录制的语料 (JSONL / JSONL.gz)")
+    parser.add_argument("--cards", type=int, default=5000, help="合成卡片数量 (未指定 --corpus 时)")
+    parser.add_argument("--page-size", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cards = load_corpus(args.corpus) if args.corpus else generate_cards(args.cards)
+    pages = paginate(cards, args.page_size)
+    source = args.corpus or "合成语料 (seed 固定)"
+    print(f"语料: {source}, {len(cards)} 张卡片, {len(pages)} 页; 默认 JSON 后端: {biliq_extract.JSON_BACKEND}")
+
+    for name, loads in backends():
+        # 每个后端使用独立的副本，避免 dict 形式的 card 被其他后端的结果影响
+        backend_pages = copy.deepcopy(pages)
+        cards_per_sec, matched, seconds = bench_throughput(backend_pages, len(cards), loads, args.repeat)
+        peak, retained, blocks, _ = bench_allocations(backend_pages, loads)
+        print(f"[{name:6}] {cards_per_sec:12,.0f} 张/秒  ({seconds * 1000:.1f} ms, 匹配 {matched} 题)  "
+              f"峰值 {peak / 1024:,.0f} KiB, 保留 {retained / 1024:,.0f} KiB "
+              f"({retained / max(matched, 1):,.0f} B/题), 新增内存块 {blocks:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+感知哈希区分度检查。
+
+    python benchmarks/bench_phash.py                        # 使用仓库中的 bili_images/*.png
+    python benchmarks/bench_phash.py path/to/images --max-distance 4
+
+对目录中的每张图片 (视为互不相同的题目) 计算 biliq_phash 的哈希，并生成几种重新上传时常见的副本
+(缩小一半、缩小后放大、JPEG 重新压缩、email 规格的 WebP)。报告不同题目之间的最小距离、
+副本与原图的最大距离以及每张图片的哈希耗时。不同题目的距离不超过阈值 (会被误报为重复)，
+或副本的距离超过阈值 (真正的重复会被漏掉) 时以退出码 1 结束。
+"""
+import argparse
+import glob
+import io
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import biliq_phash  # noqa: E402
+
+
+def copies(path):
+    """生成 (名称, 图片字节) 形式的副本。"""
+    Image = biliq_phash.Image
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        width, height = img.size
+        variants = [
+            ('half', img.resize((width // 2, height // 2)), 'PNG', {}),
+            ('upscaled', img.resize((width // 2, height // 2)).resize((width, height)), 'PNG', {}),
+            ('jpeg60', img, 'JPEG', {'quality': 60}),
+            ('webp1280', img.resize((1280, height * 1280 // width)), 'WEBP', {'quality': 80}),
+        ]
+        for name, variant, fmt, options in variants:
+            buffer = io.BytesIO()
+            variant.save(buffer, fmt, **options)
+            yield name, buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感知哈希区分度检查")
+    parser.add_argument("image_dir", nargs='?', default=os.path.join(ROOT, "bili_images"))
+    parser.add_argument("--max-distance", type=int, default=biliq_phash.PHASH_MAX_DISTANCE)
+    args = parser.parse_args()
+
+    if not biliq_phash.available():
+        print("错误：需要 numpy 和 Pillow")
+        return 1
+    paths = sorted(glob.glob(os.path.join(args.image_dir, "*.png")) + glob.glob(os.path.join(args.image_dir, "*.jpg")))
+    if len(paths) < 2:
+        print(f"错误：{args.image_dir} 中至少需要两张图片")
+        return 1
+
+    start = time.perf_counter()
+    hashes = {path: biliq_phash.image_phash(path) for path in paths}
+    per_image = (time.perf_counter() - start) / len(paths)
+
+    distinct = sorted((bin(hashes[a] ^ hashes[b]).count('1'), os.path.basename(a), os.path.basename(b))
+                      for a, b in itertools.combinations(paths, 2))
+    copy_distances = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in paths:
+            for name, data in copies(path):
+                copy_path = os.path.join(tmp, name)
+                with open(copy_path, 'wb') as f:
+                    f.write(data)
+                distance = bin(biliq_phash.image_phash(copy_path) ^ hashes[path]).count('1')
+                copy_distances.append((distance, os.path.basename(path), name))
+    copy_distances.sort(reverse=True)
+
+    print(f"{len(paths)} 张图片，每张哈希耗时 {per_image * 1000:.1f} ms，阈值 {args.max_distance}")
+    print("不同题目的最小距离: " + ", ".join(f"{d} ({a} / {b})" for d, a, b in distinct[:3]))
+    print("副本与原图的最大距离: " + ", ".join(f"{d} ({p} {name})" for d, p, name in copy_distances[:3]))
+
+    failed = False
+    false_positives = [pair for pair in distinct if pair[0] <= args.max_distance]
+    if false_positives:
+        failed = True
+        print(f"失败：{len(false_positives)} 对不同的题目距离不超过阈值，会被误报为疑似重复")
+    missed = [item for item in copy_distances if item[0] > args.max_distance]
+    if missed:
+        failed = True
+        print(f"失败：{len(missed)} 个副本与原图的距离超过阈值，重复上传不会被发现")
+    if not failed:
+        print("通过：不同题目与副本之间的距离被阈值分开")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+启动开销基准：cron 下大多数运行没有新动态，这时的耗时几乎全部是解释器启动、导入和本地检查。
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 --json > startup.json
+
+每一项都在新的子进程中重复运行，报告中位数和最小值 (毫秒)：
+- import_*: 导入 biliq_daily / biliq_email 以及作为参照的 bilibili_api / requests 的耗时；
+- daily_first_request: 从启动 biliq_daily.py 到回放服务器收到第一个接口请求的时间；
+- daily_nothing_new: 状态库已是最新时运行 biliq_daily.py 的总耗时 (只发一次请求)；
+- daily_precheck_skip: 使用默认的 SYNC_MIN_INTERVAL 在间隔内再次运行的总耗时 (只查本地状态库，不发请求)；
+- email_already_sent: 今天的题目已投递后运行 biliq_email.py --once 的总耗时 (不发请求)。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_e2e import DAILY_SCRIPT, EMAIL_SCRIPT, write_config  # noqa: E402
+from corpus import generate_cards  # noqa: E402
+from replay_server import ReplayServer, ReplayState  # noqa: E402
+
+IMPORT_MODULES = ("biliq_daily", "biliq_email", "bilibili_api", "requests")
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def measure_import(module):
+    proc = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module=module)], cwd=REPO_DIR,
+                          capture_output=True, text=True, check=True)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def run_script(server, workdir, script, args=()):
+    """运行脚本，返回 (总耗时, 第一个 HTTP 请求到达的时间或 None, 接口请求数)。"""
+    server.state.stats.reset()
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, script, *args], cwd=workdir, capture_output=True, text=True,
+                          encoding='utf-8', errors='replace', timeout=300)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(script)} 退出码 {proc.returncode}:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+    first = server.state.stats.first("http_requests")
+    return elapsed, (first - start if first is not None else None), server.state.stats.snapshot().get('api_requests', 0)
+
+
+def set_config(workdir, **overrides):
+    """修改工作目录中的 config.json；值为 None 的配置项被删除 (恢复默认值)。"""
+    path = os.path.join(workdir, "config.json")
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config.update(overrides)
+    for key in [key for key, value in overrides.items() if value is None]: del config[key]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def summarize(name, samples, requests=None):
+    samples = [s * 1000 for s in samples if s is not None]
+    result = {'name': name, 'median_ms': round(statistics.median(samples), 1), 'min_ms': round(min(samples), 1),
+              'runs': len(samples)}
+    if requests is not None: result['api_requests'] = requests
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动开销基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--cards", type=int, default=24, help="合成卡片数量")
+    parser.add_argument("--uid", type=int, default=688379639)
+    parser.add_argument("--json", action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = [summarize(f"import_{module}", [measure_import(module) for _ in range(args.repeat)])
+               for module in IMPORT_MODULES]
+
+    # 把语料平移到今天，最新的题目就是“今天的题目”，邮件脚本才能在投递后走本地预检查
+    cards = generate_cards(args.cards, uid=args.uid)
+    shift = int(time.time()) - 60 - cards[0]['desc']['timestamp']
+    for card in cards: card['desc']['timestamp'] += shift
+
+    workdir = tempfile.mkdtemp(prefix="biliq-startup-")
+    try:
+        with ReplayServer(ReplayState(cards)) as server:
+            write_config(workdir, server, args.uid)
+            first_requests = []
+            for _ in range(args.repeat):
+                # 每次都从空状态开始，测的是冷启动到第一个请求的时间
+                for name in os.listdir(workdir):
+                    if name == "config.json": continue
+                    path = os.path.join(workdir, name)
+                    if os.path.isdir(path): shutil.rmtree(path)
+                    else: os.remove(path)
+                first_requests.append(run_script(server, workdir, DAILY_SCRIPT)[1])
+            results.append(summarize("daily_first_request", first_requests))
+
+            runs = [run_script(server, workdir, DAILY_SCRIPT) for _ in range(args.repeat)]
+            results.append(summarize("daily_nothing_new", [r[0] for r in runs], runs[-1][2]))
+
+            set_config(workdir, SYNC_MIN_INTERVAL=None)
+            runs = [run_script(server, workdir, DAILY_SCRIPT) for _ in range(args.repeat)]
+            results.append(summarize("daily_precheck_skip", [r[0] for r in runs], runs[-1][2]))
+
+            run_script(server, workdir, EMAIL_SCRIPT, ["--once"])
+            runs = [run_script(server, workdir, EMAIL_SCRIPT, ["--once"]) for _ in range(args.repeat)]
+            results.append(summarize("email_already_sent", [r[0] for r in runs], runs[-1][2]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({'python': sys.version.split()[0], 'repeat': args.repeat, 'results': results},
+                         ensure_ascii=False, indent=2))
+        return
+    print(f"Python {sys.version.split()[0]}，每项 {args.repeat} 次")
+    for r in results:
+        extra = f"  请求 {r['api_requests']}" if 'api_requests' in r else ""
+        print(f"  {r['name']:<24} 中位数 {r['median_ms']:8.1f} ms  最小 {r['min_ms']:8.1f} ms{extra}")
+
+
+if __name__ == "__main__":
+    main()
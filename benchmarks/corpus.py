@@ -0,0 +1,89 @@
+"""
+基准测试用的动态语料。
+
+load_corpus() 读取录制的语料 (JSONL，可 gzip 压缩，每行是一张原始卡片或一整页 {"cards": [...]})；
+没有录制语料时，generate_cards() 按固定随机种子生成结构与 get_dynamics 返回值一致的合成卡片，
+覆盖 modules / item.pictures / origin 三种结构以及不含 "第 N 题" 的普通动态。
+"""
+import gzip
+import json
+import random
+
+BASE_DYNAMIC_ID = 1062000000000000000
+BASE_TIMESTAMP = 1714000000
+IMAGE_HOSTS = ("i0.hdslb.com", "i1.hdslb.com", "i2.hdslb.com")
+
+
+def _image_url(rng, n):
+    host = rng.choice(IMAGE_HOSTS)
+    return f"https://{host}/bfs/new_dyn/{rng.getrandbits(128):032x}{n}.png"
+
+
+def _question_text(rng, question_number):
+    filler = "想冲高分的同学，这道题需要举出错误反例！今天的题目数二同学不做要求。" * rng.randint(1, 4)
+    return f"26考研每日一题｜第{question_number}题 \n\n{filler}"
+
+
+def generate_cards(count=5000, seed=20250505, uid=688379639, images_per_card=(1, 3)):
+    """生成 count 张合成卡片，按动态 ID 从新到旧排列 (与接口返回顺序一致)，card 字段为 JSON 字符串。"""
+    rng = random.Random(seed)
+    cards = []
+    question_number = count
+    for i in range(count):
+        dynamic_id = BASE_DYNAMIC_ID + (count - i) * 371293
+        timestamp = BASE_TIMESTAMP + (count - i) * 86400
+        pictures = [_image_url(rng, k) for k in range(rng.randint(*images_per_card))]
+        kind = rng.random()
+        if kind < 0.2:
+            # 普通动态 (不含 "第 N 题")
+            card = {'item': {'description': "今天的直播回放已上传，欢迎大家复习。",
+                             'pictures': [{'img_src': url} for url in pictures], 'upload_time': timestamp}}
+        elif kind < 0.5:
+            card = {'modules': {'module_dynamic': {
+                'desc': {'text': _question_text(rng, question_number)},
+                'major': {'type': 'MAJOR_TYPE_DRAW', 'draw': {'items': [{'src': url} for url in pictures]}}}}}
+            question_number -= 1
+        elif kind < 0.9:
+            card = {'item': {'description': _question_text(rng, question_number),
+                             'pictures': [{'img_src': url, 'img_width': 1080, 'img_height': 1440} for url in pictures],
+                             'upload_time': timestamp}}
+            question_number -= 1
+        else:
+            origin = {'item': {'description': _question_text(rng, question_number),
+                               'pictures': [{'img_src': url} for url in pictures]}}
+            card = {'item': {'content': "转发动态"}, 'origin': json.dumps(origin, ensure_ascii=False)}
+            question_number -= 1
+        cards.append({
+            'desc': {'uid': uid, 'type': 2, 'dynamic_id': dynamic_id, 'dynamic_id_str': str(dynamic_id),
+                     'timestamp': timestamp},
+            'card': json.dumps(card, ensure_ascii=False),
+            'extend_json': "{}",
+        })
+    return cards
+
+
+def load_corpus(path):
+    """读取录制的语料，返回卡片列表。"""
+    opener = gzip.open if path.endswith('.gz') else open
+    cards = []
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            record = json.loads(line)
+            if isinstance(record.get('cards'), list): cards.extend(record['cards'])
+            elif 'raw' in record: cards.append(record['raw'])
+            else: cards.append(record)
+    return cards
+
+
+def paginate(cards, page_size=12):
+    """把卡片按接口的分页方式切成页，next_offset 为下一页第一条之前的动态 ID。"""
+    pages = []
+    for start in range(0, len(cards), page_size):
+        page_cards = cards[start:start + page_size]
+        has_more = start + page_size < len(cards)
+        pages.append({'has_more': 1 if has_more else 0,
+                      'next_offset': int(page_cards[-1]['desc']['dynamic_id_str']) if has_more else 0,
+                      'cards': page_cards})
+    return pages
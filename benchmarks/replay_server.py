@@ -0,0 +1,352 @@
+"""
+离线回放服务器：代替 api.bilibili.com 和 i0/i1/i2.hdslb.com，另附一个最简 SMTP 收件服务。
+
+    python benchmarks/replay_server.py --port 8765 --smtp-port 8025
+    python benchmarks/replay_server.py --corpus recorded.jsonl.gz --latency 0.05 --errors -412,0,0
+
+HTTP 接口：
+- /dynamic_svr/v1/dynamic_svr/space_history?host_uid=..&offset_dynamic_id=..
+  按 offset_dynamic_id 返回下一页卡片 (格式与B站接口一致，card 为 JSON 字符串)。
+  --errors 给出依次返回的错误码序列 (0 表示正常返回)，用完后恢复正常，例如 -412,-352,62002。
+- /<host>/<path>  返回由路径决定的固定图片字节 (同一路径每次相同，i0/i1/i2 等镜像主机返回相同内容)，
+  支持 ETag / 304。带 @..w_..h_..q.webp 后缀的变体请求返回较小的数据。
+  --slow-host i0.hdslb.com=2.0 让指定主机的图片请求额外延迟 (用于测试对冲下载)。
+
+--latency 为每个请求的附加延迟 (秒)，--bandwidth 为每个连接的限速 (字节/秒，0 为不限)。
+服务器统计请求数、字节数和 SMTP 收到的邮件数，可通过 /__stats 读取 (JSON)。
+SMTP 收件服务接受任意账号密码；ReplayState.smtp_reject 中的收件人返回 550，smtp_tempfail 中的收件人第一次返回 451。
+"""
+import argparse
+import hashlib
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate_cards, load_corpus  # noqa: E402
+
+SPACE_HISTORY_PATH = "/dynamic_svr/v1/dynamic_svr/space_history"
+STATS_PATH = "/__stats"
+PAGE_SIZE = 12
+IMAGE_SIZE = 256 * 1024
+VARIANT_IMAGE_SIZE = 48 * 1024
+PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"  # 让伪图片通过 biliq_imagestore.looks_complete 的完整性检查
+ERROR_MESSAGES = {-412: "请求被拦截", -352: "风控校验失败", -101: "账号未登录", 62002: "稿件不可见"}
+
+
+class ReplayStats:
+    """线程安全的计数器，同时记录每个计数器第一次增加的时刻 (time.perf_counter())。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.first_seen = {}
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.first_seen.setdefault(name, time.perf_counter())
+
+    def first(self, name):
+        """计数器 name 第一次增加的时刻；从未增加时返回 None。"""
+        with self._lock:
+            return self.first_seen.get(name)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.first_seen.clear()
+
+
+def image_bytes(path, size=IMAGE_SIZE):
+    """由路径决定的固定伪图片内容 (PNG 文件头 + 哈希填充 + IEND 结束块)。"""
+    seed = hashlib.sha256(path.encode('utf-8')).digest()
+    body = (seed * (size // len(seed) + 1))[:size - 8 - len(PNG_IEND)]
+    return b"\x89PNG\r\n\x1a\n" + body + PNG_IEND
+
+
+class ReplayState:
+    """回放服务器的全部状态：语料、错误码序列、延迟/限速参数和计数器。"""
+
+    def __init__(self, cards, page_size=PAGE_SIZE, latency=0.0, bandwidth=0, errors=(), host_latency=None):
+        self.cards = cards
+        self.page_size = page_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host_latency = dict(host_latency or {})  # 图片主机 -> 额外延迟 (秒)
+        self.stats = ReplayStats()
+        self._errors = list(errors)
+        self._errors_lock = threading.Lock()
+        self.smtp_reject = set()    # 这些收件人始终返回 550
+        self.smtp_tempfail = set()  # 这些收件人第一次返回 451，之后正常
+
+    def set_errors(self, errors):
+        with self._errors_lock:
+            self._errors = list(errors)
+
+    def next_error(self):
+        with self._errors_lock:
+            return self._errors.pop(0) if self._errors else 0
+
+    def page(self, uid, offset):
+        """offset 为 0 时返回第一页，否则返回动态 ID 小于 offset 的下一页。"""
+        cards = [c for c in self.cards if str(c['desc'].get('uid')) == str(uid)] or self.cards
+        if offset:
+            cards = [c for c in cards if int(c['desc']['dynamic_id_str']) < offset]
+        page_cards = cards[:self.page_size]
+        if not page_cards:
+            return {'has_more': 0, 'next_offset': 0}
+        has_more = len(cards) > self.page_size
+        return {'has_more': 1 if has_more else 0,
+                'next_offset': int(page_cards[-1]['desc']['dynamic_id_str']) if has_more else 0,
+                'cards': page_cards}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server_version = "BiliqReplay/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.replay_state
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == STATS_PATH:
+            return self._send(200, json.dumps(self.state.stats.snapshot()).encode('utf-8'), "application/json",
+                              count=False)
+        self.state.stats.add("http_requests")
+        if self.state.latency: time.sleep(self.state.latency)
+        if parts.path == SPACE_HISTORY_PATH:
+            return self._space_history(parse_qs(parts.query))
+        return self._image(parts.path)
+
+    def _space_history(self, query):
+        self.state.stats.add("api_requests")
+        code = self.state.next_error()
+        if code:
+            self.state.stats.add("api_errors")
+            payload = {'code': code, 'message': ERROR_MESSAGES.get(code, "error"), 'ttl': 1}
+        else:
+            uid = (query.get('host_uid') or [""])[0]
+            offset = int((query.get('offset_dynamic_id') or ["0"])[0] or 0)
+            payload = {'code': 0, 'message': "0", 'ttl': 1, 'data': self.state.page(uid, offset)}
+        self._send(200, json.dumps(payload, ensure_ascii=False).encode('utf-8'), "application/json")
+
+    def _image(self, path):
+        segments = path.lstrip('/').split('/', 1)
+        if len(segments) != 2 or not segments[0].endswith('.hdslb.com'):
+            return self._send(404, b"not found", "text/plain")
+        self.state.stats.add("image_requests")
+        self.state.stats.add(f"image_requests:{segments[0]}")
+        delay = self.state.host_latency.get(segments[0])
+        if delay: time.sleep(delay)
+        is_variant = '@' in segments[1]
+        body = image_bytes(segments[1], VARIANT_IMAGE_SIZE if is_variant else IMAGE_SIZE)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.state.stats.add("image_not_modified")
+            return self._send(304, b"", None, extra_headers={'ETag': etag})
+        self._send(200, body, "image/webp" if is_variant else "image/png", extra_headers={'ETag': etag})
+
+    def _send(self, status, body, content_type, extra_headers=None, count=True):
+        self.send_response(status)
+        if content_type: self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if count: self.state.stats.add("http_bytes_sent", len(body))
+        bandwidth = self.state.bandwidth
+        if not bandwidth or not body:
+            self.wfile.write(body)
+            return
+        chunk = max(1024, bandwidth // 20)
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            time.sleep(min(chunk, len(body) - start) / bandwidth)
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """只实现 smtplib 发信所需的命令 (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT)，收到的邮件直接丢弃。"""
+
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def handle(self):
+        stats = self.server.replay_state.stats
+        stats.add("smtp_connections")
+        self._reply("220 biliq-replay ESMTP")
+        recipients = 0
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == "EHLO":
+                self._reply("250-biliq-replay")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif verb == "HELO":
+                self._reply("250 biliq-replay")
+            elif verb == "AUTH":
+                args = command.split()
+                # 不校验账号密码；只按协议读完客户端发来的凭据
+                if args[1].upper() == "LOGIN":
+                    if len(args) < 3:
+                        self._reply("334 VXNlcm5hbWU6") # "Username:"
+                        self.rfile.readline()
+                    self._reply("334 UGFzc3dvcmQ6") # "Password:"
+                    self.rfile.readline()
+                elif len(args) < 3:
+                    self._reply("334 ")
+                    self.rfile.readline()
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                recipients = 0
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(':', 1)[-1].strip().strip('<>').lower()
+                state = self.server.replay_state
+                if address in state.smtp_reject:
+                    stats.add("smtp_rejected")
+                    self._reply("550 5.1.1 Mailbox unavailable")
+                    continue
+                with state._errors_lock:
+                    tempfail = address in state.smtp_tempfail
+                    state.smtp_tempfail.discard(address)
+                if tempfail:
+                    stats.add("smtp_tempfailed")
+                    self._reply("451 4.3.0 Try again later")
+                    continue
+                recipients += 1
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"): break
+                    size += len(data_line)
+                stats.add("smtp_messages")
+                stats.add("smtp_recipients", recipients)
+                stats.add("smtp_bytes_received", size)
+                self._reply("250 OK: queued")
+            elif verb in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SMTPSinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ReplayHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端取消对冲请求或退出时会直接断开保持的连接，不算服务端错误
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)): return
+        super().handle_error(request, client_address)
+
+
+class ReplayServer:
+    """在后台线程中同时运行 HTTP 回放服务和 SMTP 收件服务。端口为 0 时自动分配。"""
+
+    def __init__(self, state, host="127.0.0.1", port=0, smtp_port=0):
+        self.state = state
+        self.httpd = ReplayHTTPServer((host, port), ReplayHandler)
+        self.httpd.replay_state = state
+        self.smtpd = SMTPSinkServer((host, smtp_port), SMTPSinkHandler)
+        self.smtpd.replay_state = state
+        self._threads = []
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def smtp_address(self):
+        return self.smtpd.server_address[:2]
+
+    def start(self):
+        for server in (self.httpd, self.smtpd):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.httpd, self.smtpd):
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def parse_errors(value):
+    return [int(code) for code in value.split(',') if code.strip()] if value else []
+
+
+def parse_host_latency(values):
+    """['i0.hdslb.com=2.0', ...] -> {'i0.hdslb.com': 2.0}"""
+    result = {}
+    for value in values or []:
+        host, _, seconds = value.partition('=')
+        result[host.strip()] = float(seconds)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="B站动态接口 / 图片 CDN / SMTP 的离线回放服务器")
+    parser.add_argument("--corpus", help="录制的语料 (JSONL，可 .gz)，默认使用合成卡片")
+    parser.add_argument("--cards", type=int, default=200, help="合成卡片数量")
+    parser.add_argument("--uid", type=int, default=688379639)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--smtp-port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的附加延迟 (秒)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个连接的限速 (字节/秒)")
+    parser.add_argument("--errors", default="", help="依次返回的错误码，如 -412,-352,62002")
+    parser.add_argument("--slow-host", action='append', help="图片主机的额外延迟，如 i0.hdslb.com=2.0 (可重复)")
+    args = parser.parse_args()
+
+    cards = load_corpus(args.corpus) if args.corpus else generate_cards(args.cards, uid=args.uid)
+    state = ReplayState(cards, args.page_size, args.latency, args.bandwidth, parse_errors(args.errors),
+                        parse_host_latency(args.slow_host))
+    server = ReplayServer(state, args.host, args.port, args.smtp_port).start()
+    print(f"回放服务器已启动：API_BASE_URL / CDN_BASE_URL = {server.base_url}，"
+          f"SMTP = {server.smtp_address[0]}:{server.smtp_address[1]} ({len(cards)} 张卡片)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n统计：", json.dumps(state.stats.snapshot(), ensure_ascii=False))
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+B站动态接口的封装，biliq_daily.py 和 biliq_email.py 共用。
+
+config.json 中设置 API_BASE_URL 时，请求会发往该地址上的本地回放服务器
+(见 benchmarks/replay_server.py) 而不是 api.bilibili.com，用于离线测试和基准测试。
+回放服务器返回的错误码同样以 ResponseCodeException 抛出，错误处理与线上一致。
+
+bilibili_api 和 requests 的导入需要约 0.25 秒，只在第一次真正访问网络时才导入，
+没有新动态、在本地预检查阶段就结束的运行不会付出这部分开销。
+
+访问B站时，buvid 和 WBI 密钥取自两个脚本共用的会话缓存 (见 biliq_session)，不必每次运行都重新获取；
+回放模式不使用会话缓存。
+"""
+import asyncio
+import functools
+import json
+import traceback
+
+from biliq_metrics import get_metrics
+from biliq_profile import profile_coroutine
+from biliq_session import INVALIDATING_CODES, configure_session_cache, get_session_cache
+
+FETCH_TIMEOUT = 30.0
+
+_api_base_url = None
+
+
+def configure_api(config):
+    """按 config.json 中的 API_BASE_URL 切换到本地回放服务器 (未设置时访问B站)，并读取会话缓存的配置。"""
+    global _api_base_url
+    _api_base_url = (config.get("API_BASE_URL") or "").rstrip('/') or None
+    configure_session_cache(config)
+    if _api_base_url:
+        print(f"注意：动态接口将使用回放服务器 {_api_base_url}")
+
+
+class ReplayUser:
+    """回放模式下 user.User 的替身，只实现 get_dynamics。"""
+
+    def __init__(self, uid, base_url, credential=None):
+        self.uid = uid
+        self.base_url = base_url
+        self.credential = credential
+
+    async def get_dynamics(self, offset=0, need_top=False):
+        import requests
+        from bilibili_api import exceptions
+        params = {'host_uid': self.uid, 'offset_dynamic_id': offset, 'need_top': 1 if need_top else 0}
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, functools.partial(
+            requests.get, f"{self.base_url}/dynamic_svr/v1/dynamic_svr/space_history", params=params,
+            timeout=FETCH_TIMEOUT))
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get('code', 0) != 0:
+            raise exceptions.ResponseCodeException(payload['code'], payload.get('message', ''), payload)
+        data = payload.get('data') or {}
+        # 与 bilibili_api 一致：card 字段自动转换成 JSON
+        for card in data.get('cards') or []:
+            if isinstance(card.get('card'), str): card['card'] = json.loads(card['card'])
+        return data
+
+
+def make_user(uid, credential=None):
+    if _api_base_url:
+        return ReplayUser(uid, _api_base_url, credential)
+    from bilibili_api import user
+    return user.User(uid=uid, credential=credential)
+
+
+def build_credential(creds_config):
+    """用 config.json 中 CREDENTIALS 部分的 Cookie 创建凭据；缺少必要字段或创建失败时返回 None。"""
+    SESSDATA = creds_config.get("SESSDATA")
+    BILI_JCT = creds_config.get("BILI_JCT")
+    BUVID3 = creds_config.get("BUVID3")
+    DEDEUSERID = creds_config.get("DEDEUSERID")
+
+    if not SESSDATA or not BILI_JCT or not BUVID3:
+        print("\n错误：config.json 中 CREDENTIALS 部分缺少必要的 SESSDATA, BILI_JCT 或 BUVID3。")
+        return None
+    print("正在使用 config.json 中的 Cookie 信息创建凭据...")
+    try:
+        from bilibili_api import Credential
+        dedeuserid_val = DEDEUSERID if DEDEUSERID and DEDEUSERID.strip() else None
+        credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3, dedeuserid=dedeuserid_val)
+        print("凭据创建成功。")
+        return credential
+    except Exception as e:
+        print(f"错误：创建 Credential 对象失败：{e}")
+        return None
+
+
+async def fetch_user_dynamics(uid, credential=None, offset=0, limiter=None):
+    """
+    获取指定用户的B站动态列表 (offset 为 0 时为第一页)。
+    根据是否提供 credential 决定使用登录模式还是匿名模式。
+    limiter 为多个目标共享的令牌桶，发出请求前先取得令牌。
+    """
+    mode = "登录模式" if credential else "匿名模式"
+    page_desc = "第一页动态" if not offset else f"offset={offset} 之后的动态"
+    print(f"正在尝试以 {mode} 获取 UID {uid} 的{page_desc}...")
+    metrics = get_metrics()
+    from bilibili_api import exceptions
+    session = None if _api_base_url else get_session_cache()
+    try:
+        request_credential = credential
+        if session is not None:
+            try: request_credential = await session.prepare(credential)
+            except Exception as e: print(f"警告：读取会话缓存失败，改由 bilibili_api 自行获取 buvid: {e}")
+        target_user = make_user(uid, request_credential)
+
+        if limiter:
+            with metrics.time('rate_limit'): await limiter.acquire()
+        metrics.inc('api_requests')
+        with metrics.time('fetch'):
+            dynamics_page = await asyncio.wait_for(profile_coroutine('fetch', target_user.get_dynamics(offset=offset)),
+                                                   timeout=FETCH_TIMEOUT)
+        if session is not None: session.capture()
+
+        if dynamics_page and 'cards' in dynamics_page:
+            print(f"成功以 {mode} 获取 UID {uid} 的 {len(dynamics_page['cards'])} 条动态。")
+            return dynamics_page
+        elif dynamics_page and offset and not dynamics_page.get('has_more'):
+            # 翻到最后一页之后，接口只返回 has_more=0 而不带 'cards'
+            print(f"UID {uid} 的动态已全部翻完 ({mode})。")
+            return {**dynamics_page, 'cards': []}
+        elif dynamics_page and 'cards' not in dynamics_page:
+             print(f"获取到 UID {uid} 的动态数据 ({mode})，但 'cards' 键不存在。响应内容：{dynamics_page}")
+             return None
+        else:
+            print(f"获取 UID {uid} 的动态数据 ({mode}) 为空。")
+            return None
+    except asyncio.TimeoutError:
+        metrics.inc('api_errors', code='timeout')
+        print(f"错误：获取 UID {uid} 动态超时 ({mode})。")
+        return None
+    except exceptions.ResponseCodeException as e:
+        metrics.inc('api_errors', code=e.code)
+        print(f"错误：Bilibili API 返回错误码 {e.code} ({mode}): {e}")
+        if session is not None and e.code in INVALIDATING_CODES: session.invalidate(f"错误码 {e.code}")
+        if e.code == -101 and credential: print("  => 提示：可能是 B站账号未登录或 Cookie 已失效 (在 config.json 中)。")
+        elif e.code == -101 and not credential: print("  => 提示：此用户动态可能需要登录才能查看。")
+        elif e.code == -412: print("  => 提示：请求被拦截，可能是操作频繁或触发了风控。")
+        elif e.code == -352: print("  => 提示：验证失败，可能是 buvid3/csrf 不正确或缺失。")
+        elif e.code == 62002: print("  => 提示：目标用户设置了隐私，无法查看动态。")
+        return None
+    except Exception as e:
+        metrics.inc('api_errors', code='exception')
+        print(f"错误：获取 UID {uid} 动态时 ({mode}) 发生未知错误: {e}")
+        traceback.print_exc()
+        return None
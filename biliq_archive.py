@@ -0,0 +1,182 @@
+"""
+增量 Markdown 归档。
+
+归档目录结构：
+
+    <archive_dir>/
+        index.json          # 分段列表，按月份从新到旧排列
+        segments/2025-05.md # 每月一个分段文件，条目按动态 ID 从新到旧排列
+
+每次运行只改写新条目所在月份的分段 (大小有上限)，不再读写整个归档；
+分段和索引都先写临时文件再 os.replace，中途崩溃不会截断已有内容。
+原来的单文件格式 (如 武忠祥老师_每日一题.md) 通过 export_markdown() 按需导出。
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+
+from biliq_profile import profile_checkpoint
+
+INDEX_FILE = "index.json"
+SEGMENT_DIR = "segments"
+UNKNOWN_SEGMENT = "unknown"
+
+ENTRY_START_RE = re.compile(r"^<!--\s*ID:\s*(\d+)\s*-->", re.MULTILINE)
+HEADING_DATE_RE = re.compile(r"^##\s.*\((\d{4})-(\d{2})-\d{2} \d{2}:\d{2}\)\s*$", re.MULTILINE)
+
+
+def default_archive_dir(output_md_file):
+    """未配置 ARCHIVE_DIR 时，归档目录放在导出文件旁边：武忠祥老师_每日一题.md -> 武忠祥老师_每日一题_archive/"""
+    return os.path.splitext(output_md_file)[0] + "_archive"
+
+
+def atomic_write_text(path, text):
+    """先写同目录下的临时文件并 fsync，再原子替换目标文件。"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+
+def segment_for_timestamp(pub_ts):
+    """根据发布时间戳返回分段名 YYYY-MM；没有时间的条目归入 unknown。"""
+    try: return datetime.fromtimestamp(int(pub_ts)).strftime('%Y-%m')
+    except (TypeError, ValueError, OverflowError, OSError): return UNKNOWN_SEGMENT
+
+
+def split_entries(content):
+    """把 Markdown 内容按 <!-- ID: ... --> 注释切分成 {dynamic_id: 条目文本}。注释之前的内容会被丢弃。"""
+    entries = {}
+    matches = list(ENTRY_START_RE.finditer(content))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+        entries[match.group(1)] = content[match.start():end].rstrip() + "\n"
+    return entries
+
+
+def _join_entries(entries):
+    # 动态 ID 随发布时间递增，按 ID 倒序即为从新到旧
+    ordered = sorted(entries.items(), key=lambda kv: int(kv[0]), reverse=True)
+    return "\n".join(text for _, text in ordered)
+
+
+def _segment_path(archive_dir, name):
+    return os.path.join(archive_dir, SEGMENT_DIR, f"{name}.md")
+
+
+def _segment_sort_key(name):
+    # unknown 排在最后，其余按月份倒序
+    return (name != UNKNOWN_SEGMENT, name)
+
+
+def load_index(archive_dir):
+    index_path = os.path.join(archive_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_index(archive_dir, segments):
+    index = {
+        'updated_at': int(time.time()),
+        'segments': sorted(segments, key=lambda seg: _segment_sort_key(seg['name']), reverse=True),
+    }
+    atomic_write_text(os.path.join(archive_dir, INDEX_FILE), json.dumps(index, ensure_ascii=False, indent=2) + "\n")
+    return index
+
+
+def append_entries(archive_dir, new_entries):
+    """
+    把新条目写入归档。new_entries 为 dict 列表，键为 dynamic_id / pub_ts / markdown。
+    只改写受影响月份的分段文件，最后更新索引。返回实际新增的条目数。
+    """
+    by_segment = {}
+    for entry in new_entries:
+        by_segment.setdefault(segment_for_timestamp(entry.get('pub_ts')), {})[str(entry['dynamic_id'])] = \
+            entry['markdown'].rstrip() + "\n"
+
+    index = load_index(archive_dir) or {'segments': []}
+    segments = {seg['name']: seg for seg in index['segments']}
+    added = 0
+    for name, entries in by_segment.items():
+        path = _segment_path(archive_dir, name)
+        existing = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                existing = split_entries(f.read())
+        added += len(entries.keys() - existing.keys())
+        existing.update(entries)
+        content = _join_entries(existing)
+        profile_checkpoint('archive') # 此时分段的全部条目和拼接结果同时存在，内存占用最高
+        atomic_write_text(path, content)
+        segments[name] = {'name': name, 'file': f"{SEGMENT_DIR}/{name}.md", 'entries': len(existing)}
+
+    if by_segment:
+        _write_index(archive_dir, list(segments.values()))
+    return added
+
+
+def migrate_legacy_markdown(output_md_file, archive_dir):
+    """
+    一次性把旧的单文件归档拆分成按月分段。归档索引已存在或旧文件不存在时不做任何事。
+    返回迁移的条目数。
+    """
+    if load_index(archive_dir) is not None or not os.path.exists(output_md_file):
+        return 0
+    with open(output_md_file, 'r', encoding='utf-8') as f:
+        entries = split_entries(f.read())
+
+    by_segment = {}
+    for dynamic_id, text in entries.items():
+        heading = HEADING_DATE_RE.search(text)
+        name = f"{heading.group(1)}-{heading.group(2)}" if heading else UNKNOWN_SEGMENT
+        by_segment.setdefault(name, {})[dynamic_id] = text
+
+    segments = []
+    for name, segment_entries in by_segment.items():
+        atomic_write_text(_segment_path(archive_dir, name), _join_entries(segment_entries))
+        segments.append({'name': name, 'file': f"{SEGMENT_DIR}/{name}.md", 'entries': len(segment_entries)})
+    _write_index(archive_dir, segments)
+    print(f"已将 {output_md_file} 中的 {len(entries)} 条记录迁移到分段归档 {archive_dir}。")
+    return len(entries)
+
+
+def export_markdown(archive_dir, output_md_file):
+    """按索引顺序 (从新到旧) 拼接所有分段，导出为单个 Markdown 文件。返回导出的分段数。"""
+    index = load_index(archive_dir)
+    if index is None:
+        print(f"归档目录 {archive_dir} 中没有 {INDEX_FILE}，无可导出内容。")
+        return 0
+
+    directory = os.path.dirname(output_md_file) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        # 逐个分段写入临时文件，内存占用只与单个分段大小有关
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as out:
+            for i, seg in enumerate(index['segments']):
+                with open(os.path.join(archive_dir, seg['file']), 'r', encoding='utf-8') as f:
+                    segment_content = f.read()
+                if i: out.write("\n")
+                out.write(segment_content)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_md_file)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    print(f"已将归档 {archive_dir} 的 {len(index['segments'])} 个分段导出到 {output_md_file}")
+    return len(index['segments'])
@@ -1,15 +1,33 @@
 import asyncio
+import functools
 import os
-import requests
-from datetime import datetime
-from bilibili_api import user, Credential, exceptions
+from biliq_api import build_credential, configure_api, fetch_user_dynamics
+from biliq_archive import append_entries, default_archive_dir, export_markdown, migrate_legacy_markdown
+from biliq_download import (ORIGINAL_PROFILE, close_downloader, configure_downloader, get_downloader, image_base_name,
+                            resolve_variant)
+from biliq_export import open_exporter
+from biliq_extract import card_dynamic_id, extract_questions
+from biliq_journal import RUN_FAILED, RUN_OK, configure_journal, get_journal, resume_pending
+from biliq_metrics import configure_metrics, get_metrics, print_stage_summary, write_metrics
+from biliq_phash import check_and_index, configure_phash_index, get_phash_index, max_distance
+from biliq_profile import configure_profiler, profile_section, write_profile_reports
+from biliq_ratelimit import limiter_from_config
+from biliq_search import configure_search_index, get_search_index
+from biliq_state import configure_state_store, get_state_store
 import re
 import sys
 import json
+import time
 import traceback
 
 
 CONFIG_FILE = "config.json"
+BACKFILL_STATE_FILE = "backfill_state.json"
+BACKFILL_PAGE_INTERVAL = 3.0  # 翻页间隔 (秒)，降低触发 -412 风控的概率
+BACKFILL_MAX_RETRIES = 3      # 回溯中同一条动态连续失败的运行次数上限，超过后游标越过它 (记入 abandoned_ids)
+SYNC_MAX_PAGES = 5            # 日常同步最多向前翻的页数 (遇到同步水位即停止)
+PIPELINE_DEPTH = 2            # 流水线相邻阶段之间最多缓冲的页数
+SYNC_MIN_INTERVAL = 3 * 3600  # 两次日常同步的最短间隔 (秒)，间隔内的运行只查本地状态库就结束；0 为每次都同步
 
 def load_config(filename):
     """Loads configuration from a JSON file."""
@@ -28,43 +46,6 @@ def load_config(filename):
         print(f"错误：加载配置文件时发生未知错误: {e}")
         return None
 
-async def fetch_user_dynamics(uid, credential=None):
-    """
-    获取指定用户的B站动态列表 (第一页)。
-    根据是否提供 credential 决定使用登录模式还是匿名模式。
-    """
-    mode = "登录模式" if credential else "匿名模式"
-    print(f"正在尝试以 {mode} 获取 UID {uid} 的第一页动态...")
-    try:
-        target_user = user.User(uid=uid, credential=credential)
-
-        dynamics_page = await asyncio.wait_for(target_user.get_dynamics(offset=0), timeout=30.0)
-
-        if dynamics_page and 'cards' in dynamics_page:
-            print(f"成功以 {mode} 获取 UID {uid} 的 {len(dynamics_page['cards'])} 条动态。")
-            return dynamics_page
-        elif dynamics_page and 'cards' not in dynamics_page:
-             print(f"获取到 UID {uid} 的动态数据 ({mode})，但 'cards' 键不存在。响应内容：{dynamics_page}")
-             return None
-        else:
-            print(f"获取 UID {uid} 的动态数据 ({mode}) 为空。")
-            return None
-    except asyncio.TimeoutError:
-        print(f"错误：获取 UID {uid} 动态超时 ({mode})。")
-        return None
-    except exceptions.ResponseCodeException as e:
-        print(f"错误：Bilibili API 返回错误码 {e.code} ({mode}): {e}")
-        if e.code == -101 and credential: print("  => 提示：可能是 B站账号未登录或 Cookie 已失效 (在 config.json 中)。")
-        elif e.code == -101 and not credential: print("  => 提示：此用户动态可能需要登录才能查看。")
-        elif e.code == -412: print("  => 提示：请求被拦截，可能是操作频繁或触发了风控。")
-        elif e.code == -352: print("  => 提示：验证失败，可能是 buvid3/csrf 不正确或缺失。")
-        elif e.code == 62002: print("  => 提示：目标用户设置了隐私，无法查看动态。")
-        return None
-    except Exception as e:
-        print(f"错误：获取 UID {uid} 动态时 ({mode}) 发生未知错误: {e}")
-        traceback.print_exc()
-        return None
-
 def sanitize_filename(filename):
     """Removes or replaces characters invalid in filenames."""
     filename = filename.replace('/', '-').replace('\\', '-').replace('\0', '')
@@ -78,210 +59,561 @@ def sanitize_filename(filename):
     if not filename: filename = "untitled"
     return filename
 
-def download_image(url, folder, filename):
-    """Downloads an image from a URL to a specified folder."""
-    filepath = os.path.join(folder, filename)
-    if not url.startswith(('http://', 'https://')):
-        url = 'http:' + url if url.startswith('//') else 'https://' + url
+def process_dynamics_to_markdown(dynamics_data, output_md_file, image_dir, archive_dir=None, downloader=None, state=None,
+                                 image_profile=ORIGINAL_PROFILE, stop_at=None, sync=None):
+    """
+    处理B站动态数据，严格筛选含“第N题”的图文动态，下载全部图片(命名为 N_YYYY_MM_DD、N_YYYY_MM_DD_2 ...)，
+    并把新条目写入按月分段的归档 (archive_dir，默认由 output_md_file 推出)。
+    一条动态只有在它的所有图片都下载成功后才会写入，不会出现缺图的条目。
+
+    output_md_file 只在首次运行时作为旧归档被迁移/导入，之后需要单文件时用 --export 导出。
+    图片下载先全部排队 (downloader 默认为共享的连接池下载器)，解析完整页后再按原顺序收集结果。
+    去重查询 SQLite 状态库 (state 默认为共享状态库)，不再扫描 Markdown 文件。
+    image_profile 为归档使用的图片规格 (见 biliq_download.IMAGE_PROFILES)，默认为原图。
+    stop_at 为同步水位：遇到 ID 不大于它的卡片即停止解析 (动态按从新到旧排列，之后的都已处理过)；
+    sync 为 new_sync_state() 返回的 dict，记录本页中水位之上的卡片和处理失败的动态，用于推进水位。
+    返回本次新写入的条目数。
+    """
+    page = queue_page_downloads(dynamics_data, output_md_file, image_dir, archive_dir, downloader, state,
+                                image_profile, stop_at, sync)
+    return write_page(page) if page is not None else 0
 
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                   'Referer': 'https://www.bilibili.com/'}
-        print(f"  正在下载图片: {url} -> {filepath}")
-        response = requests.get(url, stream=True, timeout=30, headers=headers)
-        response.raise_for_status()
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return filepath
-    except requests.exceptions.MissingSchema: print(f"  下载图片失败: 无效的URL: {url}"); return None
-    except requests.exceptions.HTTPError as e: print(f"  下载图片失败: HTTP错误 {e.response.status_code} for {url}"); return None
-    except requests.exceptions.RequestException as e: print(f"  下载图片失败: {url} - {e}"); return None
-    except IOError as e: print(f"  保存图片失败: {filepath} - {e}"); return None
-
-def process_dynamics_to_markdown(dynamics_data, output_md_file, image_dir):
+def queue_page_downloads(dynamics_data, output_md_file, image_dir, archive_dir=None, downloader=None, state=None,
+                         image_profile=ORIGINAL_PROFILE, stop_at=None, sync=None, queued_ids=None):
     """
-    处理B站动态数据，严格筛选含“第N题”的图文动态，下载图片(命名为 N_YYYY_MM_DD)，
-    并生成/更新 Markdown 文件。
+    流水线的解析阶段：解析一页动态，把匹配题目的全部图片排队下载后立即返回，不等待下载完成。
+    返回交给 write_page() 的待写入页 (dict)；数据无效或迁移旧归档失败时返回 None。
+    待写入页的 failed_ids 记录本页处理失败的动态 ID (排队失败的在这里记入，下载或写入失败的由 write_page() 记入)。
+    queued_ids 为跨页共享的已排队动态 ID 集合，避免相邻两页重复出现的动态在写入前被排队两次。
     """
     if not (dynamics_data and 'cards' in dynamics_data and isinstance(dynamics_data['cards'], list)):
         print("动态数据无效或缺少 'cards' 列表，无法处理。")
-        return
+        return None
 
     os.makedirs(image_dir, exist_ok=True)
 
-    existing_content = ""
-    processed_ids = set()
-    if os.path.exists(output_md_file):
+    if archive_dir is None:
+        archive_dir = default_archive_dir(output_md_file)
+    try:
+        migrate_legacy_markdown(output_md_file, archive_dir) # One-time split of the single-file archive
+    except Exception as e:
+        print(f"错误：迁移现有 Markdown 文件 {output_md_file} 到分段归档失败: {e}")
+        return None
+
+    if state is None:
+        state = get_state_store()
+    try:
+        state.import_markdown(output_md_file) # One-time import of <!-- ID: ... --> comments
+    except Exception as e:
+        print(f"警告：从现有 Markdown 文件 {output_md_file} 导入已处理 ID 失败: {e}")
+
+    if downloader is None:
+        downloader = get_downloader()
+
+    stop = None
+    if stop_at is not None:
+        stop = lambda dynamic_id: _id_at_or_below(dynamic_id, stop_at)
+    if sync is not None:
+        _track_sync(sync, dynamics_data, stop)
+
+    pending_entries, failed_ids = [], []
+    if queued_ids is None: queued_ids = set() # Avoid queueing the same dynamic twice before it is written
+
+    # 已处理的动态在解析卡片内容之前就跳过
+    for record in extract_questions(dynamics_data, skip=lambda dynamic_id: dynamic_id in queued_ids or state.is_processed(dynamic_id),
+                                    stop=stop):
+        dynamic_id, question_number = record.dynamic_id, record.question_number
+        print(f"  匹配到 '第 {question_number} 题', 处理中... ID: {dynamic_id}")
         try:
-            with open(output_md_file, 'r', encoding='utf-8') as f:
-                existing_content = f.read()
-                processed_ids = set(re.findall(r"dynamic_id(?:_str)?:\s*(\d+)", existing_content, re.IGNORECASE)) \
-                                | set(re.findall(r"<!--\s*ID:\s*(\d+)\s*-->", existing_content)) # Add comment-based ID tracking
-                print(f"找到 {len(processed_ids)} 个可能已处理的动态 ID。")
+            # *** 下载图片 (新命名: N_YYYY_MM_DD, N_YYYY_MM_DD_2, ...) ***
+            # 使用提取的题号和格式化日期进行命名，按规格改写 URL 和扩展名，所有图片并行排队下载后立即继续解析下一条
+            date_for_filename = record.date_for_filename
+            image_paths, download_futures = [], []
+            for index, image_url in enumerate(record.image_urls):
+                request_url, image_folder, image_filename = resolve_variant(
+                    image_url, image_dir, image_base_name(question_number, date_for_filename, index), image_profile)
+                image_filename = sanitize_filename(image_filename)
+                image_paths.append(os.path.join(image_folder, image_filename))
+                download_futures.append(downloader.submit(request_url, image_folder, image_filename))
         except Exception as e:
-            print(f"警告：读取现有 Markdown 文件 {output_md_file} 失败: {e}")
+            print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id}")
+            traceback.print_exc()
+            failed_ids.append(int(dynamic_id))
+            if sync is not None: sync['failed_ids'].append(int(dynamic_id))
+            continue
+        pending_entries.append({'record': record, 'image_paths': image_paths, 'download_futures': download_futures})
+        queued_ids.add(dynamic_id)
+    return {'entries': pending_entries, 'archive_dir': archive_dir, 'output_md_file': output_md_file,
+            'state': state, 'sync': sync, 'failed_ids': failed_ids}
 
+def write_page(page):
+    """
+    流水线的写入阶段：按动态在页面中的顺序等待图片下载完成，渲染 Markdown 并写入归档和状态库。
+    渲染好的条目先记入运行日志 (见 biliq_journal)，写入归档和状态库后才从日志中删除，
+    中途被杀时下次运行直接从日志补写。返回本页新写入的条目数；图片下载或写入失败的动态 ID 记入 page['failed_ids']。
+    """
+    archive_dir, output_md_file, state, sync = page['archive_dir'], page['output_md_file'], page['state'], page['sync']
+    failed_ids = page.setdefault('failed_ids', [])
+    metrics = get_metrics()
     new_markdown_entries = []
-    items_list = dynamics_data['cards']
+    new_records = []
+
+    # 按动态在页面中的顺序收集下载结果，保证 Markdown 条目顺序稳定
+    for entry in page['entries']:
+        record = entry['record']
+        dynamic_id, title, pub_time_str = record.dynamic_id, record.title, record.pub_time_str
+        failed_downloads = 0
+        for download_future in entry['download_futures']:
+            try:
+                if not download_future.result(): failed_downloads += 1
+            except Exception as e:
+                print(f"  下载图片时发生意外错误：{e}. Dynamic ID: {dynamic_id}")
+                failed_downloads += 1
 
-    for item in items_list:
-        dynamic_id_for_error = item.get('desc', {}).get('dynamic_id_str', 'N/A')
-        try:
-            dynamic_id = item.get('desc', {}).get('dynamic_id_str') or \
-                         item.get('display', {}).get('origin', {}).get('dynamic_id_str') or \
-                         item.get('desc', {}).get('rid_str') or \
-                         item.get('basic', {}).get('comment_id_str') 
-
-            if not dynamic_id:
-                # print(f"  警告: 无法为某个卡片提取 dynamic_id，跳过。卡片内容片段: {str(item)[:200]}") # Debugging if needed
-                continue
-
-            if dynamic_id in processed_ids:
-                # print(f"  跳过：动态 ID {dynamic_id} 已处理过。") # Reduce noise
-                continue
-
-            card_value = item.get('card')
-            if not card_value: continue
-
-            card_data = None
-            if isinstance(card_value, str):
-                try: card_data = json.loads(card_value)
-                except json.JSONDecodeError as e: print(f"  错误：解析 card JSON 失败。ID: {dynamic_id}. Error: {e}"); continue
-            elif isinstance(card_value, dict): card_data = card_value
-            else: print(f"  警告：item['card'] 类型未知 ({type(card_value)})。跳过。 ID: {dynamic_id}"); continue
-
-            if not card_data: print(f"  内部错误：card_data 为空。跳过。 ID: {dynamic_id}"); continue
-
-            pub_ts = item.get('desc', {}).get('timestamp') or \
-                     card_data.get('item', {}).get('upload_time') 
-
-            major_module_items = None 
-            description = None
-            module_dynamic = card_data.get('modules', {}).get('module_dynamic', {})
-
-            # Structure 1: 'modules' -> 'module_dynamic' -> 'major' (draw) and 'desc'
-            if module_dynamic:
-                major_data = module_dynamic.get('major', {})
-                desc_data = module_dynamic.get('desc')
-                if major_data.get('type') == 'MAJOR_TYPE_DRAW':
-                     draw_data = major_data.get('draw')
-                     if draw_data and 'items' in draw_data and desc_data and 'text' in desc_data:
-                         major_module_items = draw_data['items']
-                         description = desc_data['text']
-                         # print(f"  找到图文内容 (结构 'modules'): ID {dynamic_id}")
-
-            # Structure 2: Direct 'item' with 'pictures' and 'description' (Older or simpler format)
-            if major_module_items is None:
-                item_data = card_data.get('item', {})
-                if isinstance(item_data.get('pictures'), list) and item_data.get('description'):
-                    # Map 'pictures' structure to the same format as 'items' if possible
-                    major_module_items = [{'src': pic.get('img_src')} for pic in item_data['pictures'] if pic.get('img_src')]
-                    description = item_data['description']
-                    # print(f"  找到图文内容 (结构 'item'): ID {dynamic_id}")
-
-            # Structure 3: Origin item for forwarded dynamics (less likely for "每日一题")
-            if major_module_items is None and 'origin' in card_data:
-                 origin_card_value = card_data.get('origin')
-                 origin_card_data = None
-                 if isinstance(origin_card_value, str):
-                     try: origin_card_data = json.loads(origin_card_value)
-                     except json.JSONDecodeError: pass # Ignore parse error here
-                 elif isinstance(origin_card_value, dict): origin_card_data = origin_card_value
-
-                 if origin_card_data:
-                    origin_item_data = origin_card_data.get('item', {})
-                    if isinstance(origin_item_data.get('pictures'), list) and origin_item_data.get('description'):
-                        major_module_items = [{'src': pic.get('img_src')} for pic in origin_item_data['pictures'] if pic.get('img_src')]
-                        description = origin_item_data['description'] # Use original description
-
-            if major_module_items is None or description is None:
-                 # print(f"  跳过：动态 ID {dynamic_id} 未找到有效的图文内容结构。")
-                 continue # Skip if no usable text/image content found
-
-            # --- 核心筛选和信息提取 ---
-            text_content = description.strip()
-            if not text_content: continue # Skip if text is empty
-
-            # 1. *** 严格筛选: 必须包含 "第 N 题" ***
-            question_match = re.search(r"第\s*(\d+)\s*题", text_content, re.IGNORECASE)
-            if not question_match:
-                # print(f"  跳过：内容未匹配 '第 N 题'。 ID: {dynamic_id}") # Reduce noise unless debugging
-                continue
-            question_number = question_match.group(1) # 提取题号 N
-            print(f"  匹配到 '第 {question_number} 题', 处理中... ID: {dynamic_id}")
-
-            # 2. 生成标题
-            title = f"每日一题 | 第 {question_number} 题"
-
-            # 3. 格式化日期 (用于文件名) 和时间字符串
-            pub_time_str = "未知时间"
-            formatted_date_for_filename = "nodate"
-            if pub_ts:
-                try:
-                    dt_object = datetime.fromtimestamp(int(pub_ts))
-                    pub_time_str = dt_object.strftime('%Y-%m-%d %H:%M')
-                    formatted_date_for_filename = dt_object.strftime('%Y_%m_%d') # YYYY_MM_DD
-                except Exception as e:
-                    print(f"    解析时间戳失败: {pub_ts}, 错误: {e}")
-
-            # 4. 提取图片 URL (第一张)
-            if not (isinstance(major_module_items, list) and len(major_module_items) > 0):
-                 print(f"  跳过：图片列表为空或无效。 ID: {dynamic_id}"); continue
-
-            image_info = major_module_items[0] # Take the first image structure
-            image_url = image_info.get('src') # Prefer 'src' key
-            if not image_url:
-                # Fallback for potential different key names if needed
-                # image_url = image_info.get('img_src') # Example fallback
-                print(f"  跳过：无法获取图片 URL (检查 'src' key)。 ID: {dynamic_id}"); continue
-
-
-            # 5. *** 下载图片 (新命名: N_YYYY_MM_DD) ***
-            _, ext = os.path.splitext(image_url.split('?')[0])
-            if not ext or len(ext) > 6: ext = '.jpg' # Default to jpg, allow slightly longer extensions like .jpeg
-            # 使用提取的题号和格式化日期进行命名
-            image_filename = sanitize_filename(f"{question_number}_{formatted_date_for_filename}{ext}")
-            local_image_path = download_image(image_url, image_dir, image_filename)
-
-            if not local_image_path:
-                print(f"  处理失败：图片下载失败。跳过此动态。 ID: {dynamic_id}")
-                continue
-
-            # 6. 格式化 Markdown 条目
-            relative_image_path = os.path.join(image_dir, image_filename).replace('\\', '/')
-            # Add a comment with the dynamic ID for easier tracking/debugging
-            markdown_entry = f"""<!-- ID: {dynamic_id} -->
+        if failed_downloads:
+            print(f"  处理失败：{failed_downloads}/{len(entry['download_futures'])} 张图片下载失败。跳过此动态。 ID: {dynamic_id}")
+            failed_ids.append(int(dynamic_id))
+            if sync is not None: sync['failed_ids'].append(int(dynamic_id))
+            continue
+
+        # 6. 格式化 Markdown 条目
+        render_start = time.perf_counter()
+        relative_image_paths = [path.replace('\\', '/') for path in entry['image_paths']]
+        image_markdown = "\n\n".join(f"![{title}]({path})" for path in relative_image_paths)
+        image_markdown += _duplicate_note(dynamic_id, record.question_number, entry['image_paths'])
+        # Add a comment with the dynamic ID for easier tracking/debugging
+        markdown_entry = f"""<!-- ID: {dynamic_id} -->
 ## {title} ({pub_time_str})
 
 **文本:**
 
-{text_content}
+{record.text}
 
 **图片:**
 
-![{title}]({relative_image_path})
+{image_markdown}
 
 ---
 """
-            new_markdown_entries.append(markdown_entry)
-            if dynamic_id: processed_ids.add(dynamic_id) # Ensure ID is added after successful processing
-            print(f"  成功处理并格式化动态 ID: {dynamic_id}")
-
-        except Exception as e:
-            print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id_for_error}")
-            traceback.print_exc()
-            continue
+        new_markdown_entries.append({'dynamic_id': dynamic_id, 'pub_ts': record.pub_ts, 'markdown': markdown_entry})
+        new_records.append({'dynamic_id': dynamic_id, 'uid': record.uid, 'question_number': record.question_number,
+                            'pub_ts': record.pub_ts, 'image_paths': relative_image_paths, 'output_file': output_md_file,
+                            'title': title, 'text': record.text})
+        metrics.observe_stage('render', time.perf_counter() - render_start)
+        print(f"  成功处理并格式化动态 ID: {dynamic_id}")
 
     if new_markdown_entries:
-        # Prepend new entries to the existing content
-        final_content = "\n".join(new_markdown_entries) + "\n" + existing_content
+        journal = _stage_entries(archive_dir, new_markdown_entries, new_records)
         try:
-            with open(output_md_file, 'w', encoding='utf-8') as f: f.write(final_content)
-            print(f"\n成功将 {len(new_markdown_entries)} 条新【每日一题】动态写入到 {output_md_file}")
-        except IOError as e: print(f"\n错误：写入 Markdown 文件 {output_md_file} 失败: {e}")
+            with metrics.time('render'), profile_section('archive'):
+                append_entries(archive_dir, new_markdown_entries)
+            print(f"\n成功将 {len(new_markdown_entries)} 条新【每日一题】动态写入到归档 {archive_dir}")
+        except (IOError, ValueError) as e:
+            print(f"\n错误：写入归档 {archive_dir} 失败: {e}")
+            failed_ids.extend(int(entry['dynamic_id']) for entry in new_markdown_entries)
+            if sync is not None: sync['failed_ids'].extend(int(entry['dynamic_id']) for entry in new_markdown_entries)
+            return 0
+        # 写入成功后才记入状态库，写入失败的条目下次运行会重新处理
+        state.record_many(new_records)
+        if journal is not None: journal.discard([entry['dynamic_id'] for entry in new_markdown_entries])
+        metrics.inc('entries_written', len(new_records))
+        update_search_index(new_records)
     else:
         print("\n没有找到新的符合【每日一题】条件的动态。")
+    return len(new_markdown_entries)
+
+def _stage_entries(archive_dir, entries, records):
+    """把待写入的条目记入运行日志，返回日志 (未启用或记录失败时返回 None，照常写入归档)。"""
+    try:
+        journal = get_journal()
+        if journal is not None: journal.stage(archive_dir, entries, records)
+        return journal
+    except Exception as e:
+        print(f"警告：写入运行日志失败，本页不可从日志恢复: {e}")
+        return None
+
+def resume_journal():
+    """登记本次运行，并把上次运行记入日志但未提交的条目补写进归档、状态库和全文索引。返回运行日志 (可能为 None)。"""
+    try:
+        journal = get_journal()
+        if journal is None: return None
+        journal.begin_run()
+        resumed = resume_pending(journal, get_state_store())
+    except Exception as e:
+        print(f"警告：读取运行日志失败: {e}")
+        return None
+    if resumed:
+        get_metrics().inc('entries_written', len(resumed))
+        update_search_index(resumed)
+    return journal
+
+def _duplicate_note(dynamic_id, question_number, image_paths):
+    """检查图片是否与已归档的题目相近，返回追加在图片之后的 Markdown 提示 (没有重复时为空)。检查失败不影响写入。"""
+    try:
+        phash_index = get_phash_index()
+        if phash_index is None: return ""
+        duplicates = check_and_index(phash_index, dynamic_id, question_number, image_paths, max_distance())
+    except Exception as e:
+        print(f"  警告：检查重复图片失败: {e}. Dynamic ID: {dynamic_id}")
+        return ""
+    if not duplicates: return ""
+    get_metrics().inc('duplicate_questions')
+    links = "，".join(f"第 {d['question_number']} 题 (ID {d['dynamic_id']}，距离 {d['distance']})" for d in duplicates)
+    print(f"  疑似重复：图片与 {links} 相近。 ID: {dynamic_id}")
+    return f"\n\n> **疑似重复:** 图片与 {links} 相近"
+
+def update_search_index(records, archive_dir=None, uid=None):
+    """把新条目写入全文索引 (archive_dir 不为空时先一次性导入已有归档)。索引失败只打印警告，不影响归档。"""
+    try:
+        index = get_search_index()
+        if archive_dir: index.import_archive(archive_dir, uid)
+        if records: index.add_many(records)
+    except Exception as e:
+        print(f"警告：更新全文索引失败: {e}")
+
+def _id_at_or_below(dynamic_id, mark):
+    try: return int(dynamic_id) <= int(mark)
+    except (TypeError, ValueError): return False
+
+def new_sync_state():
+    return {'candidates': [], 'failed_ids': [], 'reached_mark': False}
+
+def _track_sync(sync, dynamics_data, stop):
+    """记录本页中位于水位之上的卡片 (ID, 发布时间)，遇到水位即停止 (只读 desc，不解析卡片内容)。"""
+    for item in dynamics_data['cards']:
+        dynamic_id = card_dynamic_id(item)
+        if not dynamic_id: continue
+        if stop is not None and stop(dynamic_id):
+            sync['reached_mark'] = True
+            return
+        try: sync['candidates'].append((int(dynamic_id), (item.get('desc') or {}).get('timestamp')))
+        except (TypeError, ValueError): pass
+
+def sync_high_water_mark(sync):
+    """返回可以安全推进到的水位 (dynamic_id, pub_ts)：不越过任何处理失败的动态，它们下次运行会被重新处理。"""
+    candidates = sync['candidates']
+    if sync['failed_ids']:
+        lowest_failed = min(sync['failed_ids'])
+        candidates = [c for c in candidates if c[0] < lowest_failed]
+    return max(candidates, key=lambda c: c[0]) if candidates else None
+
+def load_backfill_state(filename, uid):
+    """读取回溯抓取的游标；文件不存在或属于其他 UID 时从头开始。"""
+    if not os.path.exists(filename):
+        return {'uid': str(uid), 'offset': 0, 'pages': 0, 'done': False}
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (IOError, json.JSONDecodeError) as e:
+        print(f"警告：读取回溯游标文件 {filename} 失败，将从头开始: {e}")
+        return {'uid': str(uid), 'offset': 0, 'pages': 0, 'done': False}
+    if str(state.get('uid')) != str(uid):
+        print(f"回溯游标文件 {filename} 属于 UID {state.get('uid')}，将为 UID {uid} 从头开始。")
+        return {'uid': str(uid), 'offset': 0, 'pages': 0, 'done': False}
+    return state
+
+def save_backfill_state(filename, state):
+    """原子地保存回溯游标 (先写临时文件再替换)，进程被杀也不会留下半截文件。"""
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_filename, filename)
+
+async def backfill_user_dynamics(uid, credential, output_md_file, image_dir, state_file=BACKFILL_STATE_FILE,
+                                 page_interval=BACKFILL_PAGE_INTERVAL, limiter=None, stats=None, archive_dir=None,
+                                 image_profile=ORIGINAL_PROFILE, exporter=None):
+    """
+    沿 next_offset 游标一直翻到用户的第一条动态，逐页写入 Markdown。
+    每页处理完后保存游标，被中断或触发风控后再次运行会从上次停下的位置继续。
+    某页有处理失败 (如图片下载失败) 的动态时，游标停在这一页并停止本次回溯 (之后的页下次运行反正要重新翻)，
+    下次运行从这一页重新开始 (已写入的动态直接跳过)；同一条动态连续 BACKFILL_MAX_RETRIES 次运行都失败时
+    不再等待它，记入游标文件的 abandoned_ids 后继续推进。
+    """
+    if stats is None: stats = new_target_stats()
+    state = load_backfill_state(state_file, uid)
+    if state.get('done'):
+        print(f"UID {uid} 的历史动态已回溯完毕。如需重新回溯，请删除 {state_file}。")
+        return True
+    if state['offset']:
+        print(f"从上次中断处继续回溯：已完成 {state['pages']} 页，offset={state['offset']}")
+
+    blocked = False
+    retries = state.setdefault('failed_attempts', {})
+
+    def save_cursor(dynamics_page, failed_ids):
+        # 每页写入归档后才推进游标，被中断时最多重新处理尚未写入的页；不越过有失败动态的页，返回 True 停止流水线
+        nonlocal blocked
+        failed = {str(dynamic_id) for dynamic_id in failed_ids}
+        for dynamic_id in map(card_dynamic_id, dynamics_page['cards']):
+            if dynamic_id and str(dynamic_id) not in failed: retries.pop(str(dynamic_id), None)
+        if failed_ids:
+            for dynamic_id in failed_ids:
+                retries[str(dynamic_id)] = retries.get(str(dynamic_id), 0) + 1
+            if max(retries[str(dynamic_id)] for dynamic_id in failed_ids) < BACKFILL_MAX_RETRIES:
+                blocked = True
+                save_backfill_state(state_file, state)
+                print(f"第 {state['pages'] + 1} 页有 {len(failed_ids)} 条动态处理失败，游标停在 offset={state['offset']}，"
+                      f"停止回溯，下次运行从这一页重试。")
+                return True
+            abandoned = state.setdefault('abandoned_ids', [])
+            abandoned.extend(str(dynamic_id) for dynamic_id in failed_ids if str(dynamic_id) not in abandoned)
+            for dynamic_id in failed_ids: retries.pop(str(dynamic_id), None)
+            print(f"警告：动态 {', '.join(map(str, failed_ids))} 已连续 {BACKFILL_MAX_RETRIES} 次运行处理失败，"
+                  f"游标越过它们 (记录在 {state_file} 的 abandoned_ids 中)。")
+        next_offset = dynamics_page.get('next_offset') or 0
+        state['pages'] += 1
+        state['done'] = not dynamics_page.get('has_more') or not next_offset or not dynamics_page['cards']
+        state['offset'] = 0 if state['done'] else next_offset
+        save_backfill_state(state_file, state)
+        return False
+
+    # 每页写入后立即丢弃，不在内存中累积整个历史
+    result = await run_page_pipeline(uid, credential, limiter, stats, functools.partial(
+        queue_page_downloads, output_md_file=output_md_file, image_dir=image_dir, archive_dir=archive_dir,
+        image_profile=image_profile), offset=state['offset'], page_interval=page_interval, on_page_written=save_cursor,
+        exporter=exporter)
+    if result == PIPELINE_FETCH_FAILED:
+        print(f"回溯在 offset={state['offset']} 处中断，游标已保存到 {state_file}，稍后重新运行即可继续。")
+        return False
+    if blocked:
+        print(f"回溯未完成：游标停在有失败动态的 offset={state['offset']} 处，稍后重新运行即可重试。")
+        return False
+    print(f"\n回溯完成：共翻阅 {state['pages']} 页动态。")
+    return True
+
+async def sync_user_dynamics(uid, credential, output_md_file, image_dir, limiter=None, stats=None, archive_dir=None,
+                             image_profile=ORIGINAL_PROFILE, page_interval=BACKFILL_PAGE_INTERVAL, max_pages=SYNC_MAX_PAGES,
+                             exporter=None):
+    """
+    日常增量同步：从最新一页开始向前翻，遇到同步水位 (上次完整处理到的动态) 即停止获取和解析。
+    通常只需一次请求；两次运行之间发布的动态超过一页时继续翻页，最多 max_pages 页。
+    从未同步过的 UID 只处理第一页 (更早的历史用 --backfill)。全部处理完后才推进水位。
+    """
+    if stats is None: stats = new_target_stats()
+    state = get_state_store()
+    mark = state.get_high_water_mark(uid)
+    stop_at = mark[0] if mark else None
+    if stop_at: print(f"UID {uid} 的同步水位: ID {stop_at}")
+    sync = new_sync_state()
+
+    # 从未同步过的 UID 只处理第一页
+    result = await run_page_pipeline(uid, credential, limiter, stats, functools.partial(
+        queue_page_downloads, output_md_file=output_md_file, image_dir=image_dir, archive_dir=archive_dir,
+        image_profile=image_profile, stop_at=stop_at, sync=sync),
+        page_interval=page_interval, max_pages=max_pages if stop_at else 1, stop_at=stop_at, exporter=exporter)
+    if result == PIPELINE_FETCH_FAILED:
+        return False # 水位保持不变，下次运行重新同步
+    state.set_meta(f"synced_at:{uid}", str(int(time.time())))
+    if result == PIPELINE_PAGE_LIMIT and stop_at:
+        print(f"警告：向前翻阅 {max_pages} 页仍未遇到同步水位 (ID {stop_at})，水位保持不变。"
+              f"可调大 SYNC_MAX_PAGES 或运行 --backfill 补全更早的动态。")
+        return True
+
+    new_mark = sync_high_water_mark(sync)
+    if new_mark and state.advance_high_water_mark(uid, new_mark[0], new_mark[1]):
+        print(f"UID {uid} 的同步水位更新为 ID {new_mark[0]}")
+    return True
+
+def sync_due(uid, min_interval, now=None):
+    """本地预检查 (只查状态库，不导入网络库也不发请求)：UID 在 min_interval 秒内成功同步过时返回 False。"""
+    if min_interval <= 0: return True
+    synced_at = get_state_store().get_meta(f"synced_at:{uid}")
+    if synced_at is None: return True
+    return (now if now is not None else time.time()) - int(synced_at) >= min_interval
+
+def new_target_stats():
+    return {'pages': 0, 'cards': 0, 'entries': 0, 'elapsed': 0.0, 'ok': False}
+
+PIPELINE_DONE = "done"
+PIPELINE_FETCH_FAILED = "fetch_failed"
+PIPELINE_PAGE_LIMIT = "page_limit"
+PIPELINE_STOPPED = "stopped"
+
+def _page_reaches_mark(dynamics_page, stop_at):
+    return stop_at is not None and any(_id_at_or_below(card_dynamic_id(item), stop_at)
+                                       for item in dynamics_page['cards'])
+
+async def run_page_pipeline(uid, credential, limiter, stats, queue_page, offset=0, page_interval=BACKFILL_PAGE_INTERVAL,
+                            max_pages=None, stop_at=None, on_page_written=None, exporter=None, depth=PIPELINE_DEPTH):
+    """
+    按 获取 -> 解析并排队下载 -> 等待下载并写入 三个阶段流水线处理一个用户的动态页：
+    第 N 页的图片还在下载、写入时，第 N+1 页已经在解析，第 N+2 页已经在获取。
+    阶段之间是容量为 depth 的有界队列，后面的阶段跟不上时前面的阶段暂停，内存中最多缓冲几页。
+    写入阶段只有一个，按页顺序写入，归档条目顺序与逐页处理时一致。
+
+    queue_page(dynamics_page, queued_ids=...) 在线程池中运行 (通常是 queue_page_downloads 的 partial)；
+    on_page_written(dynamics_page, failed_ids) 在每页写入后调用，failed_ids 为本页处理失败 (不应越过) 的动态 ID；
+    整页无法处理 (queue_page 返回 None) 时为本页全部动态的 ID。on_page_written 返回 True 时立即停止：
+    不再获取新页，已获取但尚未写入的页被丢弃 (已排队的图片下载仍会完成并留在图片仓库中)。exporter (biliq_export.JsonlExporter) 不为空时，
+    每页在解析前先把原始卡片追加到导出文件。翻到最后一页、遇到 stop_at 水位或已翻 max_pages 页时停止获取。
+    返回 PIPELINE_DONE / PIPELINE_FETCH_FAILED / PIPELINE_PAGE_LIMIT / PIPELINE_STOPPED；获取失败前已获取的页仍会写完。
+    """
+    loop = asyncio.get_running_loop()
+    fetched, queued = asyncio.Queue(depth), asyncio.Queue(depth)
+    queued_ids = set()
+
+    async def fetch_stage():
+        page_offset, pages = offset, 0
+        try:
+            while True:
+                dynamics_page = await fetch_user_dynamics(uid, credential, offset=page_offset, limiter=limiter)
+                if dynamics_page is None or not isinstance(dynamics_page.get('cards'), list):
+                    result = PIPELINE_FETCH_FAILED
+                    break
+                pages += 1
+                await fetched.put(dynamics_page)
+                next_offset = dynamics_page.get('next_offset') or 0
+                if not dynamics_page.get('has_more') or not next_offset or not dynamics_page['cards'] \
+                        or _page_reaches_mark(dynamics_page, stop_at):
+                    result = PIPELINE_DONE
+                    break
+                if max_pages and pages >= max_pages:
+                    result = PIPELINE_PAGE_LIMIT
+                    break
+                if stop_at is not None: print(f"第 {pages} 页中没有遇到同步水位，继续向前翻页...")
+                page_offset = next_offset
+                await asyncio.sleep(page_interval)
+        except Exception:
+            await fetched.put(None)
+            raise
+        await fetched.put(None)
+        return result
+
+    async def queue_stage():
+        try:
+            while (dynamics_page := await fetched.get()) is not None:
+                if exporter is not None:
+                    await loop.run_in_executor(None, exporter.write_page, dynamics_page, uid)
+                page = await loop.run_in_executor(None, functools.partial(queue_page, dynamics_page,
+                                                                          queued_ids=queued_ids))
+                await queued.put((dynamics_page, page))
+        except Exception:
+            await queued.put(None)
+            raise
+        await queued.put(None)
+
+    fetch_task = asyncio.create_task(fetch_stage())
+    queue_task = asyncio.create_task(queue_stage())
+    try:
+        while (item := await queued.get()) is not None:
+            dynamics_page, page = item
+            if page is not None:
+                entries = await loop.run_in_executor(None, write_page, page)
+                failed_ids = page['failed_ids']
+            else:
+                entries = 0
+                failed_ids = [int(dynamic_id) for dynamic_id in map(card_dynamic_id, dynamics_page['cards'])
+                              if dynamic_id and str(dynamic_id).isdigit()]
+            stats['pages'] += 1
+            stats['cards'] += len(dynamics_page['cards'])
+            stats['entries'] += entries
+            if on_page_written and on_page_written(dynamics_page, failed_ids):
+                return PIPELINE_STOPPED # finally 中取消获取和解析阶段
+        await queue_task # 解析阶段的异常在这里抛出
+        return await fetch_task
+    finally:
+        for task in (fetch_task, queue_task):
+            if not task.done(): task.cancel()
+
+def load_targets(config):
+    """
+    读取抓取目标列表。
+    优先使用 TARGETS 列表，每项可单独指定 OUTPUT_MD_FILE / IMAGE_DIR / BACKFILL_STATE_FILE；
+    未配置 TARGETS 时退回到单个 TARGET_UID (兼容旧配置)。
+    ARCHIVE_DIR 为分段归档目录，默认放在 OUTPUT_MD_FILE 旁边；IMAGE_PROFILE 为归档图片规格，
+    默认取全局的 ARCHIVE_IMAGE_PROFILE (原图)。
+    """
+    targets_config = config.get("TARGETS")
+    if not targets_config:
+        if not config.get("TARGET_UID"): return []
+        output_md_file = config.get("OUTPUT_MD_FILE", "bilibili_dynamics.md")
+        return [{
+            'uid': config["TARGET_UID"],
+            'name': str(config["TARGET_UID"]),
+            'output_md_file': output_md_file,
+            'archive_dir': config.get("ARCHIVE_DIR", default_archive_dir(output_md_file)),
+            'image_dir': config.get("IMAGE_DIR", "bili_images"),
+            'image_profile': config.get("ARCHIVE_IMAGE_PROFILE", ORIGINAL_PROFILE),
+            'state_file': config.get("BACKFILL_STATE_FILE", BACKFILL_STATE_FILE),
+        }]
+
+    targets = []
+    for target_config in targets_config:
+        if not isinstance(target_config, dict): target_config = {"UID": target_config}
+        uid = target_config.get("UID")
+        if not uid:
+            print(f"警告：TARGETS 中的条目缺少 UID，已忽略: {target_config}")
+            continue
+        output_md_file = target_config.get("OUTPUT_MD_FILE", f"bilibili_dynamics_{uid}.md")
+        targets.append({
+            'uid': uid,
+            'name': target_config.get("NAME", str(uid)),
+            'output_md_file': output_md_file,
+            'archive_dir': target_config.get("ARCHIVE_DIR", default_archive_dir(output_md_file)),
+            'image_dir': target_config.get("IMAGE_DIR", os.path.join(config.get("IMAGE_DIR", "bili_images"), str(uid))),
+            'image_profile': target_config.get("IMAGE_PROFILE", config.get("ARCHIVE_IMAGE_PROFILE", ORIGINAL_PROFILE)),
+            'state_file': target_config.get("BACKFILL_STATE_FILE", f"backfill_state_{uid}.json"),
+        })
+    return targets
+
+async def run_target(target, credential, limiter, backfill=False, page_interval=BACKFILL_PAGE_INTERVAL,
+                     max_pages=SYNC_MAX_PAGES, exporter=None):
+    """抓取单个目标并写入它自己的 Markdown 文件和图片目录，返回吞吐统计。"""
+    stats = new_target_stats()
+    start_time = time.monotonic()
+    try:
+        # 先把旧的单文件归档拆成分段，全文索引的一次性导入才能看到已有的题目
+        migrate_legacy_markdown(target['output_md_file'], target['archive_dir'])
+        update_search_index([], target['archive_dir'], target['uid'])
+    except Exception as e:
+        print(f"错误：迁移现有 Markdown 文件 {target['output_md_file']} 到分段归档失败，暂不导入全文索引: {e}")
+    try:
+        if backfill:
+            stats['ok'] = await backfill_user_dynamics(target['uid'], credential, target['output_md_file'],
+                                                       target['image_dir'], target['state_file'], page_interval,
+                                                       limiter=limiter, stats=stats, archive_dir=target['archive_dir'],
+                                                       image_profile=target['image_profile'], exporter=exporter)
+        else:
+            print(f"\n[{target['name']}] 开始增量同步...")
+            stats['ok'] = await sync_user_dynamics(target['uid'], credential, target['output_md_file'],
+                                                   target['image_dir'], limiter=limiter, stats=stats,
+                                                   archive_dir=target['archive_dir'],
+                                                   image_profile=target['image_profile'],
+                                                   page_interval=page_interval, max_pages=max_pages,
+                                                   exporter=exporter)
+    except Exception as e:
+        print(f"错误：处理目标 {target['name']} (UID {target['uid']}) 时发生意外错误: {e}")
+        traceback.print_exc()
+    stats['elapsed'] = time.monotonic() - start_time
+    return stats
+
+async def run_targets(targets, credential, limiter, backfill=False, page_interval=BACKFILL_PAGE_INTERVAL,
+                      max_pages=SYNC_MAX_PAGES, exporter=None):
+    """在同一个事件循环中并发抓取所有目标，请求速率由共享的 limiter 统一限制。"""
+    return await asyncio.gather(*(run_target(target, credential, limiter, backfill, page_interval, max_pages, exporter)
+                                  for target in targets))
+
+def export_targets(targets):
+    """把每个目标的分段归档导出为原来的单文件 Markdown (不访问网络)。"""
+    for target in targets:
+        try:
+            migrate_legacy_markdown(target['output_md_file'], target['archive_dir'])
+            export_markdown(target['archive_dir'], target['output_md_file'])
+        except (IOError, ValueError) as e:
+            print(f"错误：导出 {target['archive_dir']} 到 {target['output_md_file']} 失败: {e}")
+            return False
+    return True
+
+def print_throughput_report(targets, results, limiter=None):
+    print("\n--- 各目标吞吐统计 ---")
+    for target, stats in zip(targets, results):
+        elapsed = stats['elapsed'] or 1e-9
+        status = "成功" if stats['ok'] else "失败"
+        print(f"  {target['name']} (UID {target['uid']}) [{status}]: {stats['pages']} 页, {stats['cards']} 条动态, "
+              f"新增 {stats['entries']} 题, 耗时 {stats['elapsed']:.1f}s, "
+              f"{stats['cards'] / elapsed:.1f} 条/秒, {stats['pages'] / elapsed:.2f} 页/秒")
+    if limiter is not None:
+        print(f"  限速器累计等待: {limiter.waited:.1f}s (速率 {limiter.rate:g} 次/秒, 突发 {limiter.capacity:g})")
 
 if __name__ == "__main__":
     print("--- Bilibili 动态 Markdown 生成器 (每日一题筛选版) ---")
@@ -291,21 +623,70 @@ if __name__ == "__main__":
     if not config:
         sys.exit(1)
 
-    TARGET_UID = config.get("TARGET_UID")
-    OUTPUT_MD_FILE = config.get("OUTPUT_MD_FILE", "bilibili_dynamics.md")
-    IMAGE_DIR = config.get("IMAGE_DIR", "bili_images")
+    TARGETS = load_targets(config)
     CREDS_CONFIG = config.get("CREDENTIALS", {})
+    PAGE_INTERVAL = float(config.get("BACKFILL_PAGE_INTERVAL", BACKFILL_PAGE_INTERVAL))
+    MAX_SYNC_PAGES = int(config.get("SYNC_MAX_PAGES", SYNC_MAX_PAGES))
 
-    if not TARGET_UID:
-        print(f"错误: 配置文件 {CONFIG_FILE} 中缺少 TARGET_UID。")
+    if not TARGETS:
+        print(f"错误: 配置文件 {CONFIG_FILE} 中缺少 TARGET_UID 或 TARGETS。")
         sys.exit(1)
 
-    print(f"目标用户 UID: {TARGET_UID}")
-    print(f"输出 Markdown 文件: {OUTPUT_MD_FILE}")
-    print(f"图片保存目录: {IMAGE_DIR}")
+    for target in TARGETS:
+        print(f"目标用户 UID: {target['uid']} ({target['name']})")
+        print(f"  归档目录: {target['archive_dir']}")
+        print(f"  导出 Markdown 文件: {target['output_md_file']}")
+        print(f"  图片保存目录: {target['image_dir']}")
+    configure_api(config)
+    configure_downloader(config)
+    configure_state_store(config)
+    configure_metrics(config)
+    configure_search_index(config)
+    configure_phash_index(config)
+    configure_journal(config)
+    limiter = limiter_from_config(config)
+
+    args = sys.argv[1:]
+    # --profile: 按阶段剖析 CPU 和内存，报告写入 PROFILE_DIR
+    profile = '--profile' in args
+    if profile: args.remove('--profile')
+    configure_profiler(config, profile)
+    if '--export' in args:
+        sys.exit(0 if export_targets(TARGETS) else 1)
+
+    backfill = '--backfill' in args
+    if backfill:
+        args.remove('--backfill')
+        print("回溯模式：将翻阅全部历史动态，游标保存在 " + ", ".join(t['state_file'] for t in TARGETS))
+
+    # 先补写上次运行中断时留在运行日志里的条目，即使本次所有目标都因 SYNC_MIN_INTERVAL 跳过
+    journal = resume_journal()
+
+    force = '--force' in args
+    if force: args.remove('--force')
+    if not backfill and not force:
+        min_interval = float(config.get("SYNC_MIN_INTERVAL", SYNC_MIN_INTERVAL))
+        due_targets = [target for target in TARGETS if sync_due(target['uid'], min_interval)]
+        if len(due_targets) < len(TARGETS):
+            print(f"\n{len(TARGETS) - len(due_targets)} 个目标在 {min_interval:g} 秒内已同步过，本次跳过 (--force 强制同步)。")
+        if not due_targets:
+            if journal is not None: journal.finish_run(RUN_OK)
+            print("\n--- 没有需要同步的目标 ---")
+            sys.exit(0)
+        TARGETS = due_targets
+
+    raw_export_file = config.get("RAW_EXPORT_FILE")
+    if '--export-jsonl' in args:
+        position = args.index('--export-jsonl')
+        if position + 1 >= len(args):
+            print("错误: --export-jsonl 需要指定导出文件，例如 --export-jsonl dynamics.jsonl.gz")
+            sys.exit(1)
+        raw_export_file = args[position + 1]
+        del args[position:position + 2]
+    exporter = open_exporter(raw_export_file)
 
     use_login = False
-    if len(sys.argv) > 1 and sys.argv[1] == '1':
+    if args and args[0] == '1':
         use_login = True
         print("\n请求使用登录模式 (命令行参数 '1').")
     else:
@@ -314,39 +695,37 @@ if __name__ == "__main__":
 
     credential = None
     if use_login:
-        SESSDATA = CREDS_CONFIG.get("SESSDATA")
-        BILI_JCT = CREDS_CONFIG.get("BILI_JCT")
-        BUVID3 = CREDS_CONFIG.get("BUVID3")
-        DEDEUSERID = CREDS_CONFIG.get("DEDEUSERID")
-
-        if not SESSDATA or not BILI_JCT or not BUVID3:
-            print("\n错误：请求了登录模式，但 config.json 中 CREDENTIALS 部分缺少必要的 SESSDATA, BILI_JCT 或 BUVID3。")
+        credential = build_credential(CREDS_CONFIG)
+        if credential is None:
             print("将尝试切换回匿名模式。")
             use_login = False
-        else:
-            print("正在使用 config.json 中的 Cookie 信息创建凭据...")
-            try:
-                 dedeuserid_val = DEDEUSERID if DEDEUSERID and DEDEUSERID.strip() else None
-                 credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3, dedeuserid=dedeuserid_val)
-                 print("凭据创建成功。")
-            except Exception as e:
-                 print(f"错误：创建 Credential 对象失败：{e}")
-                 print("将尝试切换回匿名模式。")
-                 use_login = False
-                 credential = None
-
-    dynamics_data = asyncio.run(fetch_user_dynamics(TARGET_UID, credential))
 
-    if dynamics_data:
-        print("\n开始处理动态数据并生成 Markdown...")
-        process_dynamics_to_markdown(dynamics_data, OUTPUT_MD_FILE, IMAGE_DIR)
+    try:
+        results = asyncio.run(run_targets(TARGETS, credential, limiter, backfill, PAGE_INTERVAL, MAX_SYNC_PAGES,
+                                          exporter))
+    finally:
+        if exporter is not None: exporter.close()
+        close_downloader() # 保存图片主机的延迟统计
+    if journal is not None: journal.finish_run(RUN_OK if all(stats['ok'] for stats in results) else RUN_FAILED)
+    print_throughput_report(TARGETS, results, limiter)
+    print_stage_summary()
+    write_metrics("biliq_daily")
+    write_profile_reports("biliq_daily")
+
+    if config.get("EXPORT_AFTER_RUN"):
+        export_targets(TARGETS)
+
+    if all(stats['ok'] for stats in results):
         print("\n--- 处理完成 ---")
+    elif backfill:
+        print("\n--- 回溯未完成，请稍后重新运行 ---")
+        sys.exit(1)
     else:
-        print("\n未能成功获取动态数据，程序退出。请检查：")
+        print("\n未能成功获取部分或全部目标的动态数据。请检查：")
         print(f"1. 网络连接是否正常。")
         if use_login: print("2. config.json 中的 Cookie (SESSDATA, bili_jct, buvid3) 是否仍然有效且未过期。")
         else: print("2. 目标用户的动态是否公开可见，或是否需要登录查看。")
-        print(f"3. 目标用户 UID ({TARGET_UID}) 是否正确。")
+        failed_uids = ", ".join(str(t['uid']) for t, stats in zip(TARGETS, results) if not stats['ok'])
+        print(f"3. 目标用户 UID ({failed_uids}) 是否正确。")
         print(f"4. 是否触发了 B站的风控策略 (如请求过于频繁)。")
         sys.exit(1)
-
@@ -0,0 +1,526 @@
+"""
+图片下载子系统。
+
+所有下载共用一个 keep-alive 的 requests.Session，并通过线程池做有界并发；
+连接池按主机限制连接数 (pool_block=True)，同一 CDN 节点上的并发请求会排队复用已建立的连接，
+而不是每张图片都重新进行一次 TCP/TLS 握手。
+
+下载结果存入内容寻址仓库 (见 biliq_imagestore)：已经下载过的 URL 不再访问网络，
+需要复查时带上 ETag / Last-Modified 发条件请求，服务器返回 304 即直接复用仓库中的对象。
+
+B站图床 (*.hdslb.com) 支持在 URL 后追加 @{w}w_{h}h_{q}q.webp 之类的后缀，由服务端缩放和转码。
+IMAGE_PROFILES 定义了几种图片规格，resolve_variant() 负责改写 URL、确定扩展名和存放位置。
+
+B站图床的 i0/i1/i2.hdslb.com 是内容相同的镜像主机。下载时先请求历史延迟最好的主机，
+若它在按历史延迟学习到的分位数 (HEDGE_PERCENTILE) 内没有完成，就向另一个镜像发出对冲请求；
+两个请求各自流式写入仓库的临时文件，先完整下载的一个胜出，另一个被取消并删除临时文件。
+主机失败 (连接错误或 5xx) 时也会立即改用下一个镜像。每个主机的延迟样本保存在 DOWNLOAD_HOST_STATS 文件中，
+下次运行据此选择主机。被取消的请求只知道延迟的下限，不记为样本，而是记一次落败，按 LOSS_PENALTY 折算。
+
+requests 在第一次创建下载器时才导入，共享下载器也在第一次需要下载时才创建。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from biliq_archive import atomic_write_text
+from biliq_imagestore import STORE_DIR_NAME, ImageStore, link_alias
+from biliq_metrics import get_metrics
+from biliq_profile import get_profiler, profile_section, profiled
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                   'Referer': 'https://www.bilibili.com/'}
+MAX_WORKERS = 8       # 同时进行的下载数上限
+PER_HOST_LIMIT = 4    # 每个主机的最大连接数
+POOL_HOSTS = 10       # 连接池缓存的主机数 (i0/i1/i2.hdslb.com 等)
+TIMEOUT = 30
+
+# 镜像主机与对冲请求
+MIRROR_HOSTS = ('i0.hdslb.com', 'i1.hdslb.com', 'i2.hdslb.com')
+HOST_STATS_FILE = "biliq_download_hosts.json"
+HOST_STATS_WINDOW = 200      # 每个主机保留的最近延迟样本数
+HEDGE_PERCENTILE = 0.95      # 主请求超过该分位数的历史延迟仍未完成时发出对冲请求
+HEDGE_MIN_SAMPLES = 10       # 样本不足时使用 HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.05
+FAILURE_PENALTY = 5.0        # 选择主机时每次近期失败折算的秒数
+LOSS_PENALTY = 1.0           # 选择主机时每次近期对冲落败 (请求被先完成的镜像取消) 折算的秒数
+
+# 图片规格：width/height 为最大宽高 (像素)，format 为转码格式，quality 为压缩质量。
+# 空规格表示原图。除原图外，每种规格存放在图片目录下与规格同名的子目录中。
+ORIGINAL_PROFILE = 'original'
+IMAGE_PROFILES = {
+    ORIGINAL_PROFILE: {},
+    'email': {'width': 1280, 'format': 'webp', 'quality': 80},
+    'thumbnail': {'width': 240, 'height': 240, 'format': 'webp', 'quality': 75},
+}
+VARIANT_HOST_SUFFIX = '.hdslb.com'
+
+
+def normalize_url(url):
+    """补全缺少协议的图片 URL (B站接口里常见 //i0.hdslb.com/... 形式)。"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'http:' + url if url.startswith('//') else 'https://' + url
+    return url
+
+
+def image_base_name(question_number, date_for_filename, index=0):
+    """
+    题目图片的文件名 (不含扩展名)。第一张沿用 N_YYYY_MM_DD，
+    同一动态的其余图片依次为 N_YYYY_MM_DD_2、N_YYYY_MM_DD_3 ...，重复运行得到的名字不变。
+    """
+    base_name = f"{question_number}_{date_for_filename}"
+    return base_name if index == 0 else f"{base_name}_{index + 1}"
+
+
+def image_extension(url, default='.jpg'):
+    """从 URL 路径推断扩展名 (忽略查询参数和 @ 后缀)。"""
+    _, ext = os.path.splitext(url.split('?')[0].split('@')[0])
+    if not ext or len(ext) > 6: ext = default # Allow slightly longer extensions like .jpeg
+    return ext.lower()
+
+
+def is_variant_host(url):
+    return (urlsplit(url).hostname or '').endswith(VARIANT_HOST_SUFFIX)
+
+
+def variant_url(url, profile):
+    """
+    按规格改写图床 URL，例如 .../abc.png -> .../abc.png@1280w_80q.webp；空规格返回去掉 @ 后缀的原图 URL。
+    非 B站图床的 URL 不支持缩放：空规格时原样返回，否则返回 None。
+    """
+    url = normalize_url(url)
+    if not is_variant_host(url):
+        return None if profile else url
+    base = url.split('?')[0].split('@')[0]
+    if not profile:
+        return base
+    params = []
+    if profile.get('width'): params.append(f"{int(profile['width'])}w")
+    if profile.get('height'): params.append(f"{int(profile['height'])}h")
+    if profile.get('quality'): params.append(f"{int(profile['quality'])}q")
+    return f"{base}@{'_'.join(params)}.{profile.get('format', 'webp')}"
+
+
+def resolve_variant(url, image_dir, base_name, profile_name=ORIGINAL_PROFILE):
+    """
+    返回 (请求 URL, 存放目录, 文件名)。
+    原图存放在 image_dir/base_name.<原扩展名>，其他规格存放在 image_dir/<规格名>/base_name.<规格格式>。
+    只有 B站图床支持服务端缩放，其他 URL 一律按原图处理。
+    """
+    profile = IMAGE_PROFILES.get(profile_name)
+    if profile is None:
+        print(f"  警告：未定义的图片规格 {profile_name}，改用原图。")
+        profile = {}
+    request_url = variant_url(url, profile)
+    if not profile or request_url is None:
+        return variant_url(url, {}), image_dir, f"{base_name}{image_extension(url)}"
+    return request_url, os.path.join(image_dir, profile_name), f"{base_name}.{profile.get('format', 'webp')}"
+
+
+class HostLatencyStats:
+    """
+    每个图片主机最近的下载延迟 (从发出请求到完整收到响应的秒数)、近期失败次数和对冲落败次数。
+    hedge_delay() 给出发出对冲请求前的等待时间，rank() 按历史表现给候选主机排序。
+    """
+
+    def __init__(self, window=HOST_STATS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._failures = {}
+        self._losses = {}
+
+    def record(self, host, seconds):
+        with self._lock:
+            self._samples.setdefault(host, deque(maxlen=self.window)).append(seconds)
+            # 成功一次抵消一半的近期失败和落败
+            if self._failures.get(host): self._failures[host] //= 2
+            if self._losses.get(host): self._losses[host] //= 2
+
+    def record_failure(self, host):
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+
+    def record_loss(self, host):
+        """请求被先完成的镜像取消：此时的耗时只是延迟的下限，记为样本会让慢的镜像显得更快，因此只计数。"""
+        with self._lock:
+            self._losses[host] = self._losses.get(host, 0) + 1
+
+    def percentile(self, host, q):
+        """返回主机延迟的 q 分位数；没有样本时返回 None。"""
+        with self._lock:
+            samples = sorted(self._samples.get(host) or ())
+        if not samples: return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def hedge_delay(self, host, q=HEDGE_PERCENTILE, timeout=TIMEOUT):
+        with self._lock:
+            enough = len(self._samples.get(host) or ()) >= HEDGE_MIN_SAMPLES
+        if not enough: return HEDGE_DEFAULT_DELAY
+        return min(max(self.percentile(host, q), HEDGE_MIN_DELAY), timeout)
+
+    def score(self, host):
+        median = self.percentile(host, 0.5)
+        with self._lock:
+            failures = self._failures.get(host, 0)
+            losses = self._losses.get(host, 0)
+        return (HEDGE_DEFAULT_DELAY if median is None else median) + failures * FAILURE_PENALTY + \
+            losses * LOSS_PENALTY
+
+    def rank(self, hosts):
+        """按 (中位延迟 + 失败和落败惩罚) 从好到坏排序；分数相同时保持原顺序。"""
+        return sorted(hosts, key=self.score)
+
+    def to_dict(self):
+        with self._lock:
+            return {'samples': {host: [round(s, 4) for s in samples] for host, samples in self._samples.items()},
+                    'failures': {host: n for host, n in self._failures.items() if n},
+                    'losses': {host: n for host, n in self._losses.items() if n}}
+
+    def load(self, path):
+        """读取保存的统计；文件不存在或损坏时保持为空。"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for host, samples in (data.get('samples') or {}).items():
+                self._samples[host] = deque((float(s) for s in samples), maxlen=self.window)
+            self._failures.update({host: int(n) for host, n in (data.get('failures') or {}).items()})
+            self._losses.update({host: int(n) for host, n in (data.get('losses') or {}).items()})
+
+    def save(self, path):
+        try:
+            atomic_write_text(path, json.dumps(self.to_dict(), ensure_ascii=False, indent=1))
+        except OSError as e:
+            print(f"警告：无法保存图片主机延迟统计 {path}: {e}")
+
+
+def _discard_attempt(future):
+    """被取消的对冲请求若已下载完整，删除它的临时文件。"""
+    if future.cancelled() or future.exception() is not None: return
+    result = future.result()
+    if result and result[2]:
+        try: os.remove(result[2])
+        except OSError: pass
+
+
+class ImageDownloader:
+    """带连接池的并发图片下载器。submit() 排队下载并返回 Future，download() 同步下载。"""
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, timeout=TIMEOUT,
+                 store_dir=None, revalidate=False, cdn_base_url=None, hedge=True, hedge_percentile=HEDGE_PERCENTILE,
+                 mirror_hosts=MIRROR_HOSTS, host_stats_file=None):
+        """
+        store_dir 为图片仓库目录，默认在每个图片目录下使用 .store；
+        revalidate 为 True 时，仓库中已有的图片也会发条件请求确认是否有更新；
+        cdn_base_url 用于离线测试：http://host/path 会改为请求 <cdn_base_url>/host/path，仓库仍按原 URL 记录；
+        hedge 为 False 时只请求 URL 原本的主机；host_stats_file 为主机延迟统计的保存位置 (None 表示不保存)。
+        """
+        self.timeout = timeout
+        self.cdn_base_url = cdn_base_url.rstrip('/') if cdn_base_url else None
+        self.store_dir = store_dir
+        self.revalidate = revalidate
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.mirror_hosts = tuple(mirror_hosts or ())
+        self.host_stats = HostLatencyStats()
+        self.host_stats_file = host_stats_file
+        if host_stats_file: self.host_stats.load(host_stats_file)
+        self._stores = {}
+        self._stores_lock = threading.Lock()
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=per_host_limit, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if self.cdn_base_url:
+            # 回放时所有镜像都指向同一个地址，为每个镜像单独建连接池，连接数限制与直连时一致
+            for host in self.mirror_hosts:
+                self.session.mount(f"{self.cdn_base_url}/{host}/",
+                                   HTTPAdapter(pool_maxsize=per_host_limit, pool_block=True))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='biliq-download')
+        # 每个下载最多同时有主请求和对冲请求两个请求在进行
+        self._attempt_executor = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix='biliq-fetch')
+
+    def submit(self, url, folder, filename):
+        """将下载任务放入队列，返回结果为本地路径 (失败时为 None) 的 Future。"""
+        return self._executor.submit(self.download, url, folder, filename)
+
+    def route(self, url):
+        """返回实际请求的地址 (配置了 cdn_base_url 时指向本地回放服务器)。"""
+        if not self.cdn_base_url: return url
+        parts = urlsplit(url)
+        return f"{self.cdn_base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+    def candidate_urls(self, url):
+        """返回按主机历史表现排序的候选 URL；不属于镜像主机的 URL 只有它自己。"""
+        parts = urlsplit(url)
+        if not self.hedge or parts.hostname not in self.mirror_hosts:
+            return [url]
+        hosts = [parts.hostname] + [h for h in self.mirror_hosts if h != parts.hostname]
+        return [parts._replace(netloc=host).geturl() for host in self.host_stats.rank(hosts)]
+
+    def store_for(self, folder):
+        root = self.store_dir or os.path.join(folder, STORE_DIR_NAME)
+        with self._stores_lock:
+            store = self._stores.get(root)
+            if store is None:
+                store = self._stores[root] = ImageStore(root)
+                store.clean_temp()
+            return store
+
+    def download(self, url, folder, filename):
+        """
+        Downloads an image from a URL to a specified folder.
+        folder/filename 是指向仓库对象的链接；仓库中已有该 URL 时不访问网络。
+        """
+        with get_metrics().time('download'), profile_section('download'):
+            return self._download(url, folder, filename)
+
+    def _download(self, url, folder, filename):
+        import requests
+        metrics = get_metrics()
+        filepath = os.path.join(folder, filename)
+        url = normalize_url(url)
+        ext = os.path.splitext(filename)[1]
+
+        try:
+            store = self.store_for(folder)
+            meta = store.lookup(url)
+            if meta and not self.revalidate:
+                link_alias(meta['path'], filepath)
+                metrics.inc('downloads', result='store_hit')
+                print(f"  图片已在仓库中，跳过下载: {url} -> {filepath}")
+                return filepath
+            if meta is None and os.path.isfile(filepath):
+                if store.adopt(url, filepath):
+                    metrics.inc('downloads', result='adopted')
+                    print(f"  图片已存在，收入仓库并跳过下载: {filepath}")
+                    return filepath
+                metrics.inc('downloads', result='incomplete_local')
+                print(f"  已存在的图片文件不完整，重新下载: {filepath}")
+
+            headers = {}
+            if meta and meta['etag']: headers['If-None-Match'] = meta['etag']
+            if meta and meta['last_modified']: headers['If-Modified-Since'] = meta['last_modified']
+
+            print(f"  正在下载图片: {url} -> {filepath}")
+            status, response_headers, tmp_path, sha256, size = self._fetch(url, store, headers)
+            if status == 304 and meta:
+                link_alias(meta['path'], filepath)
+                metrics.inc('downloads', result='not_modified')
+                print(f"  图片未变化 (304)，复用仓库中的文件: {filepath}")
+                return filepath
+            object_path = store.commit_file(tmp_path, sha256, ext)
+            store.record(url, sha256, ext, size, response_headers.get('ETag'), response_headers.get('Last-Modified'))
+            link_alias(object_path, filepath)
+            metrics.inc('downloads', result='downloaded')
+            metrics.inc('download_bytes', size)
+            return filepath
+        except requests.exceptions.MissingSchema: print(f"  下载图片失败: 无效的URL: {url}")
+        except requests.exceptions.HTTPError as e: print(f"  下载图片失败: HTTP错误 {e.response.status_code} for {url}")
+        except requests.exceptions.RequestException as e: print(f"  下载图片失败: {url} - {e}")
+        except IOError as e: print(f"  保存图片失败: {filepath} - {e}")
+        metrics.inc('downloads', result='failed')
+        return None
+
+    def _fetch(self, url, store, headers):
+        """
+        下载 url，返回 (状态码, 响应头, 临时文件, sha256, 字节数)；304 时临时文件为 None。
+        主请求在对冲等待时间内没有完成时向下一个镜像发出对冲请求，先完整下载的请求胜出，其余请求被取消；
+        请求失败 (连接错误或 5xx) 时立即改用下一个镜像。全部失败时抛出最后一个异常。
+        """
+        candidates = self.candidate_urls(url)
+        cancel = threading.Event()
+        if len(candidates) == 1:
+            return self._attempt(candidates[0], store, headers, cancel)
+        metrics = get_metrics()
+        primary_host = urlsplit(candidates[0]).hostname
+        pending = {}
+        error = None
+        hedged = False
+
+        def launch():
+            candidate = candidates.pop(0)
+            pending[self._attempt_executor.submit(profiled('download', self._attempt), candidate, store, headers,
+                                                  cancel)] = candidate
+
+        launch()
+        try:
+            while pending:
+                delay = None
+                if candidates and not hedged:
+                    delay = self.host_stats.hedge_delay(primary_host, self.hedge_percentile, self.timeout)
+                done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    metrics.inc('download_hedges', result='sent')
+                    launch()
+                    continue
+                for future in done:
+                    candidate = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = e
+                        if pending or not candidates or not self._should_failover(e): continue
+                        print(f"  {urlsplit(candidate).hostname} 请求失败，改用镜像 {urlsplit(candidates[0]).hostname}")
+                        metrics.inc('download_hedges', result='failover')
+                        launch()
+                        continue
+                    if result is None: continue
+                    if hedged:
+                        metrics.inc('download_hedges',
+                                    result='won' if urlsplit(candidate).hostname != primary_host else 'lost')
+                    for other in done - {future}:
+                        _discard_attempt(other)
+                    return result
+            raise error
+        finally:
+            cancel.set()
+            for future in pending:
+                future.add_done_callback(_discard_attempt)
+
+    @staticmethod
+    def _should_failover(error):
+        import requests
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        return isinstance(error, requests.exceptions.RequestException)
+
+    def _attempt(self, url, store, headers, cancel):
+        """
+        请求一个镜像并流式写入仓库的临时文件，边写边算哈希。cancel 被设置时尽快放弃并删除临时文件，返回 None。
+        完成的请求记录该主机的延迟，被取消的请求记一次落败 (不记延迟)，连接错误和 5xx 记为失败。
+        """
+        import requests
+        host = urlsplit(url).hostname
+        start = time.perf_counter()
+        tmp_path = None
+        try:
+            with self.session.get(self.route(url), stream=True, timeout=self.timeout, headers=headers) as response:
+                if (response.status_code == 304 and headers) or cancel.is_set():
+                    result = (response.status_code, response.headers, None, None, 0)
+                else:
+                    response.raise_for_status()
+                    f, tmp_path = store.new_temp_file()
+                    digest = hashlib.sha256()
+                    size = 0
+                    try:
+                        with f:
+                            for chunk in response.iter_content(chunk_size=65536):
+                                if cancel.is_set(): break
+                                f.write(chunk)
+                                digest.update(chunk)
+                                size += len(chunk)
+                    except BaseException:
+                        os.remove(tmp_path)
+                        raise
+                    result = (response.status_code, response.headers, tmp_path, digest.hexdigest(), size)
+        except requests.exceptions.RequestException as e:
+            if self._should_failover(e): self.host_stats.record_failure(host)
+            raise
+        if cancel.is_set():
+            self.host_stats.record_loss(host)
+            if tmp_path: os.remove(tmp_path)
+            return None
+        elapsed = time.perf_counter() - start
+        self.host_stats.record(host, elapsed)
+        get_metrics().observe('download_host_seconds', elapsed, host=host)
+        return result
+
+    def save_host_stats(self):
+        """把各图片主机的延迟统计写回 host_stats_file，下次运行据此选择最快的镜像。"""
+        # 剖析模式下测得的延迟被 cProfile / tracemalloc 的开销放大数倍，写回后下次运行的镜像排序和对冲等待时间
+        # 都会按失真的数据计算，因此不保存
+        if self.host_stats_file and get_profiler() is None: self.host_stats.save(self.host_stats_file)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._attempt_executor.shutdown(wait=True)
+        self.save_host_stats()
+        self.session.close()
+        with self._stores_lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_shared_downloader = None
+_shared_lock = threading.Lock()
+_downloader_options = {}
+
+
+def get_downloader():
+    """返回进程内共享的下载器，首次调用时按 configure_downloader() 的设置创建。"""
+    global _shared_downloader
+    with _shared_lock:
+        if _shared_downloader is None:
+            _shared_downloader = ImageDownloader(**_downloader_options)
+        return _shared_downloader
+
+
+def close_downloader():
+    """
+    关闭共享下载器：等待排队的下载完成，保存各图片主机的延迟统计 (下次运行据此选择最快的镜像)，释放连接和仓库。
+    没有创建过下载器时不做任何事；之后再调用 get_downloader() 会重新创建。
+    """
+    global _shared_downloader
+    with _shared_lock:
+        downloader, _shared_downloader = _shared_downloader, None
+    if downloader is not None:
+        downloader.close()
+
+
+def save_download_stats():
+    """常驻进程每轮检查后调用：不关闭共享下载器，只保存图片主机的延迟统计。"""
+    with _shared_lock:
+        downloader = _shared_downloader
+    if downloader is not None:
+        downloader.save_host_stats()
+
+
+def configure_downloader(config):
+    """
+    按 config.json 中的 DOWNLOAD_WORKERS / DOWNLOAD_PER_HOST / IMAGE_STORE_DIR / IMAGE_REVALIDATE / CDN_BASE_URL /
+    DOWNLOAD_HEDGE / HEDGE_PERCENTILE / DOWNLOAD_MIRRORS / DOWNLOAD_HOST_STATS 设置共享下载器 (在第一次 get_downloader() 时创建)，
+    并用 IMAGE_PROFILES 覆盖或补充默认的图片规格。
+    """
+    global _shared_downloader
+    for name, profile in (config.get("IMAGE_PROFILES") or {}).items():
+        IMAGE_PROFILES[name] = dict(profile or {})
+    with _shared_lock:
+        if _shared_downloader is not None:
+            _shared_downloader.close()
+            _shared_downloader = None
+        _downloader_options.clear()
+        _downloader_options.update(max_workers=int(config.get("DOWNLOAD_WORKERS", MAX_WORKERS)),
+                                   per_host_limit=int(config.get("DOWNLOAD_PER_HOST", PER_HOST_LIMIT)),
+                                   store_dir=config.get("IMAGE_STORE_DIR"),
+                                   revalidate=bool(config.get("IMAGE_REVALIDATE", False)),
+                                   cdn_base_url=config.get("CDN_BASE_URL"),
+                                   hedge=bool(config.get("DOWNLOAD_HEDGE", True)),
+                                   hedge_percentile=float(config.get("HEDGE_PERCENTILE", HEDGE_PERCENTILE)),
+                                   mirror_hosts=config.get("DOWNLOAD_MIRRORS", MIRROR_HOSTS),
+                                   host_stats_file=config.get("DOWNLOAD_HOST_STATS", HOST_STATS_FILE))
+
+
+def download_image(url, folder, filename):
+    """Downloads an image from a URL to a specified folder (using the shared pooled session)."""
+    return get_downloader().download(url, folder, filename)
@@ -1,21 +1,33 @@
 import asyncio
+import functools
 import os
 import sys
 import json
-import smtplib
-import schedule
-import time
-from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from bilibili_api import user, Credential, exceptions
+from datetime import datetime, timedelta
 import re
 import traceback
-import requests
+from biliq_api import build_credential, configure_api, fetch_user_dynamics
+from biliq_download import (close_downloader, configure_downloader, get_downloader, image_base_name, resolve_variant,
+                            save_download_stats)
+from biliq_extract import extract_questions
+from biliq_mail import (DIGEST_MAX_BYTES, build_digest_message, build_question_message, parse_recipients,
+                        pool_from_config, serialize_message)
+from biliq_metrics import configure_metrics, get_metrics, print_stage_summary, start_metrics_server, write_metrics
+from biliq_profile import configure_profiler, write_profile_reports
+from biliq_ratelimit import limiter_from_config
+from biliq_state import configure_state_store, get_state_store
 
 # --- 配置加载 ---
 CONFIG_FILE = "config.json"
+EMAIL_IMAGE_PROFILE = "email" # 邮件默认使用服务端缩放后的 WebP，附件体积小一个数量级
+PUBLISH_TIME = "08:00"        # UP 主通常的发布时间
+POLL_WINDOW_BEFORE = 10       # 轮询窗口：发布时间前 N 分钟开始
+POLL_WINDOW_AFTER = 180       # 轮询窗口：发布时间后 N 分钟结束
+POLL_INTERVAL = 30            # 窗口内的检查间隔 (秒)
+IDLE_POLL_INTERVAL = 1800     # 窗口外 (发布较晚时) 的检查间隔 (秒)
+EMAIL_MODE = "single"         # single: 每题一封；digest: 尚未送达的题目合成一封
+DIGEST_MAX_QUESTIONS = 14     # 一封合集邮件最多包含的题目数
+DIGEST_MAX_PAGES = 5          # 合集模式向前翻阅的最多页数
 
 def load_config(filename):
     """从JSON文件加载配置。"""
@@ -35,42 +47,6 @@ def load_config(filename):
         return None
 
 # --- 核心函数 ---
-async def fetch_user_dynamics(uid, credential=None):
-    """获取指定用户的B站动态列表 (第一页)。"""
-    mode = "登录模式" if credential else "匿名模式"
-    print(f"正在尝试以 {mode} 获取 UID {uid} 的第一页动态...")
-    try:
-        # 创建User对象，仅在存在时传递credential
-        target_user = user.User(uid=uid, credential=credential)
-
-        # 获取动态
-        dynamics_page = await asyncio.wait_for(target_user.get_dynamics(offset=0), timeout=30.0)
-
-        if dynamics_page and 'cards' in dynamics_page:
-            print(f"成功以 {mode} 获取 UID {uid} 的 {len(dynamics_page['cards'])} 条动态。")
-            return dynamics_page
-        elif dynamics_page and 'cards' not in dynamics_page:
-             print(f"获取到 UID {uid} 的动态数据 ({mode})，但 'cards' 键不存在。响应内容：{dynamics_page}")
-             return None
-        else:
-            print(f"获取 UID {uid} 的动态数据 ({mode}) 为空。")
-            return None
-    except asyncio.TimeoutError:
-        print(f"错误：获取 UID {uid} 动态超时 ({mode})。")
-        return None
-    except exceptions.ResponseCodeException as e:
-        print(f"错误：Bilibili API 返回错误码 {e.code} ({mode}): {e}")
-        if e.code == -101 and credential: print("  => 提示：可能是 B站账号未登录或 Cookie 已失效 (在 config.json 中)。")
-        elif e.code == -101 and not credential: print("  => 提示：此用户动态可能需要登录才能查看。")
-        elif e.code == -412: print("  => 提示：请求被拦截，可能是操作频繁或触发了风控。")
-        elif e.code == -352: print("  => 提示：验证失败，可能是 buvid3/csrf 不正确或缺失。")
-        elif e.code == 62002: print("  => 提示：目标用户设置了隐私，无法查看动态。")
-        return None
-    except Exception as e:
-        print(f"错误：获取 UID {uid} 动态时 ({mode}) 发生未知错误: {e}")
-        traceback.print_exc()
-        return None
-
 def sanitize_filename(filename):
     """移除或替换文件名中的无效字符。"""
     filename = filename.replace('/', '-').replace('\\', '-').replace('\0', '')
@@ -84,304 +60,468 @@ def sanitize_filename(filename):
     if not filename: filename = "untitled"
     return filename
 
-def download_image(url, folder, filename):
-    """从URL下载图片到指定文件夹。"""
-    filepath = os.path.join(folder, filename)
-    if not url.startswith(('http://', 'https://')):
-        url = 'http:' + url if url.startswith('//') else 'https://' + url
-
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                   'Referer': 'https://www.bilibili.com/'}
-        print(f"  正在下载图片: {url} -> {filepath}")
-        response = requests.get(url, stream=True, timeout=30, headers=headers)
-        response.raise_for_status()
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return filepath
-    except requests.exceptions.MissingSchema: print(f"  下载图片失败: 无效的URL: {url}"); return None
-    except requests.exceptions.HTTPError as e: print(f"  下载图片失败: HTTP错误 {e.response.status_code} for {url}"); return None
-    except requests.exceptions.RequestException as e: print(f"  下载图片失败: {url} - {e}"); return None
-    except IOError as e: print(f"  保存图片失败: {filepath} - {e}"); return None
-
-def process_dynamics_for_email(dynamics_data, image_dir):
-    """处理B站动态数据，筛选含"第N题"的图文动态，下载图片，并返回最新的一题。"""
+def process_dynamics_for_email(dynamics_data, image_dir, image_profile=EMAIL_IMAGE_PROFILE, last_sent_id=None):
+    """
+    处理B站动态数据，筛选含"第N题"的图文动态，按 image_profile 规格并行下载该动态的全部图片，
+    并返回最新的一题。任意一张图片下载失败时跳过该动态，不发送缺图的题目。
+    last_sent_id 为已发送的最新题目：遇到它 (或更早的动态) 即停止，不下载任何图片。
+    """
     if not (dynamics_data and 'cards' in dynamics_data and isinstance(dynamics_data['cards'], list)):
         print("动态数据无效或缺少 'cards' 列表，无法处理。")
         return None
 
     os.makedirs(image_dir, exist_ok=True)
 
-    items_list = dynamics_data['cards']
     latest_question = None
 
-    for item in items_list:
-        dynamic_id_for_error = item.get('desc', {}).get('dynamic_id_str', 'N/A')
-        try:
-            # 提取dynamic_id
-            dynamic_id = item.get('desc', {}).get('dynamic_id_str') or \
-                         item.get('display', {}).get('origin', {}).get('dynamic_id_str') or \
-                         item.get('desc', {}).get('rid_str') or \
-                         item.get('basic', {}).get('comment_id_str')
-
-            if not dynamic_id:
-                continue
-
-            card_value = item.get('card')
-            if not card_value: continue
-
-            card_data = None
-            if isinstance(card_value, str):
-                try: card_data = json.loads(card_value)
-                except json.JSONDecodeError as e: print(f"  错误：解析 card JSON 失败。ID: {dynamic_id}. Error: {e}"); continue
-            elif isinstance(card_value, dict): card_data = card_value
-            else: print(f"  警告：item['card'] 类型未知 ({type(card_value)})。跳过。 ID: {dynamic_id}"); continue
-
-            if not card_data: print(f"  内部错误：card_data 为空。跳过。 ID: {dynamic_id}"); continue
-
-            # 获取发布时间
-            pub_ts = item.get('desc', {}).get('timestamp') or \
-                     card_data.get('item', {}).get('upload_time')
-
-            # 提取内容 (适配多种结构)
-            major_module_items = None # 图片字典列表
-            description = None
-            module_dynamic = card_data.get('modules', {}).get('module_dynamic', {})
-
-            # 结构1: 'modules' -> 'module_dynamic' -> 'major' (draw) and 'desc'
-            if module_dynamic:
-                major_data = module_dynamic.get('major', {})
-                desc_data = module_dynamic.get('desc')
-                if major_data.get('type') == 'MAJOR_TYPE_DRAW':
-                     draw_data = major_data.get('draw')
-                     if draw_data and 'items' in draw_data and desc_data and 'text' in desc_data:
-                         major_module_items = draw_data['items']
-                         description = desc_data['text']
-
-            # 结构2: 直接 'item' 带有 'pictures' 和 'description' (旧格式或简单格式)
-            if major_module_items is None:
-                item_data = card_data.get('item', {})
-                if isinstance(item_data.get('pictures'), list) and item_data.get('description'):
-                    major_module_items = [{'src': pic.get('img_src')} for pic in item_data['pictures'] if pic.get('img_src')]
-                    description = item_data['description']
-
-            # 结构3: 转发动态的原始项目
-            if major_module_items is None and 'origin' in card_data:
-                 origin_card_value = card_data.get('origin')
-                 origin_card_data = None
-                 if isinstance(origin_card_value, str):
-                     try: origin_card_data = json.loads(origin_card_value)
-                     except json.JSONDecodeError: pass
-                 elif isinstance(origin_card_value, dict): origin_card_data = origin_card_value
-
-                 if origin_card_data:
-                    origin_item_data = origin_card_data.get('item', {})
-                    if isinstance(origin_item_data.get('pictures'), list) and origin_item_data.get('description'):
-                        major_module_items = [{'src': pic.get('img_src')} for pic in origin_item_data['pictures'] if pic.get('img_src')]
-                        description = origin_item_data['description']
-
-            if major_module_items is None or description is None:
-                 continue
-
-            # 核心筛选和信息提取
-            text_content = description.strip()
-            if not text_content: continue
-
-            # 严格筛选: 必须包含 "第 N 题"
-            question_match = re.search(r"第\s*(\d+)\s*题", text_content, re.IGNORECASE)
-            if not question_match:
-                continue
-            question_number = question_match.group(1) # 提取题号 N
-            print(f"  匹配到 '第 {question_number} 题', 处理中... ID: {dynamic_id}")
-
-            # 生成标题
-            title = f"每日一题 | 第 {question_number} 题"
-
-            # 格式化日期和时间字符串
-            pub_time_str = "未知时间"
-            formatted_date_for_filename = "nodate"
-            if pub_ts:
-                try:
-                    dt_object = datetime.fromtimestamp(int(pub_ts))
-                    pub_time_str = dt_object.strftime('%Y-%m-%d %H:%M')
-                    formatted_date_for_filename = dt_object.strftime('%Y_%m_%d')
-                except Exception as e:
-                    print(f"    解析时间戳失败: {pub_ts}, 错误: {e}")
-
-            # 提取图片 URL (第一张)
-            if not (isinstance(major_module_items, list) and len(major_module_items) > 0):
-                 print(f"  跳过：图片列表为空或无效。 ID: {dynamic_id}"); continue
-
-            image_info = major_module_items[0]
-            image_url = image_info.get('src')
-            if not image_url:
-                print(f"  跳过：无法获取图片 URL (检查 'src' key)。 ID: {dynamic_id}"); continue
-
-            # 下载图片
-            _, ext = os.path.splitext(image_url.split('?')[0])
-            if not ext or len(ext) > 6: ext = '.jpg'
-            image_filename = sanitize_filename(f"{question_number}_{formatted_date_for_filename}{ext}")
-            local_image_path = download_image(image_url, image_dir, image_filename)
-
-            if not local_image_path:
-                print(f"  处理失败：图片下载失败。跳过此动态。 ID: {dynamic_id}")
-                continue
-
-            # 如果是第一个匹配的题目，保存为最新题目
-            if latest_question is None:
-                latest_question = {
-                    'title': title,
-                    'text': text_content,
-                    'image_path': local_image_path,
-                    'pub_time': pub_time_str,
-                    'question_number': question_number
-                }
-                print(f"  找到最新题目：第 {question_number} 题")
-                break  # 只需要最新的一题
-
-        except Exception as e:
-            print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id_for_error}")
-            traceback.print_exc()
-            continue
+    for record in extract_questions(dynamics_data):
+        if last_sent_id and _is_not_newer(record.dynamic_id, last_sent_id):
+            print(f"  没有比已发送的题目 (ID: {last_sent_id}) 更新的每日一题。")
+            break
+        # 第一个成功处理的题目即为最新题目
+        latest_question = collect_question(*queue_question(record, image_dir, image_profile))
+        if latest_question:
+            print(f"  找到最新题目：第 {record.question_number} 题")
+            break  # 只需要最新的一题
 
     return latest_question
 
-def send_email(email_config, question_data):
-    """发送包含每日一题的邮件"""
+def process_dynamics_for_digest(dynamics_data, image_dir, image_profile=EMAIL_IMAGE_PROFILE, last_sent_id=None,
+                                limit=DIGEST_MAX_QUESTIONS):
+    """
+    合集模式：返回本页中比 last_sent_id 更新的全部题目 (从新到旧，最多 limit 道)，以及是否已遇到 last_sent_id。
+    所有题目的图片先全部排队并行下载，再按顺序收集；图片下载失败的题目被跳过。
+    """
+    if not (dynamics_data and 'cards' in dynamics_data and isinstance(dynamics_data['cards'], list)):
+        print("动态数据无效或缺少 'cards' 列表，无法处理。")
+        return [], True
+
+    os.makedirs(image_dir, exist_ok=True)
+
+    queued, reached = [], False
+    for record in extract_questions(dynamics_data):
+        if last_sent_id and _is_not_newer(record.dynamic_id, last_sent_id):
+            reached = True
+            break
+        if len(queued) >= limit: break
+        queued.append(queue_question(record, image_dir, image_profile))
+    questions = [question for question in (collect_question(*item) for item in queued) if question]
+    return questions, reached
+
+def queue_question(record, image_dir, image_profile=EMAIL_IMAGE_PROFILE):
+    """按规格改写 URL 并把题目的全部图片排队下载 (不同规格分目录存放)，返回 (题目, 下载任务列表或 None)。"""
+    question_number, dynamic_id = record.question_number, record.dynamic_id
+    print(f"  匹配到 '第 {question_number} 题', 处理中... ID: {dynamic_id}")
+    downloader = get_downloader()
+    try:
+        date_for_filename = record.date_for_filename
+        download_futures = []
+        for index, image_url in enumerate(record.image_urls):
+            request_url, image_folder, image_filename = resolve_variant(
+                image_url, image_dir, image_base_name(question_number, date_for_filename, index), image_profile)
+            download_futures.append(downloader.submit(request_url, image_folder, sanitize_filename(image_filename)))
+    except Exception as e:
+        print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id}")
+        traceback.print_exc()
+        return record, None
+    return record, download_futures
+
+def collect_question(record, download_futures):
+    """等待题目的图片下载完成，返回邮件使用的题目数据；任意一张图片下载失败时返回 None，不发送缺图的题目。"""
+    if download_futures is None: return None
+    dynamic_id = record.dynamic_id
+    try:
+        local_image_paths = [future.result() for future in download_futures]
+    except Exception as e:
+        print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id}")
+        traceback.print_exc()
+        return None
+
+    if not all(local_image_paths):
+        print(f"  处理失败：{local_image_paths.count(None)}/{len(local_image_paths)} 张图片下载失败。跳过此动态。 ID: {dynamic_id}")
+        return None
+
+    return {
+        'title': record.title,
+        'text': record.text,
+        'image_path': local_image_paths[0],
+        'image_paths': local_image_paths,
+        'image_urls': list(record.image_urls),
+        'pub_time': record.pub_time_str,
+        'question_number': record.question_number,
+        'dynamic_id': dynamic_id,
+        'pub_ts': record.pub_ts
+    }
+
+def _is_not_newer(dynamic_id, last_sent_id):
+    # 动态 ID 随发布时间递增
+    try: return int(dynamic_id) <= int(last_sent_id)
+    except (TypeError, ValueError): return str(dynamic_id) == str(last_sent_id)
+
+def send_email(email_config, question_data, ledger=None):
+    """
+    把每日一题邮件发给全部收件人 (见 biliq_mail)。全部送达时返回 True。
+    ledger 为状态库：已收到该题目的收件人不再发送，每送达一封立即记入投递记录。
+    """
     if not question_data:
         print("没有找到可发送的题目数据")
         return False
     
     try:
-        # 创建邮件
-        msg = MIMEMultipart()
-        msg['From'] = email_config['sender']
-        msg['To'] = email_config['receiver']
-        msg['Subject'] = f"B站每日一题 - {question_data['title']}"
-        
-        # 邮件正文
-        email_body = f"""
-        <html>
-        <body>
-            <h2>{question_data['title']} ({question_data['pub_time']})</h2>
-            <p><b>题目内容:</b></p>
-            <p>{question_data['text']}</p>
-            <p><img src="cid:question_image" width="80%"></p>
-        </body>
-        </html>
-        """
-        msg.attach(MIMEText(email_body, 'html'))
-        
-        # 添加图片附件
-        with open(question_data['image_path'], 'rb') as img_file:
-            img = MIMEImage(img_file.read())
-            img.add_header('Content-ID', '<question_image>')
-            msg.attach(img)
-        
-        # 连接到SMTP服务器并发送
-        with smtplib.SMTP_SSL(email_config['smtp_server'], email_config['smtp_port']) as server:
-            server.login(email_config['sender'], email_config['password'])
-            server.send_message(msg)
-        
-        print(f"成功发送每日一题邮件：第 {question_data['question_number']} 题")
-        return True
+        recipients = parse_recipients(email_config)
+    except OSError as e:
+        print(f"错误: 无法读取收件人文件 {email_config.get('recipients_file')}: {e}")
+        return False
+    if not recipients:
+        print("错误: 邮件配置中没有收件人 (receiver / recipients_file)")
+        return False
+
+    try:
+        on_sent = None
+        if ledger is not None and question_data.get('dynamic_id'):
+            dynamic_id = question_data['dynamic_id']
+            delivered = ledger.delivered_recipients(dynamic_id)
+            recipients = [r for r in recipients if r.lower() not in delivered]
+            if not recipients:
+                print(f"第 {question_data['question_number']} 题已发送给全部收件人，跳过。")
+                return True
+            on_sent = functools.partial(_record_delivery, ledger, question_data)
+        # 邮件和图片只构建一次，所有收件人共用
+        message_bytes = serialize_message(build_question_message(email_config['sender'], question_data))
+        print(f"正在发送每日一题邮件给 {len(recipients)} 个收件人...")
+        report = pool_from_config(email_config).deliver(message_bytes, recipients, on_sent=on_sent)
     except Exception as e:
+        get_metrics().inc('smtp_errors')
         print(f"发送邮件时发生错误: {e}")
         traceback.print_exc()
         return False
 
-def job():
-    """定时任务：获取并发送每日一题"""
-    print(f"\n--- 开始执行定时任务 [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ---")
-    
-    # 加载配置
-    config = load_config(CONFIG_FILE)
-    if not config:
-        print("无法加载配置，任务终止")
-        return
-    
-    # 获取配置值
+    if report.sent:
+        print(f"成功发送每日一题邮件：第 {question_data['question_number']} 题 ({len(report.sent)}/{len(recipients)} 个收件人)")
+    for recipient, error in report.failed.items():
+        print(f"  发送给 {recipient} 失败: {error}")
+    return report.ok
+
+def _record_delivery(ledger, question_data, recipient):
+    ledger.record_delivery(question_data['dynamic_id'], recipient, question_data.get('uid'), question_data.get('pub_ts'))
+
+def _record_digest_delivery(ledger, questions, recipient):
+    for question_data in questions:
+        _record_delivery(ledger, question_data, recipient)
+
+def plan_digests(questions, recipients, ledger=None):
+    """
+    按每个收件人尚未收到的题目分组，返回 [(题目列表, 收件人列表)]，未收到的题目相同的收件人共用一封邮件。
+    没有 ledger 时所有收件人收到全部题目。
+    """
+    if ledger is None: return [(questions, recipients)] if questions and recipients else []
+    delivered = {q['dynamic_id']: ledger.delivered_recipients(q['dynamic_id']) for q in questions}
+    groups = {}
+    for recipient in recipients:
+        missing = tuple(q['dynamic_id'] for q in questions if recipient.lower() not in delivered[q['dynamic_id']])
+        if missing: groups.setdefault(missing, []).append(recipient)
+    by_id = {q['dynamic_id']: q for q in questions}
+    return [([by_id[dynamic_id] for dynamic_id in missing], group) for missing, group in groups.items()]
+
+def send_digest(email_config, questions, ledger=None, max_bytes=DIGEST_MAX_BYTES):
+    """
+    把多道题目合成一封邮件发送 (见 biliq_mail.build_digest_message)，questions 按发布时间从旧到新排列。
+    ledger 为状态库：每个收件人只收到自己尚未收到的题目，每送达一封立即把其中的全部题目记入投递记录。
+    全部送达时返回 True。
+    """
+    if not questions:
+        print("没有找到可发送的题目数据")
+        return False
+    try:
+        recipients = parse_recipients(email_config)
+    except OSError as e:
+        print(f"错误: 无法读取收件人文件 {email_config.get('recipients_file')}: {e}")
+        return False
+    if not recipients:
+        print("错误: 邮件配置中没有收件人 (receiver / recipients_file)")
+        return False
+    groups = plan_digests(questions, recipients, ledger)
+    if not groups:
+        print(f"{len(questions)} 道题目已发送给全部收件人，跳过。")
+        return True
+
+    metrics = get_metrics()
+    ok = True
+    for group_questions, group_recipients in groups:
+        numbers = "、".join(str(q['question_number']) for q in group_questions)
+        try:
+            msg, stats = build_digest_message(email_config['sender'], group_questions, max_bytes)
+            message_bytes = serialize_message(msg)
+            for result in ('attached', 'linked', 'deduplicated'):
+                if stats[result]: metrics.inc('digest_images', stats[result], result=result)
+            print(f"正在发送合集邮件 (第 {numbers} 题，附加 {stats['attached']} 张图片共 {stats['bytes'] / 1048576:.1f} MB，"
+                  f"改为链接 {stats['linked']} 张，重复图片 {stats['deduplicated']} 张) 给 {len(group_recipients)} 个收件人...")
+            on_sent = functools.partial(_record_digest_delivery, ledger, group_questions) if ledger is not None else None
+            report = pool_from_config(email_config).deliver(message_bytes, group_recipients, on_sent=on_sent)
+        except Exception as e:
+            metrics.inc('smtp_errors')
+            print(f"发送合集邮件时发生错误: {e}")
+            traceback.print_exc()
+            ok = False
+            continue
+        if report.sent:
+            print(f"成功发送合集邮件：第 {numbers} 题 ({len(report.sent)}/{len(group_recipients)} 个收件人)")
+        for recipient, error in report.failed.items():
+            print(f"  发送给 {recipient} 失败: {error}")
+        ok = ok and report.ok
+    return ok
+
+def _is_today(pub_ts):
+    try: return datetime.fromtimestamp(int(pub_ts)).date() == datetime.now().date()
+    except (TypeError, ValueError, OverflowError, OSError): return False
+
+def delivered_today(settings, ledger):
+    """
+    只查投递记录 (不访问网络)：今天发布的题目已送达全部收件人时返回 True。
+    返回 (是否已送达, 已送达全部收件人的最新动态 ID)。收件人文件无法读取时视为未送达。
+    """
+    try:
+        recipients = parse_recipients(settings['email'])
+    except OSError as e:
+        print(f"错误: 无法读取收件人文件 {settings['email'].get('recipients_file')}: {e}")
+        return False, None
+    last = ledger.last_delivery(settings['uid'], recipients)
+    if last is None: return False, None
+    return _is_today(last[1]), last[0]
+
+def load_settings(config):
+    """检查配置并创建凭据 (只在启动时执行一次)。配置不完整时返回 None。"""
     TARGET_UID = config.get("TARGET_UID")
-    IMAGE_DIR = config.get("IMAGE_DIR", "bili_images")
-    CREDS_CONFIG = config.get("CREDENTIALS", {})
     EMAIL_CONFIG = config.get("EMAIL", {})
-    
+    CREDS_CONFIG = config.get("CREDENTIALS", {})
+
     if not TARGET_UID:
         print(f"错误: 配置文件 {CONFIG_FILE} 中缺少 TARGET_UID。")
-        return
-    
-    if not EMAIL_CONFIG or not all(k in EMAIL_CONFIG for k in ['sender', 'password', 'receiver', 'smtp_server', 'smtp_port']):
-        print("错误: 邮件配置不完整，请检查config.json中的EMAIL部分")
-        return
-    
-    print(f"目标用户 UID: {TARGET_UID}")
-    print(f"图片保存目录: {IMAGE_DIR}")
-    
+        return None
+    if not EMAIL_CONFIG or not all(k in EMAIL_CONFIG for k in ['sender', 'password', 'smtp_server', 'smtp_port']) or \
+            not (EMAIL_CONFIG.get('receiver') or EMAIL_CONFIG.get('recipients_file')):
+        print("错误: 邮件配置不完整，请在config.json中添加EMAIL部分，包含sender、password、smtp_server和smtp_port字段，"
+              "以及receiver或recipients_file (至少一个)")
+        return None
+    try:
+        recipients = parse_recipients(EMAIL_CONFIG)
+    except OSError as e:
+        print(f"错误: 无法读取收件人文件 {EMAIL_CONFIG.get('recipients_file')}: {e}")
+        return None
+    if not recipients:
+        print("错误: 邮件配置中没有收件人 (receiver / recipients_file)")
+        return None
+
+    settings = {
+        'uid': TARGET_UID,
+        'image_dir': config.get("IMAGE_DIR", "bili_images"),
+        'image_profile': config.get("EMAIL_IMAGE_PROFILE", EMAIL_IMAGE_PROFILE),
+        'email': EMAIL_CONFIG,
+        'credential': None,
+        'mode': config.get("EMAIL_MODE", EMAIL_MODE),
+        'digest_max_questions': int(config.get("DIGEST_MAX_QUESTIONS", DIGEST_MAX_QUESTIONS)),
+        'digest_max_pages': int(config.get("DIGEST_MAX_PAGES", DIGEST_MAX_PAGES)),
+        'digest_max_bytes': int(config.get("DIGEST_MAX_BYTES", DIGEST_MAX_BYTES)),
+    }
+    print(f"目标用户 UID: {settings['uid']}")
+    print(f"图片保存目录: {settings['image_dir']}")
+    if settings['mode'] == 'digest':
+        print(f"合集模式：尚未送达的题目合成一封邮件 (最多 {settings['digest_max_questions']} 题，"
+              f"附件预算 {settings['digest_max_bytes'] / 1048576:g} MB)")
+
     # 尝试使用登录模式
-    credential = None
-    SESSDATA = CREDS_CONFIG.get("SESSDATA")
-    BILI_JCT = CREDS_CONFIG.get("BILI_JCT")
-    BUVID3 = CREDS_CONFIG.get("BUVID3")
-    DEDEUSERID = CREDS_CONFIG.get("DEDEUSERID")
-    
-    if SESSDATA and BILI_JCT and BUVID3:
-        print("正在使用 config.json 中的 Cookie 信息创建凭据...")
-        try:
-            dedeuserid_val = DEDEUSERID if DEDEUSERID and DEDEUSERID.strip() else None
-            credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3, dedeuserid=dedeuserid_val)
-            print("凭据创建成功。")
-        except Exception as e:
-            print(f"错误：创建 Credential 对象失败：{e}")
-            print("将尝试切换回匿名模式。")
-            credential = None
+    if CREDS_CONFIG.get("SESSDATA") and CREDS_CONFIG.get("BILI_JCT") and CREDS_CONFIG.get("BUVID3"):
+        settings['credential'] = build_credential(CREDS_CONFIG)
+        if settings['credential'] is None: print("将尝试切换回匿名模式。")
     else:
         print("使用匿名模式获取动态")
-    
-    # 获取动态
-    dynamics_data = asyncio.run(fetch_user_dynamics(TARGET_UID, credential))
-    
-    # 处理数据并发送邮件
-    if dynamics_data:
-        print("\n开始处理动态数据...")
-        latest_question = process_dynamics_for_email(dynamics_data, IMAGE_DIR)
-        
-        if latest_question:
-            send_email(EMAIL_CONFIG, latest_question)
-        else:
-            print("未找到符合条件的每日一题")
-    else:
-        print("\n未能成功获取动态数据，任务终止。")
+    return settings
+
+async def check_and_send(settings, limiter=None, ledger=None):
+    """
+    先查投递记录：今天的题目已送达全部收件人时直接返回，不发出任何请求。
+    否则获取第一页动态，遇到已送达全部收件人的题目即停止；有更新的题目时下载图片并发送邮件。
+    返回 (结果, 题目数据)，结果为 'sent' / 'up_to_date' / 'no_new' / 'not_found' / 'fetch_failed' / 'send_failed'。
+    合集模式 (settings['mode'] 为 digest) 见 check_and_send_digest()。
+    """
+    ledger = ledger or get_state_store()
+    done_today, last_sent_id = delivered_today(settings, ledger)
+    if done_today:
+        print("今天的题目已发送给全部收件人，无需检查。")
+        return 'up_to_date', None
+    if settings.get('mode') == 'digest':
+        return await check_and_send_digest(settings, limiter, ledger, last_sent_id)
+
+    dynamics_data = await fetch_user_dynamics(settings['uid'], settings['credential'], limiter=limiter)
+    if not dynamics_data:
+        print("\n未能成功获取动态数据。")
+        return 'fetch_failed', None
+
+    # 下载图片和发送邮件是阻塞操作，放到线程池中执行，不阻塞事件循环
+    loop = asyncio.get_running_loop()
+    latest_question = await loop.run_in_executor(None, functools.partial(
+        process_dynamics_for_email, dynamics_data, settings['image_dir'], settings['image_profile'], last_sent_id))
+    if not latest_question:
+        print("未找到新的每日一题")
+        return ('no_new' if last_sent_id else 'not_found'), None
+    latest_question['uid'] = settings['uid']
+    sent = await loop.run_in_executor(None, send_email, settings['email'], latest_question, ledger)
+    return ('sent' if sent else 'send_failed'), latest_question
+
+async def check_and_send_digest(settings, limiter=None, ledger=None, last_sent_id=None):
+    """
+    合集模式：从第一页向前翻，收集比已送达全部收件人的最新题目 (last_sent_id) 更新的全部题目，
+    最多 digest_max_questions 道、digest_max_pages 页，合成一封邮件发送。返回值同 check_and_send()，题目数据为列表。
+    """
+    loop = asyncio.get_running_loop()
+    questions, offset = [], 0
+    for page in range(settings['digest_max_pages']):
+        dynamics_data = await fetch_user_dynamics(settings['uid'], settings['credential'], offset=offset, limiter=limiter)
+        if not dynamics_data:
+            if page == 0:
+                print("\n未能成功获取动态数据。")
+                return 'fetch_failed', None
+            break # 之后的页获取失败时先发送已收集的题目
+        found, reached = await loop.run_in_executor(None, functools.partial(
+            process_dynamics_for_digest, dynamics_data, settings['image_dir'], settings['image_profile'], last_sent_id,
+            settings['digest_max_questions'] - len(questions)))
+        questions.extend(found)
+        offset = dynamics_data.get('next_offset')
+        if reached or len(questions) >= settings['digest_max_questions'] or not dynamics_data.get('has_more') or not offset:
+            break
+    if not questions:
+        print("未找到新的每日一题")
+        return ('no_new' if last_sent_id else 'not_found'), None
+    for question in questions: question['uid'] = settings['uid']
+    questions.reverse() # 合集按发布时间从旧到新排列
+    sent = await loop.run_in_executor(None, send_digest, settings['email'], questions, ledger, settings['digest_max_bytes'])
+    return ('sent' if sent else 'send_failed'), questions
+
+def job(settings):
+    """执行一次：获取并发送最新的每日一题。发送成功或没有需要发送的新题目时返回 True。"""
+    print(f"\n--- 开始执行任务 [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ---")
+    try:
+        result, _ = asyncio.run(check_and_send(settings))
+        return result in ('sent', 'up_to_date', 'no_new')
+    finally:
+        close_downloader() # 保存图片主机的延迟统计
+        print_stage_summary()
+        write_metrics("biliq_email")
+        write_profile_reports("biliq_email")
+
+def parse_publish_time(value):
+    """把 "08:00" 解析为 (时, 分)。"""
+    try:
+        hour, minute = (int(part) for part in str(value).split(':', 1))
+        if 0 <= hour < 24 and 0 <= minute < 60: return hour, minute
+    except ValueError:
+        pass
+    print(f"警告：PUBLISH_TIME 格式无效 ({value})，使用默认值 {PUBLISH_TIME}")
+    return parse_publish_time(PUBLISH_TIME)
+
+def polling_window(now, publish_time, before_minutes, after_minutes):
+    """返回 now 当天的轮询窗口 (开始, 结束)。"""
+    hour, minute = publish_time
+    publish_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return publish_at - timedelta(minutes=before_minutes), publish_at + timedelta(minutes=after_minutes)
+
+def next_poll_delay(now, schedule_config, sent_today, consecutive_failures=0):
+    """
+    计算下一次轮询前等待的秒数：
+    - 今天已发送：等到明天的轮询窗口开始；
+    - 在轮询窗口内：每 POLL_INTERVAL 秒一次 (接口连续出错时指数退避，最多到 IDLE_POLL_INTERVAL)；
+    - 窗口外：每 IDLE_POLL_INTERVAL 秒一次，但不会错过下一个窗口的开始。
+    """
+    window_start, window_end = polling_window(now, schedule_config['publish_time'],
+                                              schedule_config['window_before'], schedule_config['window_after'])
+    next_window_start = window_start if now < window_start else window_start + timedelta(days=1)
+    until_next_window = (next_window_start - now).total_seconds()
+    if sent_today:
+        return until_next_window
+    if window_start <= now < window_end:
+        delay = schedule_config['interval'] * (2 ** min(consecutive_failures, 10))
+        return min(delay, schedule_config['idle_interval'])
+    return max(1.0, min(schedule_config['idle_interval'], until_next_window))
+
+def load_schedule_config(config):
+    return {
+        'publish_time': parse_publish_time(config.get("PUBLISH_TIME", PUBLISH_TIME)),
+        'window_before': float(config.get("POLL_WINDOW_BEFORE", POLL_WINDOW_BEFORE)),
+        'window_after': float(config.get("POLL_WINDOW_AFTER", POLL_WINDOW_AFTER)),
+        'interval': float(config.get("POLL_INTERVAL", POLL_INTERVAL)),
+        'idle_interval': float(config.get("IDLE_POLL_INTERVAL", IDLE_POLL_INTERVAL)),
+    }
+
+async def run_daemon(settings, schedule_config, limiter=None):
+    """
+    常驻运行：凭据、HTTP 连接池和事件循环在整个进程中复用。
+    启动时立即检查一次 (发送尚未发送过的最新题目)，之后按发布时间附近的轮询窗口检查，
+    新题目一出现就发送。投递记录保存在状态库中，重启后不会重复发送；
+    今天发布的题目送达全部收件人之后，才会休眠到明天的轮询窗口。
+    """
+    ledger = get_state_store()
+    hour, minute = schedule_config['publish_time']
+    print(f"轮询窗口: 每天 {hour:02d}:{minute:02d} 前 {schedule_config['window_before']:g} 分钟至后 "
+          f"{schedule_config['window_after']:g} 分钟，每 {schedule_config['interval']:g} 秒检查一次；"
+          f"窗口外每 {schedule_config['idle_interval']:g} 秒检查一次")
+    consecutive_failures = 0
+
+    while True:
+        now = datetime.now()
+        print(f"\n--- 检查新题目 [{now.strftime('%Y-%m-%d %H:%M:%S')}] ---")
+        try:
+            result, _ = await check_and_send(settings, limiter, ledger)
+        except Exception as e:
+            print(f"\n检查新题目时发生错误: {e}")
+            traceback.print_exc()
+            result = 'fetch_failed'
+        consecutive_failures = consecutive_failures + 1 if result == 'fetch_failed' else 0
+        save_download_stats()
+        write_metrics("biliq_email")
+        write_profile_reports("biliq_email")
+
+        now = datetime.now()
+        sent_today, _ = delivered_today(settings, ledger)
+        delay = next_poll_delay(now, schedule_config, sent_today, consecutive_failures)
+        print(f"下一次检查: {(now + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')}")
+        await asyncio.sleep(delay)
 
 # --- 主执行块 ---
 if __name__ == "__main__":
     print("--- B站每日一题邮件发送工具 ---")
     
-    # 加载配置
+    # 加载配置 (只在启动时加载一次)
     config = load_config(CONFIG_FILE)
     if not config:
         sys.exit(1)
     
-    # 检查邮件配置
-    if "EMAIL" not in config or not all(k in config["EMAIL"] for k in ['sender', 'password', 'receiver', 'smtp_server', 'smtp_port']):
-        print("错误: 邮件配置不完整，请在config.json中添加EMAIL部分，包含sender、password、receiver、smtp_server和smtp_port字段")
+    settings = load_settings(config)
+    if settings is None:
         sys.exit(1)
+    # --digest: 本次运行使用合集模式 (等同于 EMAIL_MODE 为 digest)
+    if '--digest' in sys.argv[1:]:
+        settings['mode'] = 'digest'
     
-    # 首次运行立即执行一次
-    print("首次运行，立即执行一次任务...")
-    job()
-    
-    # 设置定时任务，每天8:10执行
-    schedule.every().day.at("08:10").do(job)
-    print("已设置定时任务，将在每天 08:10 执行")
-    
-    # 运行定时任务循环
+    configure_api(config)
+    configure_downloader(config)
+    configure_metrics(config)
+    configure_state_store(config)
+    # --profile: 按阶段剖析 CPU 和内存，报告写入 PROFILE_DIR (常驻运行时每轮检查后更新)
+    configure_profiler(config, '--profile' in sys.argv[1:])
+
+    # --once: 只执行一次任务后退出 (用于 cron 或基准测试)
+    if '--once' in sys.argv[1:]:
+        sys.exit(0 if job(settings) else 1)
+
+    # 常驻运行时按 METRICS_PORT 提供实时指标
+    start_metrics_server()
+
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(60)  # 每分钟检查一次
+        asyncio.run(run_daemon(settings, load_schedule_config(config), limiter_from_config(config)))
     except KeyboardInterrupt:
         print("\n程序被用户中断")
     except Exception as e:
         print(f"\n程序发生错误: {e}")
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+    finally:
+        close_downloader()
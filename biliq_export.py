@@ -0,0 +1,173 @@
+"""
+原始动态的流式 JSONL 导出和离线重放。
+
+biliq_daily.py --export-jsonl dynamics.jsonl.gz (或 config.json 中的 RAW_EXPORT_FILE) 在每页动态获取后
+立即把该页的每张原始卡片连同提取结果追加到 gzip 压缩的 JSONL 文件，每行一张卡片：
+
+    {"v": 1, "uid": "688379639", "dynamic_id": "1062...", "fetched_at": 1717000000,
+     "raw": {...get_dynamics 返回的原始卡片...}, "question": {...QuestionRecord.to_dict()...} 或 null}
+
+每页写完即刷新压缩流，内存占用只与单页大小有关，与历史长度无关；进程中途被杀时最多丢失最后一页，
+读取时会忽略文件末尾不完整的行。多次运行追加到同一文件 (gzip 允许多段拼接)，同一卡片可能出现多次：
+日常同步每次都导出最新一页，恢复或重试的回溯会重新导出中断处的页。这些重复彼此相距不远，
+重放时只记住最近 DEDUPE_WINDOW 个动态 ID 去重，内存占用与导出文件的长度无关。
+
+读取端不访问网络，按当前的提取规则重新解析导出的原始卡片：
+
+    python biliq_export.py dynamics.jsonl.gz                # 统计卡片数、题目数，以及与导出时提取结果不同的卡片
+    python biliq_export.py dynamics.jsonl.gz --questions    # 以 JSONL 输出重新提取的题目
+    python biliq_export.py dynamics.jsonl.gz --diff         # 列出提取结果发生变化的卡片
+
+导出文件也可以直接作为基准测试的语料 (benchmarks/bench_e2e.py --corpus)。
+"""
+import argparse
+import gzip
+import json
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from biliq_extract import card_dynamic_id, extract_card
+
+EXPORT_FORMAT_VERSION = 1
+COMPRESS_LEVEL = 6
+DEDUPE_WINDOW = 10000  # 重放去重时记住的最近动态 ID 数 (约 1 MB)
+
+
+class JsonlExporter:
+    """线程安全的 gzip JSONL 追加写入器。多个目标可以共用一个导出文件。"""
+
+    def __init__(self, path, compresslevel=COMPRESS_LEVEL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'ab', compresslevel=compresslevel)
+        self.cards_written = 0
+
+    def write_page(self, dynamics_page, uid=None):
+        """把一页动态的原始卡片和提取结果追加到导出文件并刷新。返回写入的卡片数。"""
+        cards = dynamics_page.get('cards') or []
+        fetched_at = int(time.time())
+        lines = []
+        for item in cards:
+            dynamic_id = card_dynamic_id(item)
+            try: record = extract_card(item, dynamic_id=dynamic_id) if dynamic_id else None
+            except Exception: record = None # 提取失败不影响导出原始卡片
+            line = {'v': EXPORT_FORMAT_VERSION, 'uid': str(uid) if uid is not None else None,
+                    'dynamic_id': dynamic_id, 'fetched_at': fetched_at, 'raw': item,
+                    'question': record.to_dict() if record is not None else None}
+            lines.append(json.dumps(line, ensure_ascii=False, separators=(',', ':')))
+        if not lines: return 0
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        with self._lock:
+            self._file.write(data)
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self.cards_written += len(lines)
+        return len(lines)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_exporter(path):
+    """打开导出文件；path 为空或无法打开时返回 None (只打印警告，不影响抓取)。"""
+    if not path: return None
+    try:
+        exporter = JsonlExporter(path)
+    except OSError as e:
+        print(f"警告：无法打开导出文件 {path}: {e}")
+        return None
+    print(f"原始动态将流式导出到 {path}")
+    return exporter
+
+
+def iter_export(path):
+    """
+    逐行读取导出文件 (.gz 或未压缩)，产出每行的 dict。
+    文件末尾被截断的行 (进程中途被杀) 会被忽略并打印警告。
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line: continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"警告：{path} 第 {line_number} 行不完整，已忽略。", file=sys.stderr)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            print(f"警告：{path} 末尾不完整 ({e})，之后的内容已忽略。", file=sys.stderr)
+
+
+def replay_export(path, uid=None, dedupe=True, window=DEDUPE_WINDOW):
+    """
+    离线重放导出文件：按当前提取规则重新解析每张原始卡片，产出 (导出行, QuestionRecord 或 None)。
+    dedupe 为 True 时跳过最近 window 个不同动态 ID 中已出现过的动态 (LRU，只在内存中保留动态 ID)；
+    相隔更远的重复仍会产出。
+    """
+    recent = OrderedDict()
+    for line in iter_export(path):
+        if uid is not None and str(line.get('uid')) != str(uid): continue
+        item = line.get('raw') or {}
+        dynamic_id = line.get('dynamic_id') or card_dynamic_id(item)
+        if dedupe and dynamic_id:
+            if dynamic_id in recent:
+                recent.move_to_end(dynamic_id)
+                continue
+            recent[dynamic_id] = None
+            if len(recent) > window: recent.popitem(last=False)
+        try: record = extract_card(item, dynamic_id=dynamic_id) if dynamic_id else None
+        except Exception as e:
+            print(f"  重新提取失败：{e}. Dynamic ID: {dynamic_id}", file=sys.stderr)
+            record = None
+        yield line, record
+
+
+def _question_changed(exported, record):
+    current = record.to_dict() if record is not None else None
+    if exported is None or current is None: return exported != current
+    return any(exported.get(key) != current.get(key) for key in current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线重放 biliq_daily.py 导出的原始动态")
+    parser.add_argument("path", help="导出文件 (JSONL，可 .gz)")
+    parser.add_argument("--uid", help="只处理指定 UID 的卡片")
+    parser.add_argument("--questions", action='store_true', help="以 JSONL 输出重新提取的题目")
+    parser.add_argument("--diff", action='store_true', help="列出提取结果与导出时不同的卡片")
+    parser.add_argument("--all", action='store_true', help="不按动态 ID 去重")
+    parser.add_argument("--dedupe-window", type=int, default=DEDUPE_WINDOW,
+                        help=f"去重时记住的最近动态 ID 数 (默认 {DEDUPE_WINDOW})")
+    args = parser.parse_args()
+
+    cards = questions = changed = 0
+    start = time.perf_counter()
+    for line, record in replay_export(args.path, uid=args.uid, dedupe=not args.all, window=args.dedupe_window):
+        cards += 1
+        if record is not None:
+            questions += 1
+            if args.questions: print(json.dumps(record.to_dict(), ensure_ascii=False))
+        if _question_changed(line.get('question'), record):
+            changed += 1
+            if args.diff:
+                before = line.get('question') or {}
+                after = record.to_dict() if record is not None else {}
+                print(f"{line.get('dynamic_id')}: 第 {before.get('question_number', '-')} 题 -> "
+                      f"第 {after.get('question_number', '-')} 题", file=sys.stderr if args.questions else sys.stdout)
+    elapsed = time.perf_counter() - start
+    print(f"卡片: {cards}  题目: {questions}  提取结果变化: {changed}  耗时: {elapsed:.2f}s",
+          file=sys.stderr if args.questions else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
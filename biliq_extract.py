@@ -0,0 +1,211 @@
+"""
+动态卡片提取引擎。
+
+把一页 get_dynamics 返回的原始数据单次遍历转换成紧凑的 QuestionRecord：
+每张卡片 (以及转发动态的 origin) 的嵌套 JSON 只解析一次，"第 N 题" 正则预先编译，
+记录对象使用 __slots__。安装了 orjson 时自动用它解析嵌套 JSON。
+
+支持的三种卡片结构：
+1. card.modules.module_dynamic: major (MAJOR_TYPE_DRAW) + desc
+2. card.item: pictures + description (旧格式或简单格式)
+3. card.origin: 转发动态的原始内容 (结构同 2)
+"""
+import json
+import re
+import time
+import traceback
+from datetime import datetime
+
+from biliq_metrics import get_metrics
+from biliq_profile import profile_iter
+
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+    _fast_loads = orjson.loads
+    _json_errors = (orjson.JSONDecodeError, ValueError)
+except ImportError:
+    JSON_BACKEND = "json"
+    _fast_loads = json.loads
+    _json_errors = (json.JSONDecodeError, ValueError)
+
+QUESTION_RE = re.compile(r"第\s*(\d+)\s*题", re.IGNORECASE)
+
+
+class QuestionRecord:
+    """一条匹配 "第 N 题" 的图文动态。"""
+
+    __slots__ = ('dynamic_id', 'uid', 'question_number', 'pub_ts', 'text', 'image_urls')
+
+    def __init__(self, dynamic_id, uid, question_number, pub_ts, text, image_urls):
+        self.dynamic_id = dynamic_id
+        self.uid = uid
+        self.question_number = question_number
+        self.pub_ts = pub_ts
+        self.text = text
+        self.image_urls = image_urls
+
+    @property
+    def title(self):
+        return f"每日一题 | 第 {self.question_number} 题"
+
+    def _datetime(self):
+        if not self.pub_ts: return None
+        try: return datetime.fromtimestamp(int(self.pub_ts))
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            print(f"    解析时间戳失败: {self.pub_ts}, 错误: {e}")
+            return None
+
+    @property
+    def pub_time_str(self):
+        dt_object = self._datetime()
+        return dt_object.strftime('%Y-%m-%d %H:%M') if dt_object else "未知时间"
+
+    @property
+    def date_for_filename(self):
+        dt_object = self._datetime()
+        return dt_object.strftime('%Y_%m_%d') if dt_object else "nodate" # YYYY_MM_DD
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"QuestionRecord(dynamic_id={self.dynamic_id!r}, question_number={self.question_number!r})"
+
+
+def card_dynamic_id(item):
+    """提取卡片的动态 ID (不解析卡片内容)。"""
+    desc = item.get('desc') or {}
+    return desc.get('dynamic_id_str') or \
+           ((item.get('display') or {}).get('origin') or {}).get('dynamic_id_str') or \
+           desc.get('rid_str') or \
+           (item.get('basic') or {}).get('comment_id_str')
+
+
+def _load_nested(value, loads):
+    if isinstance(value, dict): return value
+    if isinstance(value, (str, bytes)): return loads(value)
+    return None
+
+
+def _pictures(item_data):
+    pictures = item_data.get('pictures')
+    if isinstance(pictures, list) and item_data.get('description'):
+        return [{'src': pic.get('img_src')} for pic in pictures if pic.get('img_src')], item_data['description']
+    return None, None
+
+
+def extract_card(item, loads=None, dynamic_id=None):
+    """
+    从单张卡片提取 QuestionRecord；不是 "第 N 题" 图文动态时返回 None。
+    loads 为解析嵌套 JSON 的函数，默认使用 orjson (可用时) 或 json。
+    """
+    loads = loads or _fast_loads
+    dynamic_id = dynamic_id or card_dynamic_id(item)
+    if not dynamic_id: return None
+
+    card_value = item.get('card')
+    if not card_value: return None
+    try:
+        card_data = _load_nested(card_value, loads)
+    except _json_errors as e:
+        print(f"  错误：解析 card JSON 失败。ID: {dynamic_id}. Error: {e}"); return None
+    if card_data is None:
+        print(f"  警告：item['card'] 类型未知 ({type(card_value)})。跳过。 ID: {dynamic_id}"); return None
+    if not card_data: print(f"  内部错误：card_data 为空。跳过。 ID: {dynamic_id}"); return None
+
+    desc = item.get('desc') or {}
+    item_data = card_data.get('item') or {}
+    pub_ts = desc.get('timestamp') or item_data.get('upload_time')
+
+    major_module_items = None
+    description = None
+
+    # Structure 1: 'modules' -> 'module_dynamic' -> 'major' (draw) and 'desc'
+    module_dynamic = (card_data.get('modules') or {}).get('module_dynamic') or {}
+    if module_dynamic:
+        major_data = module_dynamic.get('major') or {}
+        desc_data = module_dynamic.get('desc')
+        if major_data.get('type') == 'MAJOR_TYPE_DRAW':
+            draw_data = major_data.get('draw')
+            if draw_data and 'items' in draw_data and desc_data and 'text' in desc_data:
+                major_module_items = draw_data['items']
+                description = desc_data['text']
+
+    # Structure 2: Direct 'item' with 'pictures' and 'description' (Older or simpler format)
+    if major_module_items is None:
+        major_module_items, description = _pictures(item_data)
+
+    # Structure 3: Origin item for forwarded dynamics (less likely for "每日一题")
+    if major_module_items is None and 'origin' in card_data:
+        try: origin_card_data = _load_nested(card_data.get('origin'), loads)
+        except _json_errors: origin_card_data = None # Ignore parse error here
+        if origin_card_data:
+            major_module_items, description = _pictures(origin_card_data.get('item') or {})
+
+    if major_module_items is None or description is None:
+        return None # Skip if no usable text/image content found
+
+    text_content = description.strip()
+    if not text_content: return None
+
+    # *** 严格筛选: 必须包含 "第 N 题" ***
+    question_match = QUESTION_RE.search(text_content)
+    if not question_match: return None
+
+    if not (isinstance(major_module_items, list) and len(major_module_items) > 0):
+        print(f"  跳过：图片列表为空或无效。 ID: {dynamic_id}"); return None
+    image_urls = [image_info.get('src') for image_info in major_module_items # Prefer 'src' key
+                  if isinstance(image_info, dict) and image_info.get('src')]
+    if not image_urls or len(image_urls) < len(major_module_items):
+        print(f"  跳过：无法获取全部图片 URL (检查 'src' key)。 ID: {dynamic_id}"); return None
+
+    return QuestionRecord(dynamic_id, desc.get('uid'), question_match.group(1), pub_ts, text_content, image_urls)
+
+
+def extract_questions(dynamics_data, skip=None, loads=None, stop=None):
+    """
+    单次遍历一页动态，按页面顺序逐条产出 QuestionRecord。
+    skip(dynamic_id) 返回 True 的卡片在解析卡片内容之前就被跳过 (用于跳过已处理的动态)；
+    stop(dynamic_id) 返回 True 时立即结束遍历，之后的卡片都不再解析 (用于在同步水位处提前停止)。
+    解析耗时 (不含调用方处理记录的时间) 和卡片计数在遍历结束或生成器关闭时记入 biliq_metrics。
+    --profile 时解析的每一步计入 biliq_profile 的 parse 阶段。
+    """
+    return profile_iter('parse', _iter_questions(dynamics_data, skip, loads, stop))
+
+
+def _iter_questions(dynamics_data, skip, loads, stop):
+    if not (dynamics_data and isinstance(dynamics_data.get('cards'), list)):
+        print("动态数据无效或缺少 'cards' 列表，无法处理。")
+        return
+    seen = skipped = matched = 0
+    elapsed = 0.0
+    try:
+        for item in dynamics_data['cards']:
+            start = time.perf_counter()
+            seen += 1
+            dynamic_id = None
+            try:
+                dynamic_id = card_dynamic_id(item)
+                if dynamic_id and stop is not None and stop(dynamic_id):
+                    seen -= 1
+                    break
+                if not dynamic_id or (skip is not None and skip(dynamic_id)):
+                    skipped += 1 if dynamic_id else 0
+                    continue
+                record = extract_card(item, loads, dynamic_id)
+            except Exception as e:
+                print(f"  处理动态时发生意外错误：{e}. Dynamic ID: {dynamic_id or 'N/A'}")
+                traceback.print_exc()
+                continue
+            finally:
+                elapsed += time.perf_counter() - start
+            if record is not None:
+                matched += 1
+                yield record
+    finally:
+        metrics = get_metrics()
+        metrics.observe_stage('parse', elapsed)
+        metrics.inc('cards_seen', seen)
+        metrics.inc('cards_skipped', skipped)
+        metrics.inc('cards_matched', matched)
@@ -0,0 +1,175 @@
+"""
+内容寻址的图片仓库。
+
+图片按内容的 SHA-256 存放在 <image_dir>/.store/objects/ab/abcdef....ext，
+URL 到内容哈希的映射以及 ETag / Last-Modified 记录在 <image_dir>/.store/store.db 中。
+N_YYYY_MM_DD.ext 这类便于阅读的文件名只是指向仓库对象的硬链接 (不支持时退化为符号链接或复制)，
+同一张图片无论被哪个脚本、以哪个文件名引用，都只下载和存储一次。
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+STORE_DIR_NAME = ".store"
+STALE_TEMP_AGE = 3600   # 超过该时间 (秒) 的临时文件视为被中断的下载留下的残留
+TAIL_BYTES = 64         # 检查图片结束标记时读取的文件末尾字节数
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url           TEXT PRIMARY KEY,
+    sha256        TEXT NOT NULL,
+    ext           TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    fetched_at    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_urls_sha256 ON urls (sha256);
+"""
+
+
+def hash_file(path, chunk_size=65536):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def looks_complete(path):
+    """
+    不解码图片，只按文件头和结束标记粗略判断图片文件是否完整 (JPEG / PNG / GIF / WebP)。
+    用于收入仓库之前排除被中断的下载留下的截断文件；无法识别的格式一律视为不完整。
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(12)
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read().rstrip(b'\x00') # 部分编码器会在结束标记后补零
+    except OSError:
+        return False
+    if head.startswith(b'\xff\xd8\xff'):
+        return tail.endswith(b'\xff\xd9')
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return tail.endswith(b'IEND\xaeB`\x82')
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return tail.endswith(b';')
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return int.from_bytes(head[4:8], 'little') + 8 <= size
+    return False
+
+
+class ImageStore:
+    """一个图片目录对应的内容寻址仓库。线程安全。"""
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "store.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def clean_temp(self, max_age=STALE_TEMP_AGE):
+        """删除被中断的下载留在 tmp 目录中的临时文件 (只删较旧的，以免影响其他进程正在进行的下载)。返回删除的文件数。"""
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.tmp_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def object_path(self, sha256, ext):
+        return os.path.join(self.objects_dir, sha256[:2], sha256 + ext)
+
+    def lookup(self, url):
+        """返回 URL 对应的元数据 dict；没有记录或仓库对象已丢失时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, ext, size, etag, last_modified FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        meta = dict(zip(('sha256', 'ext', 'size', 'etag', 'last_modified'), row))
+        meta['path'] = self.object_path(meta['sha256'], meta['ext'])
+        return meta if os.path.exists(meta['path']) else None
+
+    def new_temp_file(self):
+        """在仓库的 tmp 目录中创建临时文件，返回 (文件对象, 路径)。同一文件系统保证之后可以原子改名。"""
+        fd, path = tempfile.mkstemp(prefix="dl-", dir=self.tmp_dir)
+        return os.fdopen(fd, 'wb'), path
+
+    def commit_file(self, tmp_path, sha256, ext):
+        """把已写完的临时文件移入仓库；相同内容的对象已存在时直接丢弃临时文件。返回对象路径。"""
+        path = self.object_path(sha256, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644) # mkstemp creates 0600 files
+            os.replace(tmp_path, path)
+        return path
+
+    def record(self, url, sha256, ext, size, etag=None, last_modified=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, ext, size, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (url, sha256, ext, size, etag, last_modified, int(time.time())))
+
+    def adopt(self, url, filepath):
+        """
+        把仓库建立之前就已存在的图片文件收进仓库 (不访问网络)。返回对象路径；
+        文件看起来不完整 (见 looks_complete) 时不收入，返回 None，由调用方重新下载。
+        """
+        if not looks_complete(filepath):
+            return None
+        ext = os.path.splitext(filepath)[1]
+        sha256 = hash_file(filepath)
+        path = self.object_path(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copy2(filepath, path)
+        self.record(url, sha256, ext, os.path.getsize(path))
+        link_alias(path, filepath)
+        return path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def link_alias(object_path, alias_path):
+    """
+    让 alias_path 指向仓库对象：优先硬链接，其次相对符号链接，最后复制。
+    已经指向同一对象时不做任何事；替换时先建临时链接再 os.replace，不会出现缺失的中间状态。
+    """
+    if os.path.exists(alias_path):
+        try:
+            if os.path.samefile(object_path, alias_path): return alias_path
+        except OSError: pass
+    directory = os.path.dirname(alias_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_alias = os.path.join(directory, f".{os.path.basename(alias_path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(object_path, tmp_alias)
+        except OSError:
+            try: os.symlink(os.path.relpath(object_path, directory), tmp_alias)
+            except OSError: shutil.copy2(object_path, tmp_alias)
+        os.replace(tmp_alias, alias_path)
+    finally:
+        if os.path.lexists(tmp_alias):
+            os.remove(tmp_alias)
+    return alias_path
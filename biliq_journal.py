@@ -0,0 +1,185 @@
+"""
+运行日志 (write-ahead journal)。
+
+biliq_daily.py 写入每一页时，先把渲染好的 Markdown 条目和对应的状态库记录写入运行日志 (biliq_journal.db)
+并落盘，再写入归档和状态库，两者都成功后才从日志中删除这些条目。进程在中途被杀时，
+下次运行开始时 resume_pending() 把日志里尚未提交的条目补写进归档和状态库，
+不需要重新请求接口、下载图片或渲染。归档分段先写临时文件再原子替换，同一条目重复补写不会产生重复内容。
+
+图片不经过运行日志：下载先写入图片仓库的临时文件，完整下载并校验哈希后才改名进入仓库 (见 biliq_imagestore)，
+仓库按 URL 记录已完成的下载，中断后再次运行不会重新下载，也不会留下半截的图片文件。
+
+runs 表记录每次运行的开始、结束和结果，上次运行没有正常结束时会在下次运行开始时提示。
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from biliq_archive import append_entries
+
+JOURNAL_DB = "biliq_journal.db"
+RUN_HISTORY = 100   # runs 表保留的运行记录数
+
+RUN_RUNNING = "running"
+RUN_OK = "ok"
+RUN_FAILED = "failed"
+RUN_INTERRUPTED = "interrupted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    command     TEXT,
+    started_at  INTEGER NOT NULL,
+    finished_at INTEGER,
+    status      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_entries (
+    dynamic_id  TEXT PRIMARY KEY,
+    run_id      INTEGER,
+    archive_dir TEXT NOT NULL,
+    pub_ts      INTEGER,
+    markdown    TEXT NOT NULL,
+    record      TEXT NOT NULL,
+    staged_at   INTEGER NOT NULL
+);
+"""
+
+
+class RunJournal:
+    """线程安全的运行日志。每次写入都以 synchronous=FULL 提交，返回时已经落盘。"""
+
+    def __init__(self, path=JOURNAL_DB):
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def begin_run(self, command=None):
+        """登记一次新的运行并返回 run_id；之前仍标记为运行中的记录改为 interrupted 并打印提示。"""
+        command = command if command is not None else " ".join(sys.argv)
+        now = int(time.time())
+        with self._lock, self._conn:
+            interrupted = self._conn.execute("SELECT run_id, command, started_at FROM runs WHERE status = ?",
+                                             (RUN_RUNNING,)).fetchall()
+            self._conn.execute("UPDATE runs SET status = ? WHERE status = ?", (RUN_INTERRUPTED, RUN_RUNNING))
+            cursor = self._conn.execute("INSERT INTO runs (command, started_at, status) VALUES (?, ?, ?)",
+                                        (command, now, RUN_RUNNING))
+            self.run_id = cursor.lastrowid
+            self._conn.execute("DELETE FROM runs WHERE run_id <= ?", (self.run_id - RUN_HISTORY,))
+        for run_id, previous_command, started_at in interrupted:
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))
+            print(f"注意：第 {run_id} 次运行 ({previous_command}，开始于 {started}) 没有正常结束。")
+        return self.run_id
+
+    def finish_run(self, status=RUN_OK):
+        if self.run_id is None: return
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?",
+                               (int(time.time()), status, self.run_id))
+
+    def last_runs(self, limit=10):
+        """返回最近的运行记录 [(run_id, command, started_at, finished_at, status)]，从新到旧。"""
+        with self._lock:
+            return self._conn.execute("SELECT run_id, command, started_at, finished_at, status FROM runs "
+                                      "ORDER BY run_id DESC LIMIT ?", (limit,)).fetchall()
+
+    def stage(self, archive_dir, entries, records):
+        """
+        把即将写入归档的条目记入日志。entries 为 append_entries() 使用的 dict 列表
+        (dynamic_id / pub_ts / markdown)，records 为对应的状态库记录 (与 entries 一一对应)。
+        """
+        now = int(time.time())
+        rows = [(str(entry['dynamic_id']), self.run_id, archive_dir, entry.get('pub_ts'), entry['markdown'],
+                 json.dumps(record, ensure_ascii=False), now) for entry, record in zip(entries, records)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_entries (dynamic_id, run_id, archive_dir, pub_ts, markdown, record, staged_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def discard(self, dynamic_ids):
+        """条目已写入归档和状态库后从日志中删除。"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pending_entries WHERE dynamic_id = ?",
+                                   [(str(dynamic_id),) for dynamic_id in dynamic_ids])
+
+    def pending(self):
+        """返回本次运行之前记入日志但尚未提交的条目，按记入顺序排列。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dynamic_id, archive_dir, pub_ts, markdown, record FROM pending_entries "
+                "WHERE run_id IS NOT ? ORDER BY staged_at, rowid", (self.run_id,)).fetchall()
+        return [{'dynamic_id': dynamic_id, 'archive_dir': archive_dir,
+                 'entry': {'dynamic_id': dynamic_id, 'pub_ts': pub_ts, 'markdown': markdown},
+                 'record': json.loads(record)} for dynamic_id, archive_dir, pub_ts, markdown, record in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def resume_pending(journal, state):
+    """
+    把之前的运行记入日志但没来得及提交的条目补写进归档和状态库，返回补写的状态库记录列表。
+    状态库里已有的条目说明归档也已写入，只从日志中删除；补写失败的条目留在日志中，下次运行再试。
+    """
+    rows = journal.pending()
+    if not rows: return []
+    print(f"运行日志中有 {len(rows)} 条上次运行未提交的条目，继续写入...")
+    committed = [row['dynamic_id'] for row in rows if state.is_processed(row['dynamic_id'])]
+    if committed: journal.discard(committed)
+
+    by_archive = {}
+    for row in rows:
+        if row['dynamic_id'] not in committed:
+            by_archive.setdefault(row['archive_dir'], []).append(row)
+    resumed = []
+    for archive_dir, group in by_archive.items():
+        try:
+            append_entries(archive_dir, [row['entry'] for row in group])
+        except (IOError, ValueError) as e:
+            print(f"错误：补写归档 {archive_dir} 失败，条目保留在运行日志中: {e}")
+            continue
+        records = [row['record'] for row in group]
+        state.record_many(records)
+        journal.discard([row['dynamic_id'] for row in group])
+        resumed.extend(records)
+        print(f"已从运行日志补写 {len(group)} 条条目到归档 {archive_dir}")
+    return resumed
+
+
+_shared_journal = None
+_shared_lock = threading.Lock()
+_settings = {'db': JOURNAL_DB, 'enabled': True}
+
+
+def get_journal():
+    """返回进程内共享的运行日志，首次调用时打开；已在配置中关闭时返回 None。"""
+    global _shared_journal
+    if not _settings['enabled']: return None
+    with _shared_lock:
+        if _shared_journal is None:
+            _shared_journal = RunJournal(_settings['db'])
+        return _shared_journal
+
+
+def configure_journal(config):
+    """读取 config.json 中的 JOURNAL_DB / RUN_JOURNAL (默认开启)。"""
+    global _shared_journal
+    with _shared_lock:
+        if _shared_journal is not None:
+            _shared_journal.close()
+            _shared_journal = None
+        _settings['db'] = config.get("JOURNAL_DB", JOURNAL_DB)
+        _settings['enabled'] = bool(config.get("RUN_JOURNAL", True))
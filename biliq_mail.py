@@ -0,0 +1,326 @@
+"""
+邮件投递引擎：把同一封每日一题邮件发给一组收件人。
+
+- 邮件 (正文和全部内嵌图片) 只构建和序列化一次，每个收件人只在前面加一行 To 头，
+  图片不会为每个收件人重新读盘和编码；
+- 最多 pool_size 个已登录的 SMTP 连接并行投递，每个连接连续发送，
+  发满 max_per_connection 封后重新连接 (多数服务商限制单连接的邮件数)；
+- 只重试失败的收件人：4xx 等临时错误和连接中断按退避重试，5xx 永久错误直接报告。
+
+smtplib 不支持 SMTP PIPELINING，连接复用省去的是每封邮件的 TCP/TLS 握手和登录。
+
+合集邮件 (build_digest_message) 把多道题目放进一封邮件：图片按内容哈希生成 Content-ID，
+内容相同的图片只附加一次；附件总大小 (编码后) 超过预算时，放不下的图片改为指向图床缩略图的链接。
+"""
+import hashlib
+import html
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from biliq_download import IMAGE_PROFILES, variant_url
+from biliq_metrics import get_metrics
+
+SMTP_POOL_SIZE = 3                # 并行的 SMTP 连接数
+MAX_MESSAGES_PER_CONNECTION = 50  # 单个连接发送的邮件数上限，达到后重新连接
+MAX_RETRIES = 2                   # 临时失败的收件人最多重试的轮数
+RETRY_BACKOFF = 5.0               # 第 n 轮重试前等待 n * RETRY_BACKOFF 秒
+SMTP_TIMEOUT = 60
+DIGEST_MAX_BYTES = 15 * 1024 * 1024  # 合集邮件附件的总预算 (编码后)，多数邮箱限制单封邮件 20~25 MB
+DIGEST_THUMBNAIL_PROFILE = 'thumbnail'
+
+
+def parse_recipients(email_config):
+    """
+    从 EMAIL 配置中读取收件人：receiver 可以是单个地址、逗号分隔的多个地址或地址列表，
+    recipients_file 为每行一个地址的文本文件 (# 开头为注释)。按首次出现的顺序去重。
+    """
+    receivers = email_config.get('receiver') or []
+    if isinstance(receivers, str):
+        receivers = receivers.split(',')
+    addresses = list(receivers)
+    recipients_file = email_config.get('recipients_file')
+    if recipients_file:
+        with open(recipients_file, 'r', encoding='utf-8') as f:
+            addresses.extend(line.split('#', 1)[0] for line in f)
+    seen, result = set(), []
+    for address in addresses:
+        address = address.strip()
+        if address and address.lower() not in seen:
+            seen.add(address.lower())
+            result.append(address)
+    return result
+
+
+def _image_subtype(image_path):
+    image_subtype = os.path.splitext(image_path)[1].lstrip('.').lower() or 'jpeg'
+    return 'jpeg' if image_subtype == 'jpg' else image_subtype
+
+
+def encoded_size(size):
+    """附件经 base64 编码 (每行 76 个字符加 CRLF) 后的字节数。"""
+    return (size + 2) // 3 * 4 * 78 // 76
+
+
+def build_question_message(sender, question_data):
+    """构建每日一题邮件 (不含 To 头)。第一张图片的 Content-ID 为 question_image，其余为 question_image_2 ..."""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['Subject'] = f"B站每日一题 - {question_data['title']}"
+
+    image_paths = question_data.get('image_paths') or [question_data['image_path']]
+    content_ids = ['question_image' if i == 0 else f'question_image_{i + 1}' for i in range(len(image_paths))]
+    image_tags = "\n".join(f'<p><img src="cid:{cid}" width="80%"></p>' for cid in content_ids)
+    email_body = f"""
+        <html>
+        <body>
+            <h2>{question_data['title']} ({question_data['pub_time']})</h2>
+            <p><b>题目内容:</b></p>
+            <p>{question_data['text']}</p>
+            {image_tags}
+        </body>
+        </html>
+        """
+    msg.attach(MIMEText(email_body, 'html'))
+
+    # 添加图片附件 (显式指定子类型，WebP 等格式无法被自动识别)
+    for image_path, cid in zip(image_paths, content_ids):
+        with open(image_path, 'rb') as img_file:
+            img = MIMEImage(img_file.read(), _subtype=_image_subtype(image_path))
+        img.add_header('Content-ID', f'<{cid}>')
+        msg.attach(img)
+    return msg
+
+
+def _thumbnail_link(image_url):
+    """返回 (原图链接, 缩略图地址)；非 B站图床的图片没有缩略图，直接链接原图。"""
+    if not image_url: return None, None
+    original = variant_url(image_url, {})
+    thumbnail = variant_url(image_url, IMAGE_PROFILES.get(DIGEST_THUMBNAIL_PROFILE) or {})
+    return original, thumbnail or original
+
+
+def build_digest_message(sender, questions, max_bytes=DIGEST_MAX_BYTES):
+    """
+    构建多道题目的合集邮件 (不含 To 头)，questions 按发布时间从旧到新排列，
+    每项除 title / text / pub_time / question_number / image_paths 外还可以带 image_urls (图床原始地址)。
+    图片的 Content-ID 由内容的 SHA-256 得出，相同内容只附加一次；按题目顺序附加，
+    编码后的总大小超过 max_bytes 时，之后放不下的图片改为链接到图床缩略图 (点击打开原图)。
+    返回 (邮件, 统计)，统计为 {'attached', 'linked', 'deduplicated', 'bytes'}。
+    """
+    msg = MIMEMultipart('related')
+    msg['From'] = sender
+    numbers = [q['question_number'] for q in questions]
+    msg['Subject'] = (f"B站每日一题合集 - 第 {numbers[0]} ~ {numbers[-1]} 题 (共 {len(questions)} 题)"
+                      if len(questions) > 1 else f"B站每日一题 - {questions[0]['title']}")
+    stats = {'attached': 0, 'linked': 0, 'deduplicated': 0, 'bytes': 0}
+    attachments = {}  # Content-ID -> MIMEImage
+    sections = []
+    for question in questions:
+        image_paths = question.get('image_paths') or [question['image_path']]
+        image_urls = list(question.get('image_urls') or [])
+        image_tags = []
+        for index, image_path in enumerate(image_paths):
+            with open(image_path, 'rb') as img_file:
+                data = img_file.read()
+            cid = f"img-{hashlib.sha256(data).hexdigest()[:24]}@biliq"
+            if cid in attachments:
+                stats['deduplicated'] += 1
+            elif stats['bytes'] + encoded_size(len(data)) <= max_bytes:
+                img = MIMEImage(data, _subtype=_image_subtype(image_path))
+                img.add_header('Content-ID', f'<{cid}>')
+                attachments[cid] = img
+                stats['attached'] += 1
+                stats['bytes'] += encoded_size(len(data))
+            else:
+                original, thumbnail = _thumbnail_link(image_urls[index] if index < len(image_urls) else None)
+                stats['linked'] += 1
+                if original:
+                    image_tags.append(f'<p><a href="{html.escape(original)}"><img src="{html.escape(thumbnail)}" '
+                                      f'alt="第 {question["question_number"]} 题图片"></a><br>'
+                                      f'<small>邮件大小已达上限，点击图片查看原图</small></p>')
+                else:
+                    image_tags.append("<p><small>邮件大小已达上限，图片未附加</small></p>")
+                continue
+            image_tags.append(f'<p><img src="cid:{cid}" width="80%"></p>')
+        anchor = f"q{question['question_number']}"
+        sections.append(f"""
+            <h2 id="{anchor}">{html.escape(question['title'])} ({question['pub_time']})</h2>
+            <p><b>题目内容:</b></p>
+            <p>{html.escape(question['text'])}</p>
+            {"".join(image_tags)}
+            <hr>""")
+    contents = "".join(f'<li><a href="#q{q["question_number"]}">{html.escape(q["title"])}</a> ({q["pub_time"]})</li>'
+                       for q in questions)
+    email_body = f"""
+        <html>
+        <body>
+            <h1>B站每日一题合集 (共 {len(questions)} 题)</h1>
+            <ol>{contents}</ol>
+            {"".join(sections)}
+        </body>
+        </html>
+        """
+    msg.attach(MIMEText(email_body, 'html'))
+    for img in attachments.values():
+        msg.attach(img)
+    return msg, stats
+
+
+def serialize_message(msg):
+    """把邮件序列化为 CRLF 换行的字节串，所有收件人共用。"""
+    # 沿用 compat32 策略 (与 smtplib.send_message 一致)，中文主题按 RFC 2047 编码
+    return msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+
+
+def personalize(message_bytes, recipient):
+    """在共用的邮件字节前加上收件人的 To 头 (头部顺序不影响解析)。"""
+    return b"To: " + recipient.encode('utf-8') + b"\r\n" + message_bytes
+
+
+class DeliveryReport:
+    """一次投递的结果：sent 为成功的收件人，failed 为 {收件人: 错误说明}。"""
+
+    def __init__(self):
+        self.sent = []
+        self.failed = {}
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def _sent(self, recipient):
+        with self._lock:
+            self.sent.append(recipient)
+            self.failed.pop(recipient, None)
+
+    def _failed(self, recipient, error):
+        with self._lock:
+            self.failed[recipient] = error
+
+
+class SMTPDeliveryPool:
+    """按 EMAIL 配置建立的 SMTP 连接池。每次 deliver() 结束时关闭全部连接。"""
+
+    def __init__(self, email_config, pool_size=SMTP_POOL_SIZE, max_per_connection=MAX_MESSAGES_PER_CONNECTION,
+                 max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF, timeout=SMTP_TIMEOUT):
+        self.email_config = email_config
+        self.sender = email_config['sender']
+        self.pool_size = max(1, int(pool_size))
+        self.max_per_connection = max(1, int(max_per_connection))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+
+    def _connect(self):
+        # smtp_ssl 为 false 时使用明文 SMTP，仅用于本地测试服务器
+        smtp_class = smtplib.SMTP_SSL if self.email_config.get('smtp_ssl', True) else smtplib.SMTP
+        server = smtp_class(self.email_config['smtp_server'], self.email_config['smtp_port'], timeout=self.timeout)
+        try:
+            server.login(self.sender, self.email_config['password'])
+        except BaseException:
+            _close_quietly(server)
+            raise
+        get_metrics().inc('smtp_connections')
+        return server
+
+    def _worker(self, message_bytes, work, report, transient, on_sent):
+        connection, sent_on_connection = None, 0
+        try:
+            while True:
+                try: recipient = work.get_nowait()
+                except queue.Empty: return
+                try:
+                    if connection is None or sent_on_connection >= self.max_per_connection:
+                        _close_quietly(connection)
+                        connection, sent_on_connection = None, 0
+                        connection = self._connect()
+                    connection.sendmail(self.sender, [recipient], personalize(message_bytes, recipient))
+                    sent_on_connection += 1
+                    report._sent(recipient)
+                    if on_sent: on_sent(recipient)
+                except smtplib.SMTPAuthenticationError as e:
+                    # 登录失败对所有收件人都一样，本线程不再继续
+                    report._failed(recipient, f"登录失败: {e.smtp_code} {_decode(e.smtp_error)}")
+                    transient.put(recipient)
+                    return
+                except smtplib.SMTPRecipientsRefused as e:
+                    code, error = e.recipients.get(recipient, (550, b""))
+                    report._failed(recipient, f"{code} {_decode(error)}")
+                    if code < 500: transient.put(recipient)
+                except smtplib.SMTPResponseException as e:
+                    report._failed(recipient, f"{e.smtp_code} {_decode(e.smtp_error)}")
+                    if e.smtp_code < 500: transient.put(recipient)
+                except (smtplib.SMTPException, OSError) as e:
+                    # 连接中断等：丢弃连接，收件人留待重试
+                    report._failed(recipient, str(e) or e.__class__.__name__)
+                    transient.put(recipient)
+                    _close_quietly(connection)
+                    connection = None
+        finally:
+            _close_quietly(connection)
+
+    def _deliver_once(self, message_bytes, recipients, report, on_sent):
+        work, transient = queue.Queue(), queue.Queue()
+        for recipient in recipients:
+            work.put(recipient)
+        threads = [threading.Thread(target=self._worker, args=(message_bytes, work, report, transient, on_sent),
+                                    daemon=True)
+                   for _ in range(min(self.pool_size, len(recipients)))]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        # 所有线程都因登录失败退出时，剩下的收件人同样算作临时失败
+        while not work.empty():
+            recipient = work.get_nowait()
+            report._failed(recipient, "未能建立 SMTP 连接")
+            transient.put(recipient)
+        return [transient.get_nowait() for _ in range(transient.qsize())]
+
+    def deliver(self, message_bytes, recipients, on_sent=None):
+        """
+        把 message_bytes 投递给全部收件人，只重试临时失败的收件人。返回 DeliveryReport。
+        on_sent(recipient) 在每封邮件送达后立即调用 (在投递线程中)，用于逐封记录投递结果。
+        """
+        report = DeliveryReport()
+        metrics = get_metrics()
+        pending = list(recipients)
+        with metrics.time('smtp'):
+            for attempt in range(self.max_retries + 1):
+                if not pending: break
+                if attempt:
+                    print(f"  {len(pending)} 个收件人投递失败，{attempt * self.retry_backoff:g} 秒后第 {attempt} 次重试...")
+                    metrics.inc('smtp_retries', len(pending))
+                    time.sleep(attempt * self.retry_backoff)
+                report.attempts = attempt + 1
+                pending = self._deliver_once(message_bytes, pending, report, on_sent)
+        metrics.inc('emails_sent', len(report.sent))
+        metrics.inc('smtp_errors', len(report.failed))
+        return report
+
+
+def pool_from_config(email_config):
+    """按 EMAIL 配置中的 pool_size / max_per_connection / max_retries / retry_backoff 创建连接池。"""
+    return SMTPDeliveryPool(email_config,
+                            pool_size=email_config.get('pool_size', SMTP_POOL_SIZE),
+                            max_per_connection=email_config.get('max_per_connection', MAX_MESSAGES_PER_CONNECTION),
+                            max_retries=email_config.get('max_retries', MAX_RETRIES),
+                            retry_backoff=float(email_config.get('retry_backoff', RETRY_BACKOFF)))
+
+
+def _decode(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+def _close_quietly(connection):
+    if connection is None: return
+    try: connection.quit()
+    except (smtplib.SMTPException, OSError):
+        try: connection.close()
+        except OSError: pass
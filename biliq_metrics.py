@@ -0,0 +1,281 @@
+"""
+按阶段统计的运行指标。
+
+各模块把耗时和计数记入进程内共享的 Metrics：
+
+- biliq_stage_seconds{stage=...}  各阶段耗时直方图，stage 为 rate_limit / fetch / parse / download / render / smtp
+- biliq_cards_seen_total / biliq_cards_matched_total / biliq_cards_skipped_total  卡片数
+- biliq_api_requests_total / biliq_api_errors_total{code=...}  动态接口请求数和错误码
+- biliq_downloads_total{result=...} / biliq_download_bytes_total  图片下载结果和下载字节数
+- biliq_entries_written_total / biliq_duplicate_questions_total / biliq_emails_sent_total / biliq_smtp_errors_total
+
+每次运行结束后按 config.json 中的 METRICS_PROM_FILE 写出 Prometheus 文本格式
+(可配合 node_exporter 的 textfile collector)，按 METRICS_JSONL_FILE 追加一行 JSON；
+设置 METRICS_PORT 后，biliq_email.py 的常驻进程在 /metrics 和 /metrics.json 上实时提供指标。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from biliq_archive import atomic_write_text
+
+METRIC_PREFIX = "biliq_"
+STAGE_METRIC = "stage_seconds"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    STAGE_METRIC: "各阶段耗时 (秒)",
+    "cards_seen": "遍历的动态卡片数",
+    "cards_matched": "匹配 \"第 N 题\" 的卡片数",
+    "cards_skipped": "已处理而跳过的卡片数",
+    "api_requests": "动态接口请求数",
+    "api_errors": "动态接口错误数 (按错误码)",
+    "session_cache": "会话缓存 (hit 使用缓存的 buvid / miss 重新获取 / invalidated 因 -352、-101 失效)",
+    "downloads": "图片下载结果",
+    "download_bytes": "从网络下载的图片字节数",
+    "download_hedges": "图片对冲请求 (sent 发出 / won 对冲胜出 / lost 主请求胜出 / failover 失败后改用镜像)",
+    "download_host_seconds": "各图片主机的请求耗时 (秒)",
+    "entries_written": "写入归档的新条目数",
+    "duplicate_questions": "图片与已归档题目相近的新条目数",
+    "emails_sent": "成功发送的邮件数",
+    "digest_images": "合集邮件中的图片 (attached 附加 / linked 超出预算改为链接 / deduplicated 重复内容只附加一次)",
+    "smtp_errors": "发送失败的邮件数",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def _series(name, label_key, extra=()):
+    items = list(label_key) + list(extra)
+    if not items: return name
+    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return f"{name}{{{labels}}}"
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    if value == float('inf'): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """固定分桶的直方图 (累计计数在输出时计算)。"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float('inf'), self.count))
+        return result
+
+
+class Metrics:
+    """线程安全的计数器和直方图集合。下载线程、事件循环和主线程共用一个实例。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def observe_stage(self, stage, seconds):
+        self.observe(STAGE_METRIC, seconds, stage=stage)
+
+    @contextmanager
+    def time(self, stage):
+        """with metrics.time('fetch'): ... 记录一次阶段耗时 (出现异常时同样记录)。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """返回可 JSON 序列化的快照：{'counters': {series: value}, 'histograms': {series: {...}}}。"""
+        with self._lock:
+            counters = {_series(name, key): value for (name, key), value in sorted(self._counters.items())}
+            histograms = {_series(name, key): {'count': h.count, 'sum': round(h.sum, 6),
+                                               'buckets': {_format_number(b): c for b, c in h.cumulative()}}
+                          for (name, key), h in sorted(self._histograms.items())}
+        return {'ts': int(time.time()), 'started_at': int(self.started_at),
+                'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (0.0.4)。"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.count, h.sum, h.cumulative())) for key, h in self._histograms.items())
+        lines, described = [], set()
+        for (name, key), value in counters:
+            full_name = f"{METRIC_PREFIX}{name}_total"
+            if full_name not in described:
+                described.add(full_name)
+                if name in METRIC_HELP: lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{_series(full_name, key)} {_format_number(value)}")
+        for (name, key), (count, total, cumulative) in histograms:
+            full_name = f"{METRIC_PREFIX}{name}"
+            if full_name not in described:
+                described.add(full_name)
+                if name in METRIC_HELP: lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+            for bound, bucket_count in cumulative:
+                lines.append(f"{_series(full_name + '_bucket', key, [('le', _format_number(bound))])} {bucket_count}")
+            lines.append(f"{_series(full_name + '_sum', key)} {_format_number(round(total, 6))}")
+            lines.append(f"{_series(full_name + '_count', key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """按阶段汇总耗时，用于在运行结束时打印。返回 [(stage, 次数, 总秒数)]。"""
+        with self._lock:
+            return sorted(((dict(key).get('stage'), h.count, h.sum)
+                           for (name, key), h in self._histograms.items() if name == STAGE_METRIC),
+                          key=lambda row: -row[2])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path.split('?', 1)[0] == "/metrics":
+            body, content_type = metrics.to_prometheus().encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split('?', 1)[0] == "/metrics.json":
+            body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8'), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    """在后台线程中通过 HTTP 提供实时指标。"""
+
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+_shared_metrics = Metrics()
+_output = {'prom_file': None, 'jsonl_file': None, 'port': None, 'host': "127.0.0.1"}
+
+
+def get_metrics():
+    """返回进程内共享的 Metrics。"""
+    return _shared_metrics
+
+
+def configure_metrics(config):
+    """读取 config.json 中的 METRICS_PROM_FILE / METRICS_JSONL_FILE / METRICS_PORT / METRICS_HOST。"""
+    _output['prom_file'] = config.get("METRICS_PROM_FILE")
+    _output['jsonl_file'] = config.get("METRICS_JSONL_FILE")
+    _output['port'] = config.get("METRICS_PORT")
+    _output['host'] = config.get("METRICS_HOST", "127.0.0.1")
+    return _shared_metrics
+
+
+def write_metrics(script=None):
+    """运行结束后写出指标文件 (未配置时不做任何事)。写入失败只打印警告，不影响主流程。"""
+    try:
+        if _output['prom_file']:
+            atomic_write_text(_output['prom_file'], _shared_metrics.to_prometheus())
+        if _output['jsonl_file']:
+            record = _shared_metrics.snapshot()
+            if script: record['script'] = script
+            directory = os.path.dirname(_output['jsonl_file'])
+            if directory: os.makedirs(directory, exist_ok=True)
+            with open(_output['jsonl_file'], 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except (IOError, OSError) as e:
+        print(f"警告：写出运行指标失败: {e}")
+
+
+def start_metrics_server():
+    """按 METRICS_PORT 启动实时指标服务；未配置或端口被占用时返回 None。"""
+    if not _output['port']:
+        return None
+    try:
+        server = MetricsServer(_shared_metrics, int(_output['port']), _output['host']).start()
+    except OSError as e:
+        print(f"警告：无法在端口 {_output['port']} 上启动指标服务: {e}")
+        return None
+    host, port = server.address
+    print(f"实时指标: http://{host}:{port}/metrics")
+    return server
+
+
+def print_stage_summary():
+    """打印各阶段耗时汇总。"""
+    rows = _shared_metrics.summary()
+    if not rows: return
+    print("\n--- 各阶段耗时 ---")
+    for stage, count, total in rows:
+        print(f"  {stage:<10} {count:>5} 次  {total:8.3f}s")
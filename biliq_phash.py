@@ -0,0 +1,386 @@
+"""
+基于感知哈希的重复图片检测。
+
+同一道题被重新发布或改了题号时，图片文件的字节不同但内容几乎一样，内容寻址仓库无法合并它们。
+这里为每张归档图片计算 64 位 pHash (32x32 灰度图的 DCT 低频 8x8 与中位数比较)。
+每日一题图片顶部约 3/8 是每天相同的 "每日一题" 横幅，只有下方的题目区域不同；对整张图计算时
+低频系数几乎只反映这个模板，不同题目的距离只有 4~6，因此先裁掉横幅 (HEADER_CROP) 再计算。
+哈希保存在 SQLite 数据库 biliq_phash.db (可用 config.json 中的 PHASH_DB 修改) 中，按内容 SHA-256 缓存，
+相同内容的文件只计算一次。查询时所有哈希以 uint64 数组常驻内存，用 NumPy 一次算出与全部哈希的
+汉明距离，几万个哈希的比对在毫秒级完成。
+
+biliq_daily.py 写入新题目前会检查它的图片，与已有题目的图片距离不超过 PHASH_MAX_DISTANCE (默认 6) 时
+在 Markdown 条目中注明疑似重复的题目。对已有图片批量建索引和输出重复报告：
+
+    python biliq_phash.py                    # 为状态库中尚未建索引的图片计算哈希 (进程池)，并列出疑似重复的题目
+    python biliq_phash.py --max-distance 4 --json
+    python biliq_phash.py --rebuild          # 清空后重新计算全部哈希
+
+需要 numpy 和 Pillow (在第一次检测时才导入)；未安装时不做重复检测，其余功能不受影响。
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from biliq_imagestore import hash_file
+
+np = None    # numpy，由 available() 导入
+Image = None # PIL.Image，由 available() 导入
+
+PHASH_DB = "biliq_phash.db"
+PHASH_MAX_DISTANCE = 6   # 64 位哈希中最多允许不同的位数 (不同题目通常相差 14 位以上，缩放/转码的副本不超过 2 位)
+HASH_SIZE = 8            # 取 DCT 左上角 HASH_SIZE x HASH_SIZE 个低频系数
+SAMPLE_SIZE = 32         # 先缩放到 SAMPLE_SIZE x SAMPLE_SIZE 灰度图
+HEADER_CROP = 0.375      # 计算前裁掉的图片顶部比例 (每天相同的横幅)
+HASH_VERSION = 2         # 哈希算法版本 (记在 PRAGMA user_version 中)；与数据库不一致时清空旧哈希
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hashes (
+    path            TEXT PRIMARY KEY,
+    sha256          TEXT NOT NULL,
+    phash           INTEGER,
+    dynamic_id      TEXT,
+    question_number INTEGER,
+    indexed_at      INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_sha256 ON image_hashes (sha256);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_dynamic ON image_hashes (dynamic_id);
+"""
+
+
+def available():
+    """numpy 和 Pillow 都已安装时返回 True。第一次调用时导入它们 (约 0.1 秒)。"""
+    global np, Image
+    if np is None or Image is None:
+        try:
+            import numpy
+            from PIL import Image as pil_image
+        except ImportError:
+            return False
+        np, Image = numpy, pil_image
+    return True
+
+
+_dct_matrix = None
+
+
+def _dct():
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = np.arange(SAMPLE_SIZE)
+        matrix = np.sqrt(2.0 / SAMPLE_SIZE) * np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * SAMPLE_SIZE))
+        matrix[0] /= np.sqrt(2.0)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+
+def image_phash(path):
+    """计算图片去掉顶部横幅后的 64 位 pHash (无符号 int)。"""
+    if not available(): raise ImportError("需要 numpy 和 Pillow")
+    with Image.open(path) as img:
+        img.draft('L', (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4)) # JPEG 解码时直接缩小，其余格式忽略
+        resampling = getattr(Image, 'Resampling', Image).LANCZOS
+        width, height = img.size
+        body = img.convert('L').crop((0, int(height * HEADER_CROP), width, height))
+        pixels = np.asarray(body.resize((SAMPLE_SIZE, SAMPLE_SIZE), resampling), dtype=np.float32)
+    dct = _dct()
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:]) # 不含直流分量
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hash_image_file(path):
+    """进程池任务：返回 (path, sha256, phash)；图片无法解码时 phash 为 None，文件不存在时返回 None。"""
+    try:
+        sha256 = hash_file(path)
+    except OSError:
+        return None
+    try:
+        return path, sha256, image_phash(path)
+    except Exception:
+        return path, sha256, None
+
+
+def hamming_distances(hashes, value):
+    """hashes (uint64 数组) 中每个哈希与 value 的汉明距离。"""
+    diff = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, 'bitwise_count'): # numpy >= 2.0
+        return np.bitwise_count(diff)
+    return np.unpackbits(diff.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def _to_signed(value):
+    # SQLite 的 INTEGER 是有符号 64 位
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class PhashIndex:
+    """线程安全的感知哈希索引。哈希同时保存在 SQLite 和内存中的 uint64 数组里。"""
+
+    def __init__(self, path=PHASH_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != HASH_VERSION:
+            cleared = self._conn.execute("DELETE FROM image_hashes").rowcount
+            self._conn.execute(f"PRAGMA user_version = {HASH_VERSION}")
+            if cleared:
+                print(f"感知哈希算法已更新，已清空 {path} 中的 {cleared} 个旧哈希；"
+                      f"运行 python biliq_phash.py 为已有图片重新建立索引。")
+        self._conn.commit()
+        self._hashes = None # uint64 数组，容量按倍数增长，前 _count 个有效
+        self._entries = []  # 与 _hashes 对应的 (path, dynamic_id, question_number)
+        self._positions = {} # path -> 在 _hashes / _entries 中的下标，与数据库的 path 主键一致，每个路径只占一项
+        self._count = 0
+
+    def _ensure_loaded(self):
+        if self._hashes is not None: return
+        rows = self._conn.execute("SELECT path, dynamic_id, question_number, phash FROM image_hashes "
+                                  "WHERE phash IS NOT NULL").fetchall()
+        self._hashes = np.zeros(max(1024, len(rows) * 2), dtype=np.uint64)
+        self._hashes[:len(rows)] = np.array([_to_unsigned(r[3]) for r in rows], dtype=np.uint64)
+        self._entries = [(r[0], r[1], r[2]) for r in rows]
+        self._positions = {r[0]: i for i, r in enumerate(rows)}
+        self._count = len(rows)
+
+    def _put(self, path, dynamic_id, question_number, phash):
+        """写入或替换 path 的内存项；phash 为 None 时删除该项 (数据库中它的哈希同样被替换为 NULL)。"""
+        position = self._positions.get(path)
+        if position is None:
+            if phash is not None: self._append(path, dynamic_id, question_number, phash)
+        elif phash is not None:
+            self._hashes[position] = np.uint64(phash)
+            self._entries[position] = (path, dynamic_id, question_number)
+        else:
+            self._remove(position)
+
+    def _remove(self, position):
+        # 用最后一项填补空位，保持前 _count 项连续
+        last = self._count - 1
+        del self._positions[self._entries[position][0]]
+        if position != last:
+            self._hashes[position] = self._hashes[last]
+            self._entries[position] = self._entries[last]
+            self._positions[self._entries[position][0]] = position
+        self._entries.pop()
+        self._count = last
+
+    def _append(self, path, dynamic_id, question_number, phash):
+        if self._count == len(self._hashes):
+            grown = np.zeros(len(self._hashes) * 2, dtype=np.uint64)
+            grown[:self._count] = self._hashes
+            self._hashes = grown
+        self._hashes[self._count] = np.uint64(phash)
+        self._entries.append((path, dynamic_id, question_number))
+        self._positions[path] = self._count
+        self._count += 1
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return self._count
+
+    def indexed_paths(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT path FROM image_hashes")}
+
+    def cached_phash(self, sha256):
+        """相同内容的图片已计算过时返回它的哈希。"""
+        with self._lock:
+            row = self._conn.execute("SELECT phash FROM image_hashes WHERE sha256 = ? AND phash IS NOT NULL LIMIT 1",
+                                     (sha256,)).fetchone()
+        return _to_unsigned(row[0]) if row else None
+
+    def add_many(self, rows):
+        """rows 为 (path, sha256, phash, dynamic_id, question_number) 列表；phash 为 None 表示无法解码。"""
+        now = int(time.time())
+        with self._lock, self._conn:
+            self._ensure_loaded()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO image_hashes (path, sha256, phash, dynamic_id, question_number, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(path, sha256, _to_signed(phash) if phash is not None else None,
+                  str(dynamic_id) if dynamic_id is not None else None,
+                  int(question_number) if question_number is not None else None, now)
+                 for path, sha256, phash, dynamic_id, question_number in rows])
+            for path, sha256, phash, dynamic_id, question_number in rows:
+                self._put(path, str(dynamic_id) if dynamic_id is not None else None, question_number, phash)
+
+    def find_similar(self, phash, max_distance=PHASH_MAX_DISTANCE, exclude_dynamic_id=None):
+        """返回与 phash 距离不超过 max_distance 的图片 [{path, dynamic_id, question_number, distance}]，按距离排序。"""
+        with self._lock:
+            self._ensure_loaded()
+            distances = hamming_distances(self._hashes[:self._count], phash)
+            candidates = np.flatnonzero(distances <= max_distance)
+            matches = [(int(distances[i]),) + self._entries[i] for i in candidates]
+        exclude = str(exclude_dynamic_id) if exclude_dynamic_id is not None else None
+        return [{'distance': distance, 'path': path, 'dynamic_id': dynamic_id, 'question_number': question_number}
+                for distance, path, dynamic_id, question_number in sorted(matches)
+                if exclude is None or dynamic_id != exclude]
+
+    def duplicate_pairs(self, max_distance=PHASH_MAX_DISTANCE):
+        """列出属于不同动态、距离不超过 max_distance 的图片对 [(distance, entry_a, entry_b)]。"""
+        with self._lock:
+            self._ensure_loaded()
+            hashes, entries, count = self._hashes[:self._count].copy(), list(self._entries), self._count
+        pairs = []
+        for i in range(count - 1):
+            distances = hamming_distances(hashes[i + 1:], hashes[i])
+            for offset in np.flatnonzero(distances <= max_distance):
+                j = i + 1 + int(offset)
+                if entries[i][1] != entries[j][1]:
+                    pairs.append((int(distances[offset]), entries[i], entries[j]))
+        pairs.sort(key=lambda pair: pair[0])
+        return pairs
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM image_hashes")
+            self._hashes, self._entries, self._positions, self._count = None, [], {}, 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_and_index(index, dynamic_id, question_number, image_paths, max_distance=PHASH_MAX_DISTANCE):
+    """
+    检查一道新题的图片是否与已有题目的图片相近，然后把这些图片加入索引。
+    返回疑似重复的题目 [{dynamic_id, question_number, distance}]，每道题只保留最小距离。
+    """
+    rows, duplicates = [], {}
+    for path in image_paths:
+        sha256 = hash_file(path)
+        phash = index.cached_phash(sha256)
+        if phash is None:
+            try: phash = image_phash(path)
+            except Exception: phash = None
+        if phash is not None:
+            for match in index.find_similar(phash, max_distance, exclude_dynamic_id=dynamic_id):
+                best = duplicates.get(match['dynamic_id'])
+                if best is None or match['distance'] < best['distance']:
+                    duplicates[match['dynamic_id']] = {'dynamic_id': match['dynamic_id'], 'distance': match['distance'],
+                                                       'question_number': match['question_number']}
+        rows.append((path, sha256, phash, dynamic_id, question_number))
+    index.add_many(rows)
+    return sorted(duplicates.values(), key=lambda d: d['distance'])
+
+
+def index_images(index, images, workers=None, batch_size=256):
+    """
+    用进程池为尚未建索引的图片计算哈希。images 为 (path, dynamic_id, question_number) 列表。
+    返回新建索引的图片数。
+    """
+    known = index.indexed_paths()
+    todo = [image for image in images if image[0] not in known and os.path.isfile(image[0])]
+    if not todo: return 0
+    owners = {path: (dynamic_id, question_number) for path, dynamic_id, question_number in todo}
+    indexed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for result in pool.map(hash_image_file, [path for path, _, _ in todo], chunksize=32):
+            if result is None: continue
+            path, sha256, phash = result
+            batch.append((path, sha256, phash) + owners[path])
+            if len(batch) >= batch_size:
+                index.add_many(batch)
+                indexed += len(batch)
+                batch = []
+        index.add_many(batch)
+        indexed += len(batch)
+    return indexed
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+_settings = {'db': PHASH_DB, 'max_distance': PHASH_MAX_DISTANCE, 'enabled': True}
+
+
+def get_phash_index():
+    """返回进程内共享的感知哈希索引；numpy / Pillow 未安装或已在配置中关闭时返回 None。"""
+    global _shared_index
+    if not (_settings['enabled'] and available()): return None
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = PhashIndex(_settings['db'])
+        return _shared_index
+
+
+def configure_phash_index(config):
+    """读取 config.json 中的 PHASH_DB / PHASH_MAX_DISTANCE / DUPLICATE_CHECK (默认开启)。"""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is not None:
+            _shared_index.close()
+            _shared_index = None
+        _settings['db'] = config.get("PHASH_DB", PHASH_DB)
+        _settings['max_distance'] = int(config.get("PHASH_MAX_DISTANCE", PHASH_MAX_DISTANCE))
+        _settings['enabled'] = bool(config.get("DUPLICATE_CHECK", True))
+
+
+def max_distance():
+    return _settings['max_distance']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为归档图片建立感知哈希索引并列出疑似重复的题目")
+    parser.add_argument("--max-distance", type=int, help=f"最大汉明距离 (默认 {PHASH_MAX_DISTANCE})")
+    parser.add_argument("--workers", type=int, help="计算哈希的进程数 (默认 CPU 核数)")
+    parser.add_argument("--rebuild", action='store_true', help="清空索引后重新计算")
+    parser.add_argument("--json", action='store_true', help="以 JSON 输出")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+
+    if not available():
+        print("错误：重复检测需要 numpy 和 Pillow，请先运行 pip install numpy Pillow")
+        return 1
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    from biliq_state import configure_state_store, get_state_store
+    configure_state_store(config)
+    configure_phash_index(dict(config, DUPLICATE_CHECK=True))
+    index = get_phash_index()
+    distance = args.max_distance if args.max_distance is not None else max_distance()
+
+    if args.rebuild: index.clear()
+    start = time.perf_counter()
+    indexed = index_images(index, get_state_store().iter_images(), args.workers)
+    if indexed:
+        print(f"已为 {indexed} 张图片计算感知哈希，耗时 {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    start = time.perf_counter()
+    pairs = index.duplicate_pairs(distance)
+    elapsed = time.perf_counter() - start
+    if args.json:
+        print(json.dumps([{'distance': d, 'a': dict(zip(('path', 'dynamic_id', 'question_number'), a)),
+                           'b': dict(zip(('path', 'dynamic_id', 'question_number'), b))}
+                          for d, a, b in pairs], ensure_ascii=False, indent=2))
+        return 0
+    for d, a, b in pairs:
+        print(f"第 {a[2]} 题 (ID {a[1]}) <-> 第 {b[2]} 题 (ID {b[1]})  距离 {d}\n    {a[0]}\n    {b[0]}")
+    print(f"\n索引中共 {len(index)} 张图片，疑似重复 {len(pairs)} 对 (距离 <= {distance})，比对耗时 {elapsed * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
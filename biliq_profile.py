@@ -0,0 +1,326 @@
+"""
+按阶段的 CPU 和内存剖析 (--profile)。
+
+biliq_daily.py 和 biliq_email.py 加上 --profile 运行时，以下阶段分别用 cProfile 和 tracemalloc 采集：
+
+- fetch     fetch_user_dynamics 中的接口请求
+- parse     卡片解析 (extract_questions)
+- download  图片下载 (包括对冲请求所在的线程)
+- archive   写入归档 (append_entries)
+
+异步的接口请求和按条产出的卡片解析只在它们自己真正执行的那几步打开剖析器，
+同一事件循环中穿插执行的其他协程和调用方处理记录的时间不会计入。
+没有 --profile 时所有钩子直接返回原对象，不产生任何开销。
+
+运行结束后在 PROFILE_DIR (默认 profile/) 下按 <脚本>-<时间> 建目录，每个阶段写出：
+
+- <stage>.prof  cProfile 原始数据，可用 python -m pstats <stage>.prof 按任意列排序查看
+- <stage>.txt   按累计耗时和自身耗时排序的函数列表、内存峰值增量，以及峰值时按代码行统计的内存分配
+
+tracemalloc 统计的是整个进程：下载线程并发运行时，各阶段的峰值会互相计入，只能作为近似值。
+默认只记录分配处的一层调用栈 (PROFILE_TRACE_FRAMES)，追踪开销约为平时的三倍；
+需要看到第三方库内的分配由哪一行本项目代码发起时可以调大，但每多一层开销都明显增加。
+归档写入在拼好分段内容、写盘之前调用 profile_checkpoint('archive')，报告中可以看到
+分段中拆分出的条目和拼接后的新内容各占多少内存。
+"""
+import contextlib
+import cProfile
+import functools
+import importlib
+import io
+import linecache
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import types
+
+PROFILE_DIR = "profile"
+TRACE_FRAMES = 1        # tracemalloc 为每块内存保存的调用栈深度，每多一层追踪开销成倍增加
+TOP_FUNCTIONS = 40      # 报告中每种排序列出的函数数
+TOP_ALLOCATIONS = 20    # 报告中列出的内存分配代码行数
+
+# 开始追踪之前先导入的网络库：导入本身有数十万次分配，追踪时要慢近十倍，也会淹没各阶段的内存数据
+PRELOAD_MODULES = ("requests", "bilibili_api")
+
+_SOURCE_PREFIX = "biliq_"
+_SELF_SOURCE = "biliq_profile.py"
+
+
+def _format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024: return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def _owner_frame(traceback):
+    """内存块调用栈中最内层的本项目代码行 (剖析器自身除外)，没有时返回 None；tracemalloc 的栈从外到内排列。"""
+    for frame in reversed(traceback):
+        name = os.path.basename(frame.filename)
+        if name.startswith(_SOURCE_PREFIX):
+            return frame if name != _SELF_SOURCE else None
+    return None
+
+
+class _StageData:
+    __slots__ = ('calls', 'sections', 'cpu_skipped', 'seconds', 'peak_sum', 'peak_max', 'stats',
+                 'snapshot', 'snapshot_growth', 'snapshot_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.sections = 0
+        self.cpu_skipped = 0
+        self.seconds = 0.0
+        self.peak_sum = 0
+        self.peak_max = 0
+        self.stats = None
+        self.snapshot = None
+        self.snapshot_growth = 0
+        self.snapshot_seconds = 0.0
+
+
+class StageProfiler:
+    """线程安全的按阶段剖析器。每个剖析段使用独立的 cProfile.Profile，结束时合并进所属阶段。"""
+
+    def __init__(self, output_dir=PROFILE_DIR, frames=TRACE_FRAMES):
+        for name in PRELOAD_MODULES:
+            try: importlib.import_module(name)
+            except ImportError: pass
+        self.output_dir = output_dir
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages = {}
+        self._active = 0
+        if not tracemalloc.is_tracing(): tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+
+    def _stage(self, stage):
+        data = self._stages.get(stage)
+        if data is None:
+            data = self._stages[stage] = _StageData()
+        return data
+
+    def count(self, stage):
+        with self._lock:
+            self._stage(stage).calls += 1
+
+    @contextlib.contextmanager
+    def section(self, stage, count=True):
+        """
+        with profiler.section('archive'): ... 剖析一段同步代码。
+        同一线程中已在剖析其他阶段时不再嵌套，这段代码计入外层阶段。
+        """
+        if getattr(self._local, 'stage', None) is not None:
+            yield
+            return
+        self._local.stage = stage
+        with self._lock:
+            # 峰值是进程级的，只在没有其他剖析段时重置，避免抹掉并发剖析段的峰值
+            if not self._active: tracemalloc.reset_peak()
+            self._active += 1
+        base = self._local.base = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None # Python 3.12 起同一时间只能有一个 cProfile 在运行
+        self._local.profile, self._local.paused = profile, 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start - self._local.paused
+            if profile is not None: profile.disable()
+            peak = max(tracemalloc.get_traced_memory()[1] - base, 0)
+            self._local.stage = self._local.profile = None
+            with self._lock:
+                self._active -= 1
+                data = self._stage(stage)
+                data.calls += 1 if count else 0
+                data.sections += 1
+                data.seconds += elapsed
+                data.peak_sum += peak
+                data.peak_max = max(data.peak_max, peak)
+                if profile is None:
+                    data.cpu_skipped += 1
+                elif data.stats is None:
+                    try: data.stats = pstats.Stats(profile)
+                    except TypeError: pass # 没有采集到任何函数调用
+                else:
+                    data.stats.add(profile)
+
+    def call(self, stage, func, *args, **kwargs):
+        with self.section(stage, count=False):
+            return func(*args, **kwargs)
+
+    async def run_coroutine(self, stage, coroutine):
+        self.count(stage)
+        return await self._step_coroutine(stage, coroutine)
+
+    @types.coroutine
+    def _step_coroutine(self, stage, coroutine):
+        # 逐步驱动协程，只在协程自身执行的每一步打开剖析器，等待期间事件循环中的其他协程不计入
+        value, error = None, None
+        while True:
+            with self.section(stage, count=False):
+                try:
+                    yielded = coroutine.throw(error) if error is not None else coroutine.send(value)
+                except StopIteration as stop:
+                    return stop.value
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                coroutine.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+    def iterate(self, stage, iterable):
+        """逐条产出 iterable 的元素，只剖析产出每个元素的那一步，调用方处理元素的时间不计入。"""
+        self.count(stage)
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.section(stage, count=False):
+                    try: item = next(iterator)
+                    except StopIteration: return
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                with self.section(stage, count=False): close()
+
+    def checkpoint(self, stage):
+        """当前线程正在剖析 stage 且内存占用超过该阶段之前的检查点时，记下此刻的内存快照。"""
+        if getattr(self._local, 'stage', None) != stage: return
+        growth = tracemalloc.get_traced_memory()[0] - self._local.base
+        with self._lock:
+            data = self._stage(stage)
+            if growth <= data.snapshot_growth: return
+            data.snapshot_growth = growth
+        # 拍快照的时间和调用不计入阶段
+        start, profile = time.perf_counter(), self._local.profile
+        if profile is not None: profile.disable()
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if profile is not None:
+                try: profile.enable()
+                except ValueError: pass
+            elapsed = time.perf_counter() - start
+            self._local.paused += elapsed
+        with self._lock:
+            data.snapshot_seconds += elapsed
+            if growth >= data.snapshot_growth: data.snapshot = snapshot
+
+    def _allocation_lines(self, snapshot, limit=TOP_ALLOCATIONS):
+        """
+        快照相对开始剖析时的内存增量，按本项目中发起分配的代码行汇总。
+        调用栈 (PROFILE_TRACE_FRAMES 层) 中没有本项目代码的分配，如导入模块和第三方库内部的缓存，不计入。
+        """
+        sizes = {}
+        for stat in snapshot.compare_to(self._baseline, 'traceback'):
+            frame = _owner_frame(stat.traceback) if stat.size_diff > 0 else None
+            if frame is None: continue
+            key = (frame.filename, frame.lineno)
+            size, count = sizes.get(key, (0, 0))
+            sizes[key] = (size + stat.size_diff, count + stat.count_diff)
+        rows = sorted(sizes.items(), key=lambda kv: -kv[1][0])[:limit]
+        return [(size, count, f"{os.path.basename(filename)}:{lineno}", linecache.getline(filename, lineno).strip())
+                for (filename, lineno), (size, count) in rows]
+
+    def _stage_report(self, stage, data):
+        lines = [f"阶段: {stage}",
+                 f"次数: {data.calls}  剖析段: {data.sections}  未采集 CPU: {data.cpu_skipped}  耗时合计: {data.seconds:.3f}s",
+                 f"内存峰值增量: 最大 {_format_bytes(data.peak_max)}  "
+                 f"平均 {_format_bytes(data.peak_sum // max(data.sections, 1))}"
+                 " (tracemalloc 统计整个进程，并发运行的阶段会互相计入)"]
+        if data.snapshot is not None:
+            lines += ["", f"检查点内存占用最高时 (比剖析段开始时多 {_format_bytes(data.snapshot_growth)})，"
+                          "相对开始运行时增加的内存按本项目代码行汇总",
+                      f"(拍快照共用时 {data.snapshot_seconds:.3f}s，不计入耗时合计，但计入下方 profile_checkpoint 的累计耗时):"]
+            lines += [f"  {_format_bytes(size):>12} {count:>8} 块  {location}  {source}"
+                      for size, count, location, source in self._allocation_lines(data.snapshot)]
+        if data.stats is not None:
+            for sort_key, title in (('cumulative', "按累计耗时排序"), ('tottime', "按自身耗时排序")):
+                buffer = io.StringIO()
+                data.stats.stream = buffer
+                data.stats.sort_stats(sort_key).print_stats(TOP_FUNCTIONS)
+                lines += ["", f"--- {title} ({sort_key}) ---", buffer.getvalue().strip("\n")]
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, script=None):
+        """把各阶段的报告写入 <output_dir>/<script>-<开始时间>/，返回目录和 [(阶段, 次数, 耗时, 峰值)]。"""
+        directory = os.path.join(self.output_dir, f"{script or 'biliq'}-"
+                                                  f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}")
+        os.makedirs(directory, exist_ok=True)
+        rows = []
+        with self._lock:
+            for stage, data in sorted(self._stages.items(), key=lambda kv: -kv[1].seconds):
+                if data.stats is not None: data.stats.dump_stats(os.path.join(directory, f"{stage}.prof"))
+                with open(os.path.join(directory, f"{stage}.txt"), 'w', encoding='utf-8') as f:
+                    f.write(self._stage_report(stage, data))
+                rows.append((stage, data.calls, data.seconds, data.peak_max))
+        return directory, rows
+
+
+_profiler = None
+_NULL_SECTION = contextlib.nullcontext()
+
+
+def get_profiler():
+    """返回本次运行的剖析器；没有 --profile 时返回 None。"""
+    return _profiler
+
+
+def configure_profiler(config, enabled):
+    """enabled (命令行 --profile) 时按 config.json 中的 PROFILE_DIR / PROFILE_TRACE_FRAMES 开始剖析。"""
+    global _profiler
+    if not enabled:
+        _profiler = None
+        return None
+    _profiler = StageProfiler(config.get("PROFILE_DIR", PROFILE_DIR), int(config.get("PROFILE_TRACE_FRAMES", TRACE_FRAMES)))
+    print(f"剖析模式：各阶段的 CPU 和内存报告将写入 {_profiler.output_dir}/")
+    return _profiler
+
+
+def profile_section(stage):
+    """with profile_section('archive'): ... 未开启剖析时是空的上下文管理器。"""
+    return _profiler.section(stage) if _profiler is not None else _NULL_SECTION
+
+
+def profile_coroutine(stage, coroutine):
+    """剖析协程自身执行的各步；未开启剖析时原样返回协程。"""
+    return _profiler.run_coroutine(stage, coroutine) if _profiler is not None else coroutine
+
+
+def profile_iter(stage, iterable):
+    """剖析产出每个元素的各步；未开启剖析时原样返回 iterable。"""
+    return _profiler.iterate(stage, iterable) if _profiler is not None else iterable
+
+
+def profiled(stage, func):
+    """包装提交到其他线程执行的函数，计入 stage 但不增加次数 (用于阶段内派发的工作)。"""
+    return functools.partial(_profiler.call, stage, func) if _profiler is not None else func
+
+
+def profile_checkpoint(stage):
+    """在内存占用可能最高的位置调用，见 StageProfiler.checkpoint。"""
+    if _profiler is not None: _profiler.checkpoint(stage)
+
+
+def write_profile_reports(script=None):
+    """写出剖析报告并打印各阶段汇总；未开启剖析时不做任何事。写入失败只打印警告。"""
+    if _profiler is None: return None
+    try:
+        directory, rows = _profiler.write_reports(script)
+    except OSError as e:
+        print(f"警告：写出剖析报告失败: {e}")
+        return None
+    print(f"\n--- 剖析报告 ({directory}) ---")
+    for stage, calls, seconds, peak in rows:
+        print(f"  {stage:<10} {calls:>5} 次  {seconds:8.3f}s  内存峰值增量 {_format_bytes(peak)}")
+    return directory
@@ -0,0 +1,49 @@
+"""
+全局令牌桶限速器。
+
+同一事件循环里的所有目标共用一个令牌桶，总请求速率不超过 rate (次/秒)，
+短时间内最多允许 capacity 次突发请求，避免多个 UID 同时抓取时一起触发 -412 风控。
+"""
+import asyncio
+import time
+
+RATE_LIMIT = 1.0   # 每秒补充的令牌数
+RATE_BURST = 3     # 令牌桶容量 (允许的突发请求数)
+
+
+class TokenBucket:
+    """asyncio 令牌桶：acquire() 在令牌不足时挂起，直到补充出足够的令牌。"""
+
+    def __init__(self, rate=RATE_LIMIT, capacity=RATE_BURST):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None  # 在事件循环内首次 acquire 时创建
+        self.waited = 0.0  # 累计等待时间 (秒)，用于运行报告
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # 持锁排队保证先到先得，后来的请求不会插队抢走刚补充的令牌
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                delay = (tokens - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= tokens
+
+
+def limiter_from_config(config):
+    """根据 config.json 中的 RATE_LIMIT / RATE_BURST 创建限速器。"""
+    return TokenBucket(rate=float(config.get("RATE_LIMIT", RATE_LIMIT)),
+                       capacity=float(config.get("RATE_BURST", RATE_BURST)))
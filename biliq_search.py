@@ -0,0 +1,301 @@
+"""
+归档题目的全文检索。
+
+索引保存在 SQLite 数据库 biliq_search.db (可用 config.json 中的 SEARCH_DB 修改) 中：
+questions 表保存题号、发布时间、正文和图片路径，questions_fts 是基于它的 FTS5 全文索引，
+使用 trigram 分词，中文无需分词词典即可按任意子串检索。biliq_daily.py 每写入一条新题目就同步更新索引；
+已有的分段归档在首次使用时一次性导入。
+
+    python biliq_search.py 一致连续 反例           # 同时包含两个词的题目
+    python biliq_search.py 反例 --since 2024-09-01 --uid 688379639
+    python biliq_search.py --number 42             # 按题号查找
+    python biliq_search.py --rebuild               # 按 config.json 中的目标重建索引
+
+少于 3 个字的检索词无法使用 trigram 索引，改为在正文中逐条匹配。
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from biliq_archive import load_index, split_entries
+from biliq_state import HEADING_RE, ID_COMMENT_RE, IMAGE_RE
+
+SEARCH_DB = "biliq_search.db"
+TRIGRAM_MIN_CHARS = 3
+DEFAULT_LIMIT = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    rowid           INTEGER PRIMARY KEY,
+    dynamic_id      TEXT NOT NULL UNIQUE,
+    uid             TEXT,
+    question_number INTEGER,
+    pub_ts          INTEGER,
+    title           TEXT,
+    text            TEXT NOT NULL,
+    image_paths     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_uid_ts ON questions (uid, pub_ts);
+CREATE INDEX IF NOT EXISTS idx_questions_number ON questions (question_number);
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5 (
+    text, content='questions', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS questions_ai AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS questions_ad AFTER DELETE ON questions BEGIN
+    INSERT INTO questions_fts (questions_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS questions_au AFTER UPDATE ON questions BEGIN
+    INSERT INTO questions_fts (questions_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO questions_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+TEXT_RE = re.compile(r"\*\*文本:\*\*\s*(.*?)\s*\*\*图片:\*\*", re.DOTALL)
+TITLE_RE = re.compile(r"^##\s+(.*?)\s*\(\d{4}-\d{2}-\d{2} \d{2}:\d{2}\)\s*$", re.MULTILINE)
+
+
+class SearchIndex:
+    """线程安全的全文索引封装。"""
+
+    def __init__(self, path=SEARCH_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def add_many(self, questions):
+        """
+        写入或更新题目，questions 为 dict 列表，
+        键为 dynamic_id / uid / question_number / pub_ts / title / text / image_paths。
+        """
+        rows = [(str(q['dynamic_id']), _str_or_none(q.get('uid')), _int_or_none(q.get('question_number')),
+                 _int_or_none(q.get('pub_ts')), q.get('title'), q.get('text') or "",
+                 json.dumps(list(q.get('image_paths') or []), ensure_ascii=False))
+                for q in questions]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO questions (dynamic_id, uid, question_number, pub_ts, title, text, image_paths) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (dynamic_id) DO UPDATE SET "
+                "uid = COALESCE(excluded.uid, uid), question_number = excluded.question_number, "
+                "pub_ts = excluded.pub_ts, title = excluded.title, text = excluded.text, image_paths = excluded.image_paths",
+                rows)
+        return len(rows)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def search(self, terms=(), uid=None, number=None, since=None, until=None, limit=DEFAULT_LIMIT):
+        """
+        检索同时包含全部 terms 的题目，可按 UID、题号和发布时间 (时间戳，含两端) 过滤。
+        有可用 trigram 的检索词时按相关度排序，否则按发布时间从新到旧。返回 dict 列表。
+        """
+        long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_CHARS]
+        short_terms = [t for t in terms if 0 < len(t) < TRIGRAM_MIN_CHARS]
+        where, params = [], []
+        if long_terms:
+            where.append("questions_fts MATCH ?")
+            params.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms))
+        for term in short_terms:
+            where.append("q.text LIKE ? ESCAPE '\\'")
+            params.append("%" + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + "%")
+        if uid is not None: where.append("q.uid = ?"); params.append(str(uid))
+        if number is not None: where.append("q.question_number = ?"); params.append(int(number))
+        if since is not None: where.append("q.pub_ts >= ?"); params.append(int(since))
+        if until is not None: where.append("q.pub_ts <= ?"); params.append(int(until))
+
+        if long_terms:
+            sql = ("SELECT q.dynamic_id, q.uid, q.question_number, q.pub_ts, q.title, q.image_paths, "
+                   "snippet(questions_fts, 0, '[', ']', '…', 16) "
+                   "FROM questions_fts JOIN questions q ON q.rowid = questions_fts.rowid "
+                   f"WHERE {' AND '.join(where)} ORDER BY bm25(questions_fts), q.pub_ts DESC LIMIT ?")
+        else:
+            sql = ("SELECT q.dynamic_id, q.uid, q.question_number, q.pub_ts, q.title, q.image_paths, "
+                   "substr(q.text, 1, 48) FROM questions q "
+                   f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY q.pub_ts DESC LIMIT ?")
+        params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'dynamic_id': r[0], 'uid': r[1], 'question_number': r[2], 'pub_ts': r[3], 'title': r[4],
+                 'image_paths': json.loads(r[5]), 'snippet': _highlight_short_terms(r[6], short_terms)}
+                for r in rows]
+
+    def import_archive(self, archive_dir, uid=None, force=False):
+        """
+        一次性把分段归档中的题目导入索引 (每个归档目录只导入一次，force=True 时重新导入)。
+        归档尚不存在时直接标记为已导入：之后写入的条目都由 add_many() 逐页加入索引。
+        返回导入的条目数。
+        """
+        meta_key = "imported:" + os.path.abspath(archive_dir)
+        if self._get_meta(meta_key) and not force:
+            return 0
+        index = load_index(archive_dir)
+        if index is None:
+            self._set_meta(meta_key, str(int(time.time())))
+            return 0
+        questions = []
+        for seg in index['segments']:
+            segment_path = os.path.join(archive_dir, seg['file'])
+            if not os.path.exists(segment_path): continue
+            with open(segment_path, 'r', encoding='utf-8') as f:
+                entries = split_entries(f.read())
+            questions.extend(parse_entry(dynamic_id, text, uid) for dynamic_id, text in entries.items())
+        self.add_many(questions)
+        self._set_meta(meta_key, str(int(time.time())))
+        print(f"已将归档 {archive_dir} 中的 {len(questions)} 道题导入全文索引 {self.path}。")
+        return len(questions)
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_entry(dynamic_id, entry_text, uid=None):
+    """从一条归档 Markdown 条目中解析出题号、标题、发布时间、正文和图片路径。"""
+    question = {'dynamic_id': dynamic_id, 'uid': uid, 'image_paths': IMAGE_RE.findall(entry_text)}
+    heading = HEADING_RE.search(entry_text)
+    if heading:
+        question['question_number'] = heading.group(1)
+        try: question['pub_ts'] = int(time.mktime(time.strptime(heading.group(2), '%Y-%m-%d %H:%M')))
+        except ValueError: pass
+    title = TITLE_RE.search(entry_text)
+    if title: question['title'] = title.group(1)
+    text = TEXT_RE.search(entry_text)
+    question['text'] = text.group(1) if text else ID_COMMENT_RE.sub("", entry_text).strip()
+    return question
+
+
+def _highlight_short_terms(snippet, short_terms):
+    for term in short_terms:
+        snippet = snippet.replace(term, f"[{term}]")
+    return snippet.replace("\n", " ")
+
+
+def _int_or_none(value):
+    try: return int(value) if value is not None else None
+    except (TypeError, ValueError): return None
+
+
+def _str_or_none(value):
+    return str(value) if value is not None else None
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+_search_db = SEARCH_DB
+
+
+def get_search_index():
+    """返回进程内共享的全文索引，首次调用时打开。"""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = SearchIndex(_search_db)
+        return _shared_index
+
+
+def configure_search_index(config):
+    """按 config.json 中的 SEARCH_DB 设置索引路径 (在首次使用时才打开)。"""
+    global _shared_index, _search_db
+    with _shared_lock:
+        if _shared_index is not None:
+            _shared_index.close()
+            _shared_index = None
+        _search_db = config.get("SEARCH_DB", SEARCH_DB)
+
+
+def _parse_date(value, end_of_day=False):
+    dt = datetime.strptime(value, '%Y-%m-%d')
+    if end_of_day: dt = dt.replace(hour=23, minute=59, second=59)
+    return int(dt.timestamp())
+
+
+def _format_result(result):
+    try: pub_time = datetime.fromtimestamp(int(result['pub_ts'])).strftime('%Y-%m-%d %H:%M')
+    except (TypeError, ValueError, OverflowError, OSError): pub_time = "未知时间"
+    title = result['title'] or f"第 {result['question_number']} 题"
+    lines = [f"{title} ({pub_time})  UID {result['uid'] or '?'}  ID {result['dynamic_id']}",
+             f"    {result['snippet']}"]
+    lines.extend(f"    {path}" for path in result['image_paths'])
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索已归档的每日一题")
+    parser.add_argument("terms", nargs='*', help="检索词 (多个词之间为“且”)")
+    parser.add_argument("--uid", help="只检索指定 UID")
+    parser.add_argument("--number", type=int, help="题号")
+    parser.add_argument("--since", help="发布日期下限 YYYY-MM-DD")
+    parser.add_argument("--until", help="发布日期上限 YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--json", action='store_true', help="以 JSON 输出")
+    parser.add_argument("--rebuild", action='store_true', help="按 config.json 中的目标重新导入全部归档")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    configure_search_index(config)
+    index = get_search_index()
+
+    if args.rebuild or index.count() == 0:
+        from biliq_daily import load_targets
+        for target in load_targets(config):
+            index.import_archive(target['archive_dir'], target['uid'], force=args.rebuild)
+        if args.rebuild and not args.terms and args.number is None:
+            print(f"索引中共有 {index.count()} 道题。")
+            return 0
+
+    if not args.terms and args.number is None and not (args.since or args.until or args.uid):
+        parser.print_usage()
+        return 1
+
+    start = time.perf_counter()
+    results = index.search(args.terms, uid=args.uid, number=args.number,
+                           since=_parse_date(args.since) if args.since else None,
+                           until=_parse_date(args.until, end_of_day=True) if args.until else None,
+                           limit=args.limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            print(_format_result(result))
+        print(f"\n共 {len(results)} 条结果，耗时 {elapsed_ms:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+B站会话缓存：在多次运行之间保存 buvid3 / buvid4 设备 Cookie 和 WBI 签名密钥。
+
+bilibili_api 在凭据缺少 buvid3 或 buvid4 时 (匿名模式，以及 config.json 里只有 buvid3 的登录模式)，
+每个进程第一次请求前都要先请求 spi 接口生成 buvid 再激活，WBI 签名的接口还要先请求 nav 取密钥。
+这些只在进程内缓存，每次运行 biliq_daily.py 或 biliq_email.py 都会多出几次请求，也更容易触发风控。
+
+SessionCache 把它们连同获取时间保存在 biliq_session.json (SESSION_CACHE_FILE) 中，两个脚本共用；
+未过期时直接填进凭据，每次运行只需一次真正的接口请求。接口返回 -352 (风控校验失败) 或 -101 (未登录)
+时丢弃缓存，下次请求重新获取。登录 Cookie (SESSDATA 等) 仍以 config.json 为准，不写入缓存。
+
+WBI 密钥没有公开的设置接口，读写的是 bilibili_api.utils.network 的模块级缓存；
+库的实现变化时只是不缓存 WBI 密钥，不影响请求。
+"""
+import asyncio
+import copy
+import json
+import threading
+import time
+import weakref
+
+from biliq_archive import atomic_write_text
+from biliq_metrics import get_metrics
+
+SESSION_CACHE_FILE = "biliq_session.json"
+BUVID_TTL = 7 * 86400     # buvid 的缓存有效期 (秒)
+WBI_TTL = 12 * 3600       # WBI 密钥每天轮换，缓存半天
+INVALIDATING_CODES = (-352, -101)
+
+_WBI_KEY_ATTR = "__wbi_mixin_key" # bilibili_api.utils.network 中的模块级缓存
+
+
+class SessionCache:
+    """线程安全的会话缓存，修改后立即原子地写回文件。"""
+
+    def __init__(self, path=SESSION_CACHE_FILE, buvid_ttl=BUVID_TTL, wbi_ttl=WBI_TTL):
+        self.path = path
+        self.buvid_ttl = buvid_ttl
+        self.wbi_ttl = wbi_ttl
+        self._lock = threading.Lock()
+        self._fetch_locks = weakref.WeakKeyDictionary() # 事件循环 -> asyncio.Lock
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            atomic_write_text(self.path, json.dumps(self._data, ensure_ascii=False, indent=2))
+        except OSError as e:
+            print(f"警告：无法保存会话缓存 {self.path}: {e}")
+
+    def _fresh(self, key, ttl, now=None):
+        value = self._data.get(key)
+        if not value: return None
+        fetched_at = self._data.get(f"{key}_at") or 0
+        return value if (now if now is not None else time.time()) - fetched_at < ttl else None
+
+    def buvid(self):
+        """返回未过期的 (buvid3, buvid4)；没有或已过期时返回 None。"""
+        with self._lock:
+            cached = self._fresh('buvid', self.buvid_ttl)
+        return tuple(cached) if cached else None
+
+    def wbi_key(self):
+        with self._lock:
+            return self._fresh('wbi_mixin_key', self.wbi_ttl)
+
+    def store(self, **values):
+        """记录新获取的值 (buvid=(b3, b4) / wbi_mixin_key=...) 并写回文件。"""
+        now = int(time.time())
+        with self._lock:
+            for key, value in values.items():
+                self._data[key] = list(value) if isinstance(value, tuple) else value
+                self._data[f"{key}_at"] = now
+            self._save()
+
+    def invalidate(self, reason=""):
+        """丢弃全部缓存 (接口返回 -352 / -101 时调用)，同时清空 bilibili_api 进程内的缓存。"""
+        with self._lock:
+            had_data = bool(self._data)
+            self._data = {}
+            if had_data: self._save()
+        try:
+            from bilibili_api.utils import network
+            network.refresh_buvid()
+            network.recalculate_wbi()
+        except Exception:
+            pass
+        if had_data:
+            get_metrics().inc('session_cache', result='invalidated')
+            print(f"  会话缓存已失效{f' ({reason})' if reason else ''}，下次请求将重新获取 buvid 和 WBI 密钥。")
+
+    def _fetch_lock(self):
+        loop = asyncio.get_running_loop()
+        lock = self._fetch_locks.get(loop)
+        if lock is None:
+            lock = self._fetch_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def prepare(self, credential=None):
+        """
+        返回填好 buvid3 / buvid4 的凭据副本 (credential 为 None 时新建匿名凭据)，并把缓存的 WBI 密钥交给 bilibili_api。
+        只填写凭据中为空的字段：调用方的凭据对象 (各目标、常驻进程的每轮检查共用) 不会被修改，
+        config.json 中配置的 BUVID3 也保持不变；缓存失效后下一次请求就会用上新获取的 buvid。
+        缓存过期或为空时获取一次新的 buvid 并写入缓存；同一事件循环中的并发请求只获取一次。
+        """
+        from bilibili_api import Credential
+        from bilibili_api.utils import network
+        credential = copy.copy(credential) if credential is not None else Credential()
+        metrics = get_metrics()
+
+        wbi_key = self.wbi_key()
+        if wbi_key and hasattr(network, _WBI_KEY_ATTR) and not getattr(network, _WBI_KEY_ATTR):
+            setattr(network, _WBI_KEY_ATTR, wbi_key)
+
+        if credential.buvid3 and credential.buvid4:
+            return credential
+        buvid = self.buvid()
+        if buvid is None:
+            async with self._fetch_lock():
+                buvid = self.buvid() # 等锁期间可能已由其他请求获取
+                if buvid is None:
+                    metrics.inc('session_cache', result='miss')
+                    buvid = tuple(await network.get_buvid())
+                    self.store(buvid=buvid)
+                    print("已获取新的 buvid 并写入会话缓存。")
+                else:
+                    metrics.inc('session_cache', result='hit')
+        else:
+            metrics.inc('session_cache', result='hit')
+        credential.buvid3 = credential.buvid3 or buvid[0]
+        credential.buvid4 = credential.buvid4 or buvid[1]
+        return credential
+
+    def capture(self):
+        """请求成功后，把 bilibili_api 本次运行中获取的 WBI 密钥写入缓存。"""
+        try:
+            from bilibili_api.utils import network
+            key = getattr(network, _WBI_KEY_ATTR, "")
+        except Exception:
+            return
+        if key and key != self.wbi_key():
+            self.store(wbi_mixin_key=key)
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+_settings = {'path': SESSION_CACHE_FILE, 'enabled': True, 'buvid_ttl': BUVID_TTL, 'wbi_ttl': WBI_TTL}
+
+
+def get_session_cache():
+    """返回进程内共享的会话缓存，首次调用时读取缓存文件；已在配置中关闭时返回 None。"""
+    global _shared_cache
+    if not _settings['enabled']: return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = SessionCache(_settings['path'], _settings['buvid_ttl'], _settings['wbi_ttl'])
+        return _shared_cache
+
+
+def configure_session_cache(config):
+    """读取 config.json 中的 SESSION_CACHE (默认开启) / SESSION_CACHE_FILE / SESSION_BUVID_TTL / SESSION_WBI_TTL。"""
+    global _shared_cache
+    with _shared_lock:
+        _shared_cache = None
+        _settings['enabled'] = bool(config.get("SESSION_CACHE", True))
+        _settings['path'] = config.get("SESSION_CACHE_FILE", SESSION_CACHE_FILE)
+        _settings['buvid_ttl'] = float(config.get("SESSION_BUVID_TTL", BUVID_TTL))
+        _settings['wbi_ttl'] = float(config.get("SESSION_WBI_TTL", WBI_TTL))
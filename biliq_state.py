@@ -0,0 +1,256 @@
+"""
+基于 SQLite 的持久化状态库。
+
+记录已处理的动态 ID、题号、发布时间和图片路径 (dynamics.image_path 为第一张，
+dynamic_images 按顺序记录一条动态的全部图片)，去重检查是一次主键查询，
+耗时与 Markdown 归档的大小无关。首次使用某个 Markdown 文件时，会从其中的
+<!-- ID: ... --> 注释一次性导入历史记录。
+
+sync_marks 表记录每个 UID 的同步水位 (已完整处理的最新动态 ID 和发布时间)，
+日常运行翻页时遇到水位即停止，不再获取和解析更早的动态。
+
+deliveries 表是邮件的投递记录，按 (动态 ID, 收件人) 记录已送达的邮件，
+邮件任务据此跳过已发送的题目，重启或重试时不会重复发送。
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+STATE_DB = "biliq_state.db"
+
+ID_COMMENT_RE = re.compile(r"<!--\s*ID:\s*(\d+)\s*-->")
+LEGACY_ID_RE = re.compile(r"dynamic_id(?:_str)?:\s*(\d+)", re.IGNORECASE)
+HEADING_RE = re.compile(r"^##\s.*?第\s*(\d+)\s*题\s*\((\d{4}-\d{2}-\d{2} \d{2}:\d{2})\)", re.MULTILINE)
+IMAGE_RE = re.compile(r"!\[[^\]]*\]\(([^)]+)\)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dynamics (
+    dynamic_id      TEXT PRIMARY KEY,
+    uid             TEXT,
+    question_number INTEGER,
+    pub_ts          INTEGER,
+    image_path      TEXT,
+    output_file     TEXT,
+    processed_at    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dynamics_uid_ts ON dynamics (uid, pub_ts);
+CREATE TABLE IF NOT EXISTS dynamic_images (
+    dynamic_id TEXT NOT NULL,
+    idx        INTEGER NOT NULL,
+    path       TEXT NOT NULL,
+    PRIMARY KEY (dynamic_id, idx)
+);
+CREATE TABLE IF NOT EXISTS sync_marks (
+    uid        TEXT PRIMARY KEY,
+    dynamic_id TEXT NOT NULL,
+    pub_ts     INTEGER,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    dynamic_id   TEXT NOT NULL,
+    recipient    TEXT NOT NULL,
+    uid          TEXT,
+    pub_ts       INTEGER,
+    delivered_at INTEGER NOT NULL,
+    PRIMARY KEY (dynamic_id, recipient)
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_uid ON deliveries (uid, dynamic_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore:
+    """线程安全的状态库封装。同一进程内的多个目标/线程共用一个连接。"""
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def is_processed(self, dynamic_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM dynamics WHERE dynamic_id = ?", (str(dynamic_id),)).fetchone()
+        return row is not None
+
+    def record_many(self, records):
+        """
+        批量写入已处理的动态，records 为 dict 列表，
+        键为 dynamic_id / uid / question_number / pub_ts / image_paths (或单个 image_path) / output_file。
+        """
+        now = int(time.time())
+        rows, image_rows = [], []
+        for r in records:
+            dynamic_id = str(r['dynamic_id'])
+            image_paths = list(r.get('image_paths') or ([r['image_path']] if r.get('image_path') else []))
+            rows.append((dynamic_id, _str_or_none(r.get('uid')), _int_or_none(r.get('question_number')),
+                         _int_or_none(r.get('pub_ts')), image_paths[0] if image_paths else None,
+                         r.get('output_file'), now))
+            image_rows.extend((dynamic_id, idx, path) for idx, path in enumerate(image_paths))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dynamics (dynamic_id, uid, question_number, pub_ts, image_path, output_file, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM dynamic_images WHERE dynamic_id = ?", [(row[0],) for row in rows])
+            self._conn.executemany("INSERT INTO dynamic_images (dynamic_id, idx, path) VALUES (?, ?, ?)", image_rows)
+
+    def image_paths(self, dynamic_id):
+        """返回一条动态的全部图片路径 (按动态中的顺序)。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM dynamic_images WHERE dynamic_id = ? ORDER BY idx",
+                                      (str(dynamic_id),)).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_images(self):
+        """返回全部已处理动态的图片 [(path, dynamic_id, question_number)]，按动态 ID 和图片顺序排列。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT i.path, i.dynamic_id, d.question_number FROM dynamic_images i "
+                "JOIN dynamics d ON d.dynamic_id = i.dynamic_id ORDER BY CAST(i.dynamic_id AS INTEGER), i.idx").fetchall()
+
+    def record(self, **record):
+        self.record_many([record])
+
+    def get_high_water_mark(self, uid):
+        """返回 UID 的同步水位 (dynamic_id, pub_ts)；从未同步过时返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT dynamic_id, pub_ts FROM sync_marks WHERE uid = ?", (str(uid),)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def advance_high_water_mark(self, uid, dynamic_id, pub_ts=None):
+        """把同步水位推进到 dynamic_id；水位只会前进，不会后退。返回是否有更新。"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT dynamic_id FROM sync_marks WHERE uid = ?", (str(uid),)).fetchone()
+            if row and int(row[0]) >= int(dynamic_id):
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_marks (uid, dynamic_id, pub_ts, updated_at) VALUES (?, ?, ?, ?)",
+                (str(uid), str(dynamic_id), _int_or_none(pub_ts), int(time.time())))
+        return True
+
+    def record_delivery(self, dynamic_id, recipient, uid=None, pub_ts=None):
+        """记录一封已送达的邮件 (收件人地址不区分大小写)。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO deliveries (dynamic_id, recipient, uid, pub_ts, delivered_at) VALUES (?, ?, ?, ?, ?)",
+                (str(dynamic_id), recipient.lower(), _str_or_none(uid), _int_or_none(pub_ts), int(time.time())))
+
+    def delivered_recipients(self, dynamic_id):
+        """返回已收到该动态邮件的收件人集合 (小写)。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT recipient FROM deliveries WHERE dynamic_id = ?", (str(dynamic_id),)).fetchall()
+        return {row[0] for row in rows}
+
+    def last_delivery(self, uid, recipients):
+        """
+        返回该 UID 已送达全部 recipients 的最新动态 (dynamic_id, pub_ts)；没有时返回 None。
+        只送达了部分收件人的动态不算在内，以便之后补发。
+        """
+        recipients = sorted({r.lower() for r in recipients})
+        if not recipients: return None
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_recipients (recipient TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM wanted_recipients")
+            self._conn.executemany("INSERT INTO wanted_recipients (recipient) VALUES (?)", [(r,) for r in recipients])
+            row = self._conn.execute(
+                "SELECT d.dynamic_id, MAX(d.pub_ts) FROM deliveries d JOIN wanted_recipients w ON d.recipient = w.recipient "
+                "WHERE d.uid = ? GROUP BY d.dynamic_id HAVING COUNT(*) = ? "
+                "ORDER BY CAST(d.dynamic_id AS INTEGER) DESC LIMIT 1", (str(uid), len(recipients))).fetchone()
+            self._conn.commit()
+        return (row[0], row[1]) if row else None
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def import_markdown(self, md_file, uid=None):
+        """
+        一次性从现有 Markdown 归档导入已处理的动态 ID (以及能解析出的题号、时间和图片路径)。
+        每个文件只导入一次，之后的运行不再扫描 Markdown。返回导入的条目数。
+        """
+        meta_key = "imported:" + os.path.abspath(md_file)
+        if self.get_meta(meta_key) or not os.path.exists(md_file):
+            return 0
+        with open(md_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        records = []
+        matches = list(ID_COMMENT_RE.finditer(content))
+        for i, match in enumerate(matches):
+            block_end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+            block = content[match.end():block_end]
+            record = {'dynamic_id': match.group(1), 'uid': uid, 'output_file': md_file}
+            heading = HEADING_RE.search(block)
+            if heading:
+                record['question_number'] = heading.group(1)
+                try: record['pub_ts'] = int(time.mktime(time.strptime(heading.group(2), '%Y-%m-%d %H:%M')))
+                except ValueError: pass
+            record['image_paths'] = IMAGE_RE.findall(block)
+            records.append(record)
+        known_ids = {r['dynamic_id'] for r in records}
+        records.extend({'dynamic_id': dynamic_id, 'uid': uid, 'output_file': md_file}
+                       for dynamic_id in set(LEGACY_ID_RE.findall(content)) - known_ids)
+
+        if records:
+            # 只补充尚未记录的 ID，不覆盖状态库里已有的更完整信息
+            with self._lock, self._conn:
+                existing = {row[0] for row in self._conn.execute("SELECT dynamic_id FROM dynamics")}
+            self.record_many([r for r in records if r['dynamic_id'] not in existing])
+        self.set_meta(meta_key, str(int(time.time())))
+        print(f"已从 {md_file} 导入 {len(records)} 个已处理的动态 ID 到状态库 {self.path}。")
+        return len(records)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _int_or_none(value):
+    try: return int(value) if value is not None else None
+    except (TypeError, ValueError): return None
+
+
+def _str_or_none(value):
+    return str(value) if value is not None else None
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_state_store():
+    """返回进程内共享的状态库，首次调用时以默认路径打开。"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = StateStore()
+        return _shared_store
+
+
+def configure_state_store(config):
+    """按 config.json 中的 STATE_DB 打开共享状态库。"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is not None:
+            _shared_store.close()
+        _shared_store = StateStore(config.get("STATE_DB", STATE_DB))
+        return _shared_store